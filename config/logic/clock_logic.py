@@ -1,7 +1,24 @@
 
 import asyncio
+import os
+import sys
 from datetime import datetime, timezone
 
+# The helpers shared by the logic scripts live in config/logic/logic_lib
+_LOGIC_DIR = os.path.dirname(os.path.abspath(__file__))
+if _LOGIC_DIR not in sys.path:
+    sys.path.append(_LOGIC_DIR)
+
+from logic_lib.script_log import ScriptLog
+
+# Console log level: 10=DEBUG, 20=INFO, 30=WARN, 40=ERROR. With profile mode
+# on, calls below the level are dropped at load instead of checked every frame.
+LOG_LEVEL: int = 20
+LOG_PROFILE_MODE: bool = False
+
+
+log = ScriptLog("clock_logic", level=LOG_LEVEL, profile=LOG_PROFILE_MODE)
+
 
 class Logic:
     def __init__(self):
@@ -56,8 +73,7 @@ class Logic:
         )
         # Example: 01101011111101100000010000000000
 
-        print("combined")
-        print(combined)
+        log.debug("combined %d", combined)
 
         self.vars.clock.utc3.packet = combined
         self.vars.clock.date3x.packet = 0x1046400d
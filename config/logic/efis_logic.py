@@ -1,7 +1,24 @@
 
 import asyncio
+import os
+import sys
 from datetime import datetime, timezone
 
+# The helpers shared by the logic scripts live in config/logic/logic_lib
+_LOGIC_DIR = os.path.dirname(os.path.abspath(__file__))
+if _LOGIC_DIR not in sys.path:
+    sys.path.append(_LOGIC_DIR)
+
+from logic_lib.script_log import ScriptLog
+
+# Console log level: 10=DEBUG, 20=INFO, 30=WARN, 40=ERROR. With profile mode
+# on, calls below the level are dropped at load instead of checked every frame.
+LOG_LEVEL: int = 20
+LOG_PROFILE_MODE: bool = False
+
+
+log = ScriptLog("efis_logic", level=LOG_LEVEL, profile=LOG_PROFILE_MODE)
+
 
 class Logic:
     def __init__(self):
@@ -14,19 +31,64 @@ class Logic:
 
         # Track last sent values to avoid unnecessary updates
         self._last_sent_values = {}
+
+        # The EFIS labels, looked up once here instead of on every update
+        self._buttons_273 = self.vars.EFIS.BUTTONS_273
+        self._buttons_274 = self.vars.EFIS.BUTTONS_274
+        self._buttons_275 = self.vars.EFIS.BUTTONS_275
+        self._range = self.vars.EFIS.RANGE
+
+        # The labels have "fresh" when the host monitors their arrival against
+        # timing_ms; without it they count as always fresh
+        self._monitored = hasattr(self._buttons_275, "fresh")
+        self._panel_alive = False
     
     def send_key_value(self, ref, value):
         # Only send the command if the value has changed
         if self._last_sent_values.get(ref) != value:
             self._last_sent_values[ref] = value
             getattr(self.datarefs.prosim, ref).value = value
-            print(f"Set value {ref} to: {value}")  # Debug output
+            log.debug("Set value %s to: %s", ref, value)
+
+    def panel_fresh(self):
+        return (self._buttons_273.fresh and self._buttons_274.fresh
+                and self._buttons_275.fresh and self._range.fresh)
+
+    def release_buttons(self):
+        # The last word of a dead panel may hold a press: release the push buttons
+        # and momentary switches. The mode, range and selectors keep their position.
+        self.send_key_value("S_MCP_EFIS1_BARO", 0)
+        self.send_key_value("S_MCP_EFIS1_MINIMUMS", 0)
+        self.send_key_value("S_MCP_EFIS1_WXR", 0)
+        self.send_key_value("S_MCP_EFIS1_STA", 0)
+        self.send_key_value("S_MCP_EFIS1_WPT", 0)
+        self.send_key_value("S_MCP_EFIS1_ARPT", 0)
+        self.send_key_value("S_MCP_EFIS1_DATA", 0)
+        self.send_key_value("S_MCP_EFIS1_POS", 0)
+        self.send_key_value("S_MCP_EFIS1_CTR", 0)
+        self.send_key_value("S_MCP_EFIS1_TERR", 0)
+        self.send_key_value("S_MCP_EFIS1_MINIMUMS_RESET", 0)
+        self.send_key_value("S_MCP_EFIS1_BARO_STD", 0)
+        self.send_key_value("S_MCP_EFIS1_TFC", 0)
+        self.send_key_value("S_MCP_EFIS1_FPV", 0)
+        self.send_key_value("S_MCP_EFIS1_MTRS", 0)
                                
     async def update(self):
-             
-       
 
-        match self.vars.EFIS.BUTTONS_275.value:
+        # The panel sends its labels every 100..200 ms: one not fresh means it stopped
+        if self._monitored and not self.panel_fresh():
+            if self._panel_alive:
+                self._panel_alive = False
+                log.warn("EFIS panel stopped sending (last word %.2f s ago), push buttons released",
+                         self._buttons_275.age or 0.0)
+                self.release_buttons()
+            await asyncio.sleep(0.01)
+            return
+        if not self._panel_alive:
+            self._panel_alive = True
+            log.info("EFIS panel sending")
+
+        match self._buttons_275.value:
             case 8192:
               self.send_key_value("S_MCP_EFIS1_MODE", 0)  
             case 16384:
@@ -37,46 +99,46 @@ class Logic:
               self.send_key_value("S_MCP_EFIS1_MODE", 3)  
 
         #EFIS 1 baro momentary [0:Center, 1:Up, 2:Down, 3:Up fast, 4:Down fast]
-        if self.vars.EFIS.BUTTONS_274.OFF:
+        if self._buttons_274.OFF:
             self.send_key_value("S_MCP_EFIS1_BARO", 0)
-        if self.vars.EFIS.BUTTONS_274.UP_SLOW:
+        if self._buttons_274.UP_SLOW:
             self.send_key_value("S_MCP_EFIS1_BARO", 1)
-        if self.vars.EFIS.BUTTONS_274.DOWN_SLOW:
+        if self._buttons_274.DOWN_SLOW:
             self.send_key_value("S_MCP_EFIS1_BARO", 2)
-        if self.vars.EFIS.BUTTONS_274.UP_FAST:
+        if self._buttons_274.UP_FAST:
             self.send_key_value("S_MCP_EFIS1_BARO", 3)
-        if self.vars.EFIS.BUTTONS_274.DOWN_FAST:
+        if self._buttons_274.DOWN_FAST:
             self.send_key_value("S_MCP_EFIS1_BARO", 4)
 
         #EFIS 1 minimums momentary [0:Center, 1:Up, 2:Down, 3:Up fast, 4:Down fast]
-        if self.vars.EFIS.BUTTONS_273.OFF:
+        if self._buttons_273.OFF:
             self.send_key_value("S_MCP_EFIS1_MINIMUMS", 0)
-        if self.vars.EFIS.BUTTONS_273.UP_SLOW:
+        if self._buttons_273.UP_SLOW:
             self.send_key_value("S_MCP_EFIS1_MINIMUMS", 1)
-        if self.vars.EFIS.BUTTONS_273.DOWN_SLOW:
+        if self._buttons_273.DOWN_SLOW:
             self.send_key_value("S_MCP_EFIS1_MINIMUMS", 2)
-        if self.vars.EFIS.BUTTONS_273.UP_FAST:
+        if self._buttons_273.UP_FAST:
             self.send_key_value("S_MCP_EFIS1_MINIMUMS", 3)
-        if self.vars.EFIS.BUTTONS_273.DOWN_FAST:
+        if self._buttons_273.DOWN_FAST:
             self.send_key_value("S_MCP_EFIS1_MINIMUMS", 4)
 
-        self.send_key_value("S_MCP_EFIS1_WXR", self.vars.EFIS.BUTTONS_275.WRX)
-        self.send_key_value("S_MCP_EFIS1_STA", self.vars.EFIS.BUTTONS_275.STA) 
-        self.send_key_value("S_MCP_EFIS1_WPT", self.vars.EFIS.BUTTONS_275.WPT)
-        self.send_key_value("S_MCP_EFIS1_ARPT", self.vars.EFIS.BUTTONS_275.ARPT) 
-        self.send_key_value("S_MCP_EFIS1_DATA", self.vars.EFIS.BUTTONS_275.DATA) 
-        self.send_key_value("S_MCP_EFIS1_POS", self.vars.EFIS.BUTTONS_275.POS) 
-        self.send_key_value("S_MCP_EFIS1_CTR", self.vars.EFIS.BUTTONS_275.CTR) 
-        self.send_key_value("S_MCP_EFIS1_TERR", self.vars.EFIS.BUTTONS_273.TERR)
-        self.send_key_value("S_MCP_EFIS1_MINIMUMS_RESET", self.vars.EFIS.BUTTONS_273.RST)
-        self.send_key_value("S_MCP_EFIS1_BARO_STD", self.vars.EFIS.BUTTONS_274.STD) 
-        self.send_key_value("S_MCP_EFIS1_TFC", self.vars.EFIS.BUTTONS_275.TFC)
-        self.send_key_value("S_MCP_EFIS1_FPV", self.vars.EFIS.BUTTONS_275.FPV)
-        self.send_key_value("S_MCP_EFIS1_MTRS", self.vars.EFIS.BUTTONS_275.MTRS)
-        self.send_key_value("S_MCP_EFIS1_BARO_MODE", self.vars.EFIS.BUTTONS_274.BARO_IN)
-        self.send_key_value("S_MCP_EFIS1_MINIMUMS_MODE", self.vars.EFIS.BUTTONS_273.MIN_BARO)
+        self.send_key_value("S_MCP_EFIS1_WXR", self._buttons_275.WRX)
+        self.send_key_value("S_MCP_EFIS1_STA", self._buttons_275.STA) 
+        self.send_key_value("S_MCP_EFIS1_WPT", self._buttons_275.WPT)
+        self.send_key_value("S_MCP_EFIS1_ARPT", self._buttons_275.ARPT) 
+        self.send_key_value("S_MCP_EFIS1_DATA", self._buttons_275.DATA) 
+        self.send_key_value("S_MCP_EFIS1_POS", self._buttons_275.POS) 
+        self.send_key_value("S_MCP_EFIS1_CTR", self._buttons_275.CTR) 
+        self.send_key_value("S_MCP_EFIS1_TERR", self._buttons_273.TERR)
+        self.send_key_value("S_MCP_EFIS1_MINIMUMS_RESET", self._buttons_273.RST)
+        self.send_key_value("S_MCP_EFIS1_BARO_STD", self._buttons_274.STD) 
+        self.send_key_value("S_MCP_EFIS1_TFC", self._buttons_275.TFC)
+        self.send_key_value("S_MCP_EFIS1_FPV", self._buttons_275.FPV)
+        self.send_key_value("S_MCP_EFIS1_MTRS", self._buttons_275.MTRS)
+        self.send_key_value("S_MCP_EFIS1_BARO_MODE", self._buttons_274.BARO_IN)
+        self.send_key_value("S_MCP_EFIS1_MINIMUMS_MODE", self._buttons_273.MIN_BARO)
             
-        # match self.vars.EFIS.RANGE.value:
+        # match self._range.value:
         #     case 8:
         #       self.send_key_value("S_MCP_EFIS1_RANGE", 0)  
         #     case 16:
@@ -94,53 +156,53 @@ class Logic:
         #     case 1024:    
         #       self.send_key_value("S_MCP_EFIS1_RANGE", 7)
 
-        if self.vars.EFIS.RANGE.five:
+        if self._range.five:
             self.send_key_value("S_MCP_EFIS1_RANGE", 0)
-        if self.vars.EFIS.RANGE.ten:
+        if self._range.ten:
             self.send_key_value("S_MCP_EFIS1_RANGE", 1)
-        if self.vars.EFIS.RANGE.twenty:
+        if self._range.twenty:
             self.send_key_value("S_MCP_EFIS1_RANGE", 2)
-        if self.vars.EFIS.RANGE.forty:
+        if self._range.forty:
             self.send_key_value("S_MCP_EFIS1_RANGE", 3)
-        if self.vars.EFIS.RANGE.eighty:
+        if self._range.eighty:
             self.send_key_value("S_MCP_EFIS1_RANGE", 4)
-        if self.vars.EFIS.RANGE.onesixty:
+        if self._range.onesixty:
             self.send_key_value("S_MCP_EFIS1_RANGE", 5)
-        if self.vars.EFIS.RANGE.threetwenty:
+        if self._range.threetwenty:
             self.send_key_value("S_MCP_EFIS1_RANGE", 6)
-        if self.vars.EFIS.RANGE.sixfourty:
+        if self._range.sixfourty:
             self.send_key_value("S_MCP_EFIS1_RANGE", 7)
 
         
-        if self.vars.EFIS.BUTTONS_273.MIN_RADIO:
+        if self._buttons_273.MIN_RADIO:
             self.send_key_value("S_MCP_EFIS1_MINIMUMS_MODE", 0)
 
-        if self.vars.EFIS.BUTTONS_273.MIN_BARO:
+        if self._buttons_273.MIN_BARO:
             self.send_key_value("S_MCP_EFIS1_MINIMUMS_MODE", 1)
 
-        if self.vars.EFIS.BUTTONS_274.BARO_IN:
+        if self._buttons_274.BARO_IN:
             self.send_key_value("S_MCP_EFIS1_BARO_MODE", 0)
 
-        if self.vars.EFIS.BUTTONS_274.BARO_HPA:
+        if self._buttons_274.BARO_HPA:
             self.send_key_value("S_MCP_EFIS1_BARO_MODE", 1)
 
         
-        if self.vars.EFIS.BUTTONS_273.VOR1_VOR:
+        if self._buttons_273.VOR1_VOR:
             self.send_key_value("S_MCP_EFIS1_SEL1", 1)
 
-        if self.vars.EFIS.BUTTONS_273.VOR1_ADF:
+        if self._buttons_273.VOR1_ADF:
             self.send_key_value("S_MCP_EFIS1_SEL1", 2)
 
-        if not self.vars.EFIS.BUTTONS_273.VOR1_VOR and not self.vars.EFIS.BUTTONS_273.VOR1_ADF:
+        if not self._buttons_273.VOR1_VOR and not self._buttons_273.VOR1_ADF:
             self.send_key_value("S_MCP_EFIS1_SEL1", 0)
 
-        if self.vars.EFIS.BUTTONS_274.VOR2_VOR:
+        if self._buttons_274.VOR2_VOR:
             self.send_key_value("S_MCP_EFIS1_SEL2", 1)
 
-        if self.vars.EFIS.BUTTONS_274.VOR2_ADF:
+        if self._buttons_274.VOR2_ADF:
             self.send_key_value("S_MCP_EFIS1_SEL2", 2)
 
-        if not self.vars.EFIS.BUTTONS_274.VOR2_VOR and not self.vars.EFIS.BUTTONS_274.VOR2_ADF:
+        if not self._buttons_274.VOR2_VOR and not self._buttons_274.VOR2_ADF:
             self.send_key_value("S_MCP_EFIS1_SEL2", 0)
 
         await asyncio.sleep(0.01)
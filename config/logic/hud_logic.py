@@ -47,16 +47,126 @@ v2.0.0
 - Fix hardcoded channel for display text
 """
 
+import array
 import asyncio
+import os
+import sys
 from enum import Enum
 from time import time
+from typing import Optional
 from resources.libs.arinc_lib.arinc_lib import ArincLabel
 
+# The helpers shared by the logic scripts live in config/logic/logic_lib
+_LOGIC_DIR = os.path.dirname(os.path.abspath(__file__))
+if _LOGIC_DIR not in sys.path:
+    sys.path.append(_LOGIC_DIR)
+
+from logic_lib.dataref_watch import DatarefWatch
+from logic_lib.glyph_table import GlyphTable
+from logic_lib.script_log import ScriptLog
+from logic_lib.tx_queue import PRIORITY_CONTROL, PRIORITY_DATA, TxQueue
+
 # Setup Definitions
 ARINC_CARD_NAME: str = "arinc_1"
 ARINC_CARD_TX_CHNL: int = 1
 ARINC_CARD_RX_CHNL: int = 1
 
+# TX queue (see TxQueue): words queued per channel and bus time handed to the
+# card per pump (a bit more than the 50 ms loop, so the bus never idles
+# between pumps)
+TX_QUEUE_WORDS: int = 256
+TX_LOOKAHEAD_SEC: float = 0.06
+
+# Console log level: 10=DEBUG, 20=INFO, 30=WARN, 40=ERROR. With profile mode
+# on, calls below the level are dropped at load instead of checked every frame.
+LOG_LEVEL: int = 20
+LOG_PROFILE_MODE: bool = False
+
+
+log = ScriptLog("hud_logic", level=LOG_LEVEL, profile=LOG_PROFILE_MODE)
+
+
+def _hgs_cp_glyph(code_point: int) -> int:
+    return chr(code_point).encode("iso-8859-5", errors="replace")[0]
+
+
+# HGS control panel character set, ISO-8859-5 based
+HGS_CP_BLINK: int = 0x80
+HGS_CP_GLYPHS = GlyphTable(
+    {
+        **{ord(bytes([b]).decode("iso-8859-5")): b for b in range(256)},
+        ord("\xb0"): 8,  # Degree symbol
+        ord("*"): 8,  # ProSim sends the degree symbol as "*"
+        ord("_"): ord("_") | HGS_CP_BLINK,  # Blinking cursor
+    },
+    _hgs_cp_glyph,
+)
+
+
+class RxLabelTable:
+    """Latest received word of every label and SDI.
+
+    Fixed arrays of 256 labels x 4 SDIs, slot ``label * 4 + sdi``, hold the
+    raw word, its driver timestamp and how many words the slot received.
+    Storing a word only writes array slots: no dict or tuple is built per
+    received word, and reading a label is one index. Labels are the label
+    byte as ``ArincLabel.Base.unpack_dec`` returns it (0o300 for the keypad).
+    """
+
+    LABELS: int = 256
+    SDIS: int = 4
+
+    def __init__(self):
+        slots = self.LABELS * self.SDIS
+        self.words = array.array("L", [0]) * slots
+        self.timestamps = array.array("d", [0.0]) * slots
+        self.counts = array.array("L", [0]) * slots
+        # label -> SDI of its newest word
+        self._newest_sdi = bytearray(self.LABELS)
+
+    def clear(self):
+        """Forgets all received words. The arrays are cleared in place."""
+        for column in (self.words, self.timestamps, self.counts):
+            column[:] = array.array(column.typecode, [0]) * len(column)
+        self._newest_sdi[:] = bytes(self.LABELS)
+
+    def put(self, word: int, timestamp: float):
+        """Stores a received word, as popped from the driver RX queue."""
+        label = word & 0xFF
+        sdi = (word >> 8) & 0x3
+        slot = label << 2 | sdi
+        self.words[slot] = word
+        self.timestamps[slot] = timestamp
+        self.counts[slot] += 1
+        self._newest_sdi[label] = sdi
+
+    def _slot(self, label: int, sdi: Optional[int]) -> int:
+        return label << 2 | (self._newest_sdi[label] if sdi is None else sdi)
+
+    def latest(self, label: int, sdi: int = None) -> Optional[int]:
+        """Newest raw word of a label, None if never received.
+
+        Args:
+            label (int): label byte, e.g. 0o300
+            sdi (int): SDI to read. None reads the newest word whatever its SDI
+        """
+        slot = self._slot(label, sdi)
+        return self.words[slot] if self.counts[slot] else None
+
+    def timestamp(self, label: int, sdi: int = None) -> Optional[float]:
+        """Driver timestamp of the newest word of a label, None if never received."""
+        slot = self._slot(label, sdi)
+        return self.timestamps[slot] if self.counts[slot] else None
+
+    def count(self, label: int, sdi: int = None) -> int:
+        """Number of words received for a label and SDI."""
+        return self.counts[self._slot(label, sdi)]
+
+    def labels(self) -> list:
+        """Label numbers received at least once."""
+        counts = self.counts
+        return [label for label in range(self.LABELS) if any(counts[label << 2:(label + 1) << 2])]
+
 
 class HUD:
     """_summary_
@@ -192,22 +302,13 @@ class HUD:
         def write_str(self, row: int, column: int, text: str):
             col = column
 
-            # Replace the degrees symbol with *
-            text = text.replace('\xb0', '*')
-
-            # Encode the text in ISO-8859-5
-            for char in text.encode("iso-8859-5"):
+            # Degree symbol, blinking "_" and ISO-8859-5 in one pass, see HGS_CP_GLYPHS
+            for char in text.translate(HGS_CP_GLYPHS).encode("latin-1"):
                 if col >= HUD.Display.DISP_COL:
                     break
 
-                if char == 95:    # ISO-8859-5 encoding for "_"
-                    char |= 0x80  # Add the blink operarion
-
-                if char == 42:  # ISO-8859-5 encoding for "*"
-                   char = 8     # Replace with degree symbol
-
                 # Write the modified character to the buffer
-                self._buffer[row][col].value = int(char)
+                self._buffer[row][col].value = char
                 col += 1
 
     class IndicatorEnum(Enum):
@@ -268,21 +369,31 @@ class HUD:
         self._rx_chnl = rx_chnl_number
         self._debug = debug
 
+        # Latest received word per label and SDI. Logic can read it with rx.latest(label)
+        self.rx = RxLabelTable()
+
+        # Display lines already written. Cleared with the display, so a reset panel gets every line again
+        self.text_watch = DatarefWatch()
+
         # Initialize or reset class variables
         self._reset()
 
         # Get reference to receiving queue. This is to make things faster
         self._rx_queue = self._device._rx_chnl[self._rx_chnl]._label_queue
 
+        # Words waiting for the bus. Counters are in tx.counters()
+        self.tx = TxQueue(self._device, TX_QUEUE_WORDS, TX_LOOKAHEAD_SEC, log=log)
+
     def _reset(self):
         """Initialize or reset internal class variables. This method
         is intended to be use internally to this class in synchronous
         manner.
         """
         self._display = self.Display()
+        self.text_watch.clear()
 
-        # Container for the holding the parsed received labels
-        self._rx_label = {}
+        # Latest received word per label and SDI
+        self.rx.clear()
 
         # Label timeout. This is to detect that the panel has stop
         # sending labels, in which case we should reset buttons bitmap.
@@ -334,14 +445,17 @@ class HUD:
         self._tx_buffer.append((self._tx_chnl, label))
 
     def _update_panel(self):
-        """Update panel sending the TX buffer"""
-        self._tx_buffer += self._display.get_labels()
-        try:
-            self._device.send_manual_list_fast(self._tx_buffer)
-        except Exception:
-            self._reset()
-        else:
-            self._tx_buffer = []
+        """Update panel queuing the TX buffer and sending what the bus can take.
+
+        Words are keyed by label and SDI, so a newer value replaces one still
+        waiting in the queue. Control labels go before the display labels.
+        """
+        for chnl, label in self._tx_buffer:
+            self.tx.put(chnl, [label], PRIORITY_CONTROL, key=label & 0x3FF)
+        for chnl, label in self._display.get_labels():
+            self.tx.put(chnl, [label], PRIORITY_DATA, key=label & 0x3FF)
+        self._tx_buffer = []
+        self.tx.pump()
 
     def _brightness_label(self, brightness: int) -> int:
         """Create brightness label
@@ -423,40 +537,23 @@ class HUD:
                     # No element in the queue... then skip
                     break
                 else:
-                    p, ssm, data, sdi, label_id = ArincLabel.Base.unpack_dec(label)
-                    if label_id in self._rx_label:
-                        self._rx_label[label_id]["ssm"] = ssm
-                        self._rx_label[label_id]["sdi"] = sdi
-                        self._rx_label[label_id]["data"] = data
-                        self._rx_label[label_id]["raw"] = label
-                    else:
-                        self._rx_label[label_id] = {
-                            "ssm": ssm,
-                            "sdi": sdi,
-                            "data": data,
-                            "raw": label,
-                        }
+                    self.rx.put(label, timestamp)
                     self._timestamp_prev = time()
                     self._panel_is_alive = True
 
             if self._debug:
                 # Print table of received labels
-                for label_id, obj in self._rx_label.items():
-                    # print(f'[{oct(label_id)}] {obj["data"]:8X} ssm: {obj["ssm"]} sdi: {obj["sdi"]}')
-                    print(
-                        f'[{oct(label_id)}]({label_id}) {(obj["raw"] & 0x7FFFFF00):8X}'
-                    )
-                print("")
+                for label_id in self.rx.labels():
+                    log.debug("[%o](%d) %8X", label_id, label_id, self.rx.latest(label_id) & 0x7FFFFF00)
 
             # Clean variables if timeout occurred
             if (time() - self._timestamp_prev) > self.RX_CHNL_TIMEOUT:
                 self._reset()
 
             # Process keypad inputs
-            if 192 in self._rx_label:
-                self._buttons_bitmap = (
-                    self._rx_label[192]["raw"] & self.ButtonEnum.ALL_KEYS.value
-                )
+            keypad = self.rx.latest(0o300)
+            if keypad is not None:
+                self._buttons_bitmap = keypad & self.ButtonEnum.ALL_KEYS.value
                 self._handle_keypad_dimmer(self._buttons_bitmap)
 
             # NOTE: Keep this commented code as reference. If blinking needs to
@@ -500,6 +597,19 @@ class Logic:
             tx_chnl_number=ARINC_CARD_TX_CHNL,
             rx_chnl_number=ARINC_CARD_RX_CHNL,
         )
+
+    def hot_reload_state(self) -> dict:
+        """State handed to the new instance when the script is hot reloaded."""
+        # By name: the reloaded module has its own ButtonEnum class
+        return {
+            "brightness": self.hud._brightness,
+            "key_states": {button.name: pressed for button, pressed in self.key_states.items()},
+        }
+
+    def hot_reload_restore(self, state: dict):
+        self.hud._brightness = state["brightness"]
+        self.key_states = {HUD.ButtonEnum[name]: pressed for name, pressed in state["key_states"].items()}
+
     def check_key(self, button: HUD.ButtonEnum, ref: str):
         # Ensure each key has its state initialized
         if button not in self.key_states:
@@ -517,7 +627,7 @@ class Logic:
     def send_key_value(self, ref, value):
         # Send the command to prosim
         getattr(self.datarefs.prosim, ref).value = value
-        print(f"Set value {ref} to: {value}")  # Debug output
+        log.debug("Set value %s to: %s", ref, value)
 
     async def update(self):
         # Update HUD
@@ -527,11 +637,17 @@ class Logic:
 
         # Prosim Mapping
 
-        #Text
-        self.hud.set_text(0, self.datarefs.prosim.hgscp_display_line1.value)
-        self.hud.set_text(1, self.datarefs.prosim.hgscp_display_line2.value)
-        self.hud.set_text(2, self.datarefs.prosim.hgscp_display_line3.value)
-        self.hud.set_text(3, self.datarefs.prosim.hgscp_display_line4.value)
+        #Text, only the lines that changed
+        prosim = self.datarefs.prosim
+        display_lines = (
+            prosim.hgscp_display_line1,
+            prosim.hgscp_display_line2,
+            prosim.hgscp_display_line3,
+            prosim.hgscp_display_line4,
+        )
+        for line_number, ref in enumerate(display_lines):
+            if self.hud.text_watch.changed(line_number, ref):
+                self.hud.set_text(line_number, ref.value)
         
         # test_is_pressed = self.hud.get_button(HUD.ButtonEnum.TEST)
         # self.hud.set_indicator(HUD.IndicatorEnum.LED_TEST, test_is_pressed)
@@ -0,0 +1,7 @@
+"""Helpers shared by the logic scripts in config/logic.
+
+The scripts put their own directory on ``sys.path`` and import from here,
+so every script runs the same implementation. Only plain Python lives in
+this package: no script loads it as a logic, and it imports nothing from
+the application.
+"""
@@ -0,0 +1,31 @@
+"""Change detection for datarefs read by the logic scripts"""
+
+# Marks a key not seen yet, so a first value of None still counts as a change
+_UNSET = object()
+
+
+class DatarefWatch:
+    """Tells whether datarefs changed since the script last looked at them.
+
+    Uses the change sequence number ``seq`` of a dataref when the sim layer
+    keeps one, so a long value such as the cdu1 XML is not compared on every
+    update. Otherwise the value itself is compared, identity first.
+    """
+
+    def __init__(self):
+        # key -> seq or value seen last
+        self._seen = {}
+
+    def changed(self, key, ref) -> bool:
+        """True if ``ref`` changed since the last call with the same ``key``, and on the first call."""
+        seq = getattr(ref, "seq", None)
+        mark = ref.value if seq is None else seq
+        prev = self._seen.get(key, _UNSET)
+        if mark is prev or mark == prev:
+            return False
+        self._seen[key] = mark
+        return True
+
+    def clear(self):
+        """Forgets everything seen, so the next ``changed()`` of every key is True."""
+        self._seen.clear()
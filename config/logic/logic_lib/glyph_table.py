@@ -0,0 +1,23 @@
+"""Code point -> glyph mapping for ``str.translate``"""
+
+from typing import Callable
+
+
+class GlyphTable(dict):
+    """Code point -> glyph mapping for ``str.translate``.
+
+    Built once when the script loads, so a display line, screen or record
+    converts in one C-level ``translate`` call instead of a Python branch per
+    character. The values are what ``str.translate`` accepts: a code point, a
+    string, or None to drop the character. Code points missing from the table
+    are passed to ``fallback`` the first time they are seen and the result is
+    cached.
+    """
+
+    def __init__(self, entries: dict, fallback: Callable[[int], object]):
+        super().__init__(entries)
+        self._fallback = fallback
+
+    def __missing__(self, code_point: int):
+        glyph = self[code_point] = self._fallback(code_point)
+        return glyph
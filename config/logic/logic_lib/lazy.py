@@ -0,0 +1,30 @@
+"""Lazy module imports for logic scripts"""
+
+import importlib.util
+import sys
+import types
+
+
+def lazy_import(name: str) -> types.ModuleType:
+    """Returns module ``name``, executed on its first attribute access instead of now.
+
+    For heavy modules a script only needs once it runs, e.g.
+    ``ET = lazy_import("xml.etree.ElementTree")`` for a parser used on the
+    first page: loading the script then costs only the lookup of the module.
+    A module already imported is returned as it is, and a module that does
+    not exist raises ``ModuleNotFoundError`` here, not at first use. Names
+    taken from the module at import time (``from x import y``) cannot be
+    lazy; use the module attribute instead.
+    """
+    module = sys.modules.get(name)
+    if module is not None:
+        return module
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        raise ModuleNotFoundError(f"No module named {name!r}", name=name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
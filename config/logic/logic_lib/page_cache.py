@@ -0,0 +1,51 @@
+"""Bounded LRU cache of rendered MCDU pages"""
+
+import collections
+import hashlib
+
+
+class PageCache:
+    """Bounded LRU cache of rendered pages, keyed by a hash of the raw page XML.
+
+    ProSim flips between a few pages (LEGS, RTE, PROG, INIT REF); a page seen
+    recently is served from here without parsing and rendering it again. The
+    least recently used pages are dropped when there are more than
+    ``max_entries`` or their estimated size exceeds ``max_bytes``.
+    """
+
+    def __init__(self, max_entries: int, max_bytes: int):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        # key -> (value, size)
+        self._pages = collections.OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(page: str) -> bytes:
+        return hashlib.blake2b(page.encode("utf-8"), digest_size=16).digest()
+
+    def __len__(self) -> int:
+        return len(self._pages)
+
+    def get(self, key: bytes):
+        entry = self._pages.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self._pages.move_to_end(key)
+        self.hits += 1
+        return entry[0]
+
+    def put(self, key: bytes, value, size: int):
+        old = self._pages.pop(key, None)
+        if old is not None:
+            self.bytes -= old[1]
+        if size > self.max_bytes:
+            return
+        self._pages[key] = (value, size)
+        self.bytes += size
+        while len(self._pages) > self.max_entries or self.bytes > self.max_bytes:
+            _, (_, dropped) = self._pages.popitem(last=False)
+            self.bytes -= dropped
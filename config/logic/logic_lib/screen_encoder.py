@@ -0,0 +1,151 @@
+"""Minimum-word text block encoding of GE MCDU screens"""
+
+from logic_lib.glyph_table import GlyphTable
+
+
+def _ge_mcdu_glyph(code_point: int) -> int:
+    return chr(code_point).encode("iso-8859-5", errors="replace")[0] & 0x7F
+
+
+# GE MCDU character set: 7 bit glyphs, ISO-8859-5 based. "Ф"/"Ю" switch
+# inverted text on/off and translate to the markers below, outside the glyph range.
+# The empty box is glyph 64: the char field is 7 bits wide, so 0xD1 cannot be sent.
+GE_MCDU_INVERSE_ON: int = 0x80
+GE_MCDU_INVERSE_OFF: int = 0x81
+GE_MCDU_GLYPHS = GlyphTable(
+    {
+        **{ord(bytes([b]).decode("iso-8859-5")): b & 0x7F for b in range(256)},
+        ord("#"): 64,  # Empty box
+        ord("`"): 36,  # ProSim degrees symbol
+        ord("Ф"): GE_MCDU_INVERSE_ON,
+        ord("Ю"): GE_MCDU_INVERSE_OFF,
+        # Small-font digits travel through the parser as Cyrillic А..Й
+        **{ord(c): 16 + n for n, c in enumerate("АБВГДЕЖЗИЙ")},
+    },
+    _ge_mcdu_glyph,
+)
+
+# Text block words: the offset header holds the run length in 9 bits, enough
+# for a run over the whole 336-cell screen; glyphs are 7 bits, controls 9 bits
+RUN_LENGTH_MASK: int = 0x1FF
+GLYPH_MASK: int = 0x7F
+CONTROL_MASK: int = 0x1FF
+
+
+class ScreenEncoder:
+    """Minimum-word encoding of a screen into text blocks.
+
+    A text block is an offset header holding a run length, a fill header
+    holding the glyph and control of that run, then one word per literal
+    character, so it costs 2 + len(literal) words. ``encode`` splits the
+    screen cells into the blocks with the fewest words in total, using a
+    linear-time dynamic program over the runs of identical cells.
+
+    ``screen_words()`` counts the screens and words it encoded and the words
+    saved against one literal block per row in ``screens``, ``words`` and
+    ``words_saved``; ``counters()`` returns them.
+
+    Args:
+        columns (int): cells per row
+        rows (int): rows encoded; cells past them are dropped
+    """
+
+    def __init__(self, columns: int, rows: int):
+        self.columns = columns
+        self.rows = rows
+        self.screens = 0
+        self.words = 0
+        self.words_saved = 0
+
+    @staticmethod
+    def cells(text: str, columns: int) -> list:
+        """Converts screen text into (glyph, control) cells. "Ф"/"Ю" switch inverted
+        text on/off without taking a cell; the control resets at every row start."""
+        codes = text.translate(GE_MCDU_GLYPHS).encode("latin-1")
+        if GE_MCDU_INVERSE_ON not in codes and GE_MCDU_INVERSE_OFF not in codes:
+            return [(g, 0) for g in codes]
+        out = []
+        control = 0
+        for g in codes:
+            if g == GE_MCDU_INVERSE_ON:
+                control = 1
+            elif g == GE_MCDU_INVERSE_OFF:
+                control = 0
+            else:
+                out.append((g, control))
+                if len(out) % columns == 0:
+                    control = 0
+        return out
+
+    @staticmethod
+    def encode(cells: list) -> list:
+        """Returns the cheapest block list as (run_length, fill_cell, literal_cells) tuples.
+
+        A block starting at cell i and ending before cell j costs 2 words while j
+        is inside the run of identical cells holding i, and one more per cell past
+        the end e of that run. best[j] is the minimum over the current run of
+        best[i] + 2 and over the closed runs of best[i] - e + 2 + j.
+        """
+        n = len(cells)
+        if n == 0:
+            return []
+        run_end = [n] * n
+        for i in range(n - 2, -1, -1):
+            run_end[i] = i + 1 if cells[i] != cells[i + 1] else run_end[i + 1]
+
+        inf = 1 << 30
+        best = [0] + [inf] * n
+        back = [0] * (n + 1)
+        run_min, run_arg = inf, 0     # min best[i] over the current run
+        pool_min, pool_arg = inf, 0   # min best[i] - run_end[i] over closed runs
+        for j in range(1, n + 1):
+            i = j - 1
+            if i > 0 and cells[i] != cells[i - 1]:
+                if run_min - i < pool_min:
+                    pool_min, pool_arg = run_min - i, run_arg
+                run_min = inf
+            if best[i] < run_min:
+                run_min, run_arg = best[i], i
+            if run_min + 2 <= pool_min + 2 + j:
+                best[j], back[j] = run_min + 2, run_arg
+            else:
+                best[j], back[j] = pool_min + 2 + j, pool_arg
+
+        blocks = []
+        j = n
+        while j > 0:
+            i = back[j]
+            k = min(run_end[i], j) - i
+            blocks.append((k, cells[i], cells[i + k:j]))
+            j = i
+        blocks.reverse()
+        return blocks
+
+    @staticmethod
+    def word_count(blocks: list) -> int:
+        return sum(2 + len(literal) for _, _, literal in blocks)
+
+    @staticmethod
+    def block_words(blocks: list, sal: int) -> list:
+        """The text block words of ``blocks`` for the panel at ``sal``, without parity."""
+        words = []
+        for run_length, (glyph, control), literal in blocks:
+            # Offset header with the run length, then the fill header with the fill cell
+            words.append(sal | 0x400 | ((run_length & RUN_LENGTH_MASK) << 13))
+            words.append(sal | 0x400 | ((glyph & GLYPH_MASK) << 13) | ((control & CONTROL_MASK) << 20))
+            words += [sal | 0x300 | ((g & GLYPH_MASK) << 13) | ((c & CONTROL_MASK) << 20) for g, c in literal]
+        return words
+
+    def screen_words(self, text: str, sal: int) -> list:
+        """Encodes a whole screen into the fewest text block words, without parity."""
+        cells = self.cells(text, self.columns)[:self.columns * self.rows]
+        words = self.block_words(self.encode(cells), sal)
+        # Baseline: one literal block per row
+        baseline = (len(cells) + self.columns - 1) // self.columns * (self.columns + 2)
+        self.screens += 1
+        self.words += len(words)
+        self.words_saved += baseline - len(words)
+        return words
+
+    def counters(self) -> dict:
+        return {"screens": self.screens, "words": self.words, "words_saved": self.words_saved}
@@ -0,0 +1,123 @@
+"""Leveled, rate-limited background logger for logic scripts"""
+
+import collections
+import sys
+import threading
+import time
+
+
+class ScriptLog:
+    """Leveled, rate-limited logger for logic scripts.
+
+    Calls only append the level, message and arguments to a deque; the text is
+    formatted and printed by a background thread, so console I/O never runs
+    on the event loop. The writer sleeps until an entry arrives. Each call
+    site is limited to one line per ``rate_limit_sec``; suppressed calls are
+    counted and reported with the next line from that site. Errors are never
+    rate-limited. At most ``capacity`` entries wait for the writer; the ones
+    beyond are dropped, counted in ``dropped`` and reported by the writer.
+    With ``profile=True`` the methods for disabled levels are replaced by a
+    no-op when the script loads. ``close()`` prints what is queued and stops
+    the writer.
+    """
+
+    DEBUG: int = 10
+    INFO: int = 20
+    WARN: int = 30
+    ERROR: int = 40
+    _NAMES = {10: "DEBUG", 20: "INFO", 30: "WARN", 40: "ERROR"}
+
+    def __init__(self, name: str, level: int = INFO, rate_limit_sec: float = 1.0, profile: bool = False,
+                 capacity: int = 4096):
+        self._name = name
+        self._level = level
+        self._rate_limit_sec = rate_limit_sec
+        self._capacity = capacity
+        # deque append/popleft are atomic, no lock needed between loop and writer
+        self._queue = collections.deque()
+        # Set after an append, cleared by the writer before it drains the queue
+        self._wake = threading.Event()
+        self._closed = False
+        # call site -> [last emit time, suppressed count]
+        self._sites = {}
+        self.dropped = 0
+        self._writer = threading.Thread(target=self._write_loop, name=f"log-{name}", daemon=True)
+        self._writer.start()
+        if profile:
+            for lvl, method in ((self.DEBUG, "debug"), (self.INFO, "info"), (self.WARN, "warn"), (self.ERROR, "error")):
+                if lvl < level:
+                    setattr(self, method, self._noop)
+
+    @staticmethod
+    def _noop(*args, **kwargs):
+        pass
+
+    def _emit(self, level: int, msg: str, args: tuple):
+        if level < self._level:
+            return
+        suppressed = 0
+        if level < self.ERROR:
+            frame = sys._getframe(2)
+            site = (frame.f_code, frame.f_lineno)
+            now = time.monotonic()
+            state = self._sites.get(site)
+            if state is None:
+                self._sites[site] = [now, 0]
+            elif now - state[0] < self._rate_limit_sec:
+                state[1] += 1
+                return
+            else:
+                suppressed = state[1]
+                state[0] = now
+                state[1] = 0
+        if self._closed or len(self._queue) >= self._capacity:
+            self.dropped += 1
+            return
+        self._queue.append((level, msg, args, suppressed))
+        # Append first: an entry added after the writer cleared the event always sets it again
+        if not self._wake.is_set():
+            self._wake.set()
+
+    def _write_loop(self):
+        reported = 0
+        while True:
+            self._wake.wait()
+            self._wake.clear()
+            while True:
+                try:
+                    level, msg, args, suppressed = self._queue.popleft()
+                except IndexError:
+                    break
+                try:
+                    text = msg % args if args else msg
+                except Exception as e:
+                    text = f"{msg} {args} (format error: {e})"
+                if suppressed:
+                    text += f" (+{suppressed} suppressed)"
+                print(f"[{self._name}] {self._NAMES.get(level, level)}: {text}")
+            if self.dropped != reported:
+                print(f"[{self._name}] WARN: {self.dropped - reported} log entries dropped, queue full")
+                reported = self.dropped
+            if self._closed:
+                return
+
+    def close(self, timeout: float = 1.0):
+        """Prints the queued entries and stops the writer. Later calls are dropped."""
+        if self._closed:
+            return
+        self._closed = True
+        self._wake.set()
+        if self._writer is not threading.current_thread():
+            self._writer.join(timeout)
+
+    def debug(self, msg: str, *args):
+        self._emit(self.DEBUG, msg, args)
+
+    def info(self, msg: str, *args):
+        self._emit(self.INFO, msg, args)
+
+    def warn(self, msg: str, *args):
+        self._emit(self.WARN, msg, args)
+
+    def error(self, msg: str, *args):
+        self._emit(self.ERROR, msg, args)
@@ -0,0 +1,129 @@
+"""Bounded per-channel TX queue between a logic script and the card driver"""
+
+import asyncio
+import collections
+from typing import Optional
+
+from logic_lib.script_log import ScriptLog
+
+# Time of one word on the 12.5 kHz bus
+ARINC_TX_WORD_SEC: float = 36 / 12500
+
+# TX priorities, lower is sent first
+PRIORITY_CONTROL: int = 0
+PRIORITY_DATA: int = 1
+
+
+class TxQueue:
+    """Bounded per-channel TX queue in front of the card driver.
+
+    Word buffers are queued per channel with a priority (lower is sent first)
+    and handed to the card by ``pump()``, only ``lookahead_sec`` of bus time
+    at a time, so the card FIFO is never overrun. A buffer queued with the
+    ``key`` of one still waiting replaces it in place: only the newest value
+    of a label goes out. A channel holds at most ``max_words``; ``put()``
+    drops a buffer that does not fit and returns False, and ``drain()``
+    waits until the queue is empty. When the driver raises, the words stay
+    queued for the next pump.
+
+    Counters, in words: ``sent``, ``replaced`` and ``dropped``, plus
+    ``send_errors`` driver calls that raised. Failed sends are reported to
+    ``log`` when one is given.
+    """
+
+    def __init__(
+        self,
+        device: object,
+        max_words: int,
+        lookahead_sec: float,
+        word_sec: float = ARINC_TX_WORD_SEC,
+        log: Optional[ScriptLog] = None,
+    ):
+        self._device = device
+        self._log = log
+        self.max_words = max_words
+        self.lookahead_sec = lookahead_sec
+        self.word_sec = word_sec
+        # channel -> {priority: OrderedDict(key -> words)}
+        self._queues = {}
+        # channel -> words queued
+        self._levels = collections.Counter()
+        # channel -> loop time the words handed to the card are off the wire
+        self._busy_until = {}
+        self.sent = 0
+        self.replaced = 0
+        self.dropped = 0
+        self.send_errors = 0
+
+    def level(self, chnl: int = None) -> int:
+        """Words queued on a channel, or on all channels."""
+        return sum(self._levels.values()) if chnl is None else self._levels[chnl]
+
+    def put(self, chnl: int, words: list, priority: int = PRIORITY_DATA, key=None) -> bool:
+        """Queues a buffer of words for a channel. Returns False if it was dropped because the queue is full."""
+        queues = self._queues.setdefault(chnl, {})
+        if key is not None:
+            for entries in queues.values():
+                old = entries.get(key)
+                if old is not None:
+                    entries[key] = words
+                    self.replaced += len(old)
+                    self._levels[chnl] += len(words) - len(old)
+                    return True
+        else:
+            key = object()
+        if self._levels[chnl] + len(words) > self.max_words:
+            self.dropped += len(words)
+            return False
+        queues.setdefault(priority, collections.OrderedDict())[key] = words
+        self._levels[chnl] += len(words)
+        return True
+
+    def pump(self):
+        """Hands queued words to the card until ``lookahead_sec`` of bus time is outstanding per channel."""
+        now = asyncio.get_event_loop().time()
+        batch = []
+        taken = []
+        for chnl, queues in self._queues.items():
+            busy_until = max(self._busy_until.get(chnl, 0.0), now)
+            for priority in sorted(queues):
+                entries = queues[priority]
+                while entries and busy_until - now < self.lookahead_sec:
+                    key, words = entries.popitem(last=False)
+                    taken.append((chnl, priority, key, words))
+                    batch += [(chnl, word) for word in words]
+                    busy_until += len(words) * self.word_sec
+            self._busy_until[chnl] = busy_until
+        if not batch:
+            return
+        try:
+            self._device.send_manual_list_fast(batch)
+        except Exception as e:
+            # Back to the head of the queue, in order, for the next pump
+            self.send_errors += 1
+            for chnl, priority, key, words in reversed(taken):
+                entries = self._queues[chnl][priority]
+                entries[key] = words
+                entries.move_to_end(key, last=False)
+                self._busy_until[chnl] = now
+            if self._log is not None:
+                self._log.warn("TX of %d words failed, kept queued: %s", len(batch), e)
+        else:
+            self.sent += len(batch)
+            for chnl, _, _, words in taken:
+                self._levels[chnl] -= len(words)
+
+    async def drain(self, chnl: int = None):
+        """Waits until the channel, or all channels, has no queued words. Pumps the queue meanwhile."""
+        while self.level(chnl):
+            self.pump()
+            await asyncio.sleep(self.lookahead_sec / 2)
+
+    def counters(self) -> dict:
+        return {
+            "queued": self.level(),
+            "sent": self.sent,
+            "replaced": self.replaced,
+            "dropped": self.dropped,
+            "send_errors": self.send_errors,
+        }
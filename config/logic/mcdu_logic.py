@@ -1,17 +1,39 @@
 ﻿import asyncio
+import os
+import sys
 import time
-import xml.etree.ElementTree as ET
 import re
 import queue
 from enum import Enum
 from typing import Callable
 from resources.libs.arinc_lib.arinc_lib import ArincLabel
 
+# The helpers shared by the logic scripts live in config/logic/logic_lib
+_LOGIC_DIR = os.path.dirname(os.path.abspath(__file__))
+if _LOGIC_DIR not in sys.path:
+    sys.path.append(_LOGIC_DIR)
+
+from logic_lib.lazy import lazy_import
+from logic_lib.screen_encoder import ScreenEncoder
+from logic_lib.script_log import ScriptLog
+
+# Parser of the cdu1 XML, loaded with the first page
+ET = lazy_import("xml.etree.ElementTree")
+
 # Setup Definitions
 ARINC_CARD_NAME: str = "arinc_1"
 ARINC_CARD_TX_CHNL: int = 3
 ARINC_CARD_RX_CHNL: int = 3
 
+# Console log level: 10=DEBUG, 20=INFO, 30=WARN, 40=ERROR. With profile mode
+# on, calls below the level are dropped at load instead of checked every frame.
+LOG_LEVEL: int = 20
+LOG_PROFILE_MODE: bool = False
+
+
+log = ScriptLog("mcdu_logic", level=LOG_LEVEL, profile=LOG_PROFILE_MODE)
+
+
 class MCDU:
     COLUMNS: int = 24
     ROWS: int = 14
@@ -25,45 +47,6 @@ class MCDU:
         OFFSET = 0x10000
         EXEC   = 0x20000
 
-    class StringSplitter:
-        GROUP_N: int = 2
-
-        @staticmethod
-        def _append(lst: list, text: str, rep_char: bool, position: int):
-            lst.append({"text": text, "rep_char": rep_char, "position": position})
-
-        @staticmethod
-        def split(text: str) -> list:
-            output = []
-            text_serializer = ""
-            rep_text_serializer = ""
-            char_position = -1
-            for i in range(1, len(text)):
-                if text[i] != text[i-1]:
-                    if len(rep_text_serializer) < MCDU.StringSplitter.GROUP_N:
-                        text_serializer += rep_text_serializer + text[i-1]
-                        if char_position < 0:
-                            char_position = i-1
-                    else:
-                        if rep_text_serializer[-1] == text[i-1]:
-                            rep_text_serializer += text[i-1]
-                        MCDU.StringSplitter._append(output, rep_text_serializer, True, char_position)
-                        char_position = -1
-                    rep_text_serializer = ""
-                else:
-                    rep_text_serializer += text[i-1]
-                    if char_position < 0:
-                        char_position = i-1
-                    if len(text_serializer) > MCDU.StringSplitter.GROUP_N:
-                        MCDU.StringSplitter._append(output, text_serializer, False, char_position)
-                        text_serializer = ""
-                        char_position = -1
-            if len(text_serializer) > 0:
-                MCDU.StringSplitter._append(output, text_serializer + text[-1], False, char_position)
-            elif len(rep_text_serializer) > 0:
-                MCDU.StringSplitter._append(output, rep_text_serializer + text[-1], True, char_position)
-            return output
-
     def __init__(
         self, arinc_device: object, 
                  tx_chnl_number: int, 
@@ -84,6 +67,8 @@ class MCDU:
         self._light_bitmap = 0
         self._scratchpad_text = ""
         self._key_queue = queue.Queue()  # For key press handling
+        # Text block encoder, counting the words saved since start
+        self.encoder = ScreenEncoder(self.COLUMNS, self.ROWS - 1)
 
     def _apply_par(self, label: int) -> int:
         label = label & 0x7FFFFFFF
@@ -135,99 +120,10 @@ class MCDU:
         return None
 
     def set_screen(self, text: str):
-        # Truncate text to 312 characters and split into sections
-        sections = self.StringSplitter.split(text[:312])
-        blocks = []
-        current_block = None
-
-        for section in sections:
-            # If there's no current block, start one from this section.
-            if current_block is None:
-                current_block = {
-                    "text": section["text"][1:] if len(section["text"]) > 1 else "",
-                    "pos": 1,
-                    "fill": section["text"][0],
-                    "rep_char": section["rep_char"],
-                    "position": section.get("position", 0)
-                }
-            else:
-                # If this section is the same type as the current block, simply append.
-                if section["rep_char"] == current_block["rep_char"]:
-                    current_block["text"] += section["text"]
-                else:
-                    # Different type: finish the current block and start a new one.
-                    blocks.append(current_block)
-                    if section["rep_char"]:
-                        new_block = {
-                            "text": "",
-                            "pos": len(section["text"]),
-                            "fill": section["text"][0],
-                            "rep_char": True,
-                            "position": section.get("position", 0)
-                        }
-                    else:
-                        new_block = {
-                            "text": section["text"][1:] if len(section["text"]) > 1 else "",
-                            "pos": 1,
-                            "fill": section["text"][0],
-                            "rep_char": False,
-                            "position": section.get("position", 0)
-                        }
-                    current_block = new_block
-
-        if current_block:
-            blocks.append(current_block)
-
-        # Build the ARINC text blocks from each simplified block.
-        for block in blocks:
-            self._add_text_block(block["pos"], block["text"], block["fill"])
-
-    def _add_text_block(self, offset: int, text: str, fill_char: str = " "):
-        if offset <= 0:
-            raise Exception("Offset has to be bigger than zero")
-        # Create the header labels (offset and fill character)
-        self._block += [
-            self._apply_par(self._sal | 0x400 | (offset << 13)),
-            self._apply_par(self._sal | 0x400 | ((fill_char.encode('iso-8859-5')[0] & 0x7F) << 13)),
-        ]
-        # Mapping for Cyrillic characters to corresponding numbers.
-        cyrillic_to_number = {
-            'А': '0',
-            'Б': '1',
-            'В': '2',
-            'Г': '3',
-            'Д': '4',
-            'Е': '5',
-            'Ж': '6',
-            'З': '7',
-            'И': '8',
-            'Й': '9'
-        }
-        control = 0  # Normal text control value
-        i = 0
-        while i < len(text):
-            c = text[i]
-            # Special case for '#' (empty box) - use the value 64.
-            if c == "#":
-                self._block += [self._char_label(self._sal, 64, control)]
-            # Inverted color: using "Ф" to start and "Ю" to end inverted text.
-            elif c == "Ф":
-                control = 1
-            elif c == "Ю":
-                control = 0
-            # For the backtick character, map to 36 (e.g. for a degrees symbol)
-            elif c == "`":
-                self._block += [self._char_label(self._sal, 36, control)]
-            # Map Cyrillic characters to small font numbers.
-            elif c in cyrillic_to_number:
-                n = cyrillic_to_number[c]
-                self._block += [self._char_label(self._sal, 16 + int(n), control)]
-            else:
-                # For all other characters, encode them in ISO-8859-5.
-                for b in c.encode("iso-8859-5"):
-                    self._block += [self._char_label(self._sal, b, control)]
-            i += 1
-
+        """Encodes the 13 screen rows (312 cells) into the fewest text block words."""
+        words = self.encoder.screen_words(text, self._sal)
+        self._block += [self._apply_par(word) for word in words]
+        log.debug("screen: %d words (%d saved since start)", len(words), self.encoder.words_saved)
 
     @property
     def scratchpad(self) -> str:
@@ -443,14 +339,13 @@ class Logic:
 
     def key_pressed_callback(self, label):
         if label != 4612:
-            print("label")
-            print(label)
+            log.debug("label %d", label)
             key_hex = (label >> 12) & 0xFF
             if key_hex > 0:
                 selected_key = self.mcdu.get_ps_key(key_hex)
                 if selected_key != "":
                     getattr(self.datarefs.prosim, selected_key).value = 1
-                    print(selected_key)
+                    log.debug("key %s", selected_key)
                     self.mcdu._key_queue.put(selected_key)
 
     async def update(self):
@@ -4,27 +4,71 @@ from resources.driver.arinc.arinc_async import ArincAsync
 from fast_enum import FastEnum
 from enum import IntEnum
 from typing import List, Optional, Tuple
+import asyncio
+import heapq
+import itertools
+import os
+import sys
 import time
 import re
-import xml.etree.ElementTree as ET
 import queue
 
+# The helpers shared by the logic scripts live in config/logic/logic_lib
+_LOGIC_DIR = os.path.dirname(os.path.abspath(__file__))
+if _LOGIC_DIR not in sys.path: sys.path.append(_LOGIC_DIR)
+from logic_lib.dataref_watch import DatarefWatch
+from logic_lib.glyph_table import GlyphTable
+from logic_lib.lazy import lazy_import
+from logic_lib.page_cache import PageCache
+from logic_lib.script_log import ScriptLog
+ET = lazy_import("xml.etree.ElementTree")   # parser of the cdu1 XML, loaded with the first page
+
 # =========================
 # Config
 # =========================
-LRU_SAL = 0o300
+LRU_SAL = 0o300         # FMC (ProSim cdu1)
+ACARS_SAL = 0o304
+MENU_SAL = 0o306
+ENABLE_ACARS_LRU = True
+ENABLE_MENU_LRU = True
 ARINC_CARD_NAME: str = "arinc_1"
 ARINC_CARD_TX_CHNL: int = 3
 ARINC_CARD_RX_CHNL: int = 3
 HEARTBEAT_SEC = 0.9
 ENABLE_SPACE_PADDING_FOR_COLUMN = False
+# Host-side pause between words. 0 = hand whole records to the card in one call
+# and let the channel speed pace the words (see RobustSender._submit).
 ARINC_WORD_GAP_SEC = 0.0
+# Record transfer: retries per page window and extra reply time allowed per record
+# on top of the time the record needs on the bus (12.5 kb/s, 32 bits + 4 bit gap).
+RECORD_RETRIES = 3
+RECORD_REPLY_TIMEOUT_SEC = 1.5
+ARINC_TX_WORD_SEC = 36 / 12500
+# Logic loop period. Also bounds how late an RX reply is demultiplexed.
+LOOP_PERIOD_SEC = 0.01
+# TX arbiter: bus time kept queued on the card, and wait after which any
+# queued buffer is promoted to top priority.
+TX_LOOKAHEAD_SEC = 0.02
+ARBITER_MAX_WAIT_SEC = 0.5
+# Arbiter priorities (lower is served first). LRUs use their own priority for
+# DATA pages; MENU requests from the MCDU always use PRIORITY_MENU_REQUEST.
+PRIORITY_CONTROL = 0
+PRIORITY_MENU_REQUEST = 1
 MCDU_COLS = 24
 MCDU_DATA_LINES = 12
 COLOR_WHITE = 7
 COLOR_GREEN = 2
 ROW_COLORS = (4,7,7,7,7,7,7,7,7,7,7,7,7,7,7)
 
+# Console log level: 10=DEBUG, 20=INFO, 30=WARN, 40=ERROR. With profile mode
+# on, calls below the level are dropped at load instead of checked every frame.
+LOG_LEVEL = 20
+LOG_PROFILE_MODE = False
+
+# Rendered pages kept for when ProSim shows them again
+PAGE_CACHE_ENTRIES = 32
+PAGE_CACHE_BYTES = 512 * 1024
+
 SQUARE_CHAR = chr(29)
 DEGREE_CHAR = chr(28)
 
@@ -54,10 +98,11 @@ class RequestType(metaclass=FastEnum):
 class Color(IntEnum):
     C0=0; C1=1; C2=2; C3=3; C4=4; C5=5; C6=6; C7=7
 
-def log(msg: str):
-    print(msg)
+log = ScriptLog("mcdu_a739", level=LOG_LEVEL, profile=LOG_PROFILE_MODE)
 
 class TextData:
+    __slots__ = ("text", "color", "lineIdx", "initial_col", "disp_attr")
+
     def __init__(self, text: str, color: int, lineIdx: int, initial_col: int = 1, disp_attr: int = 0):
         self.text = text
         self.color = color & 0x7
@@ -117,6 +162,10 @@ class A739:
         """Checks if the data word is a Negative Acknowledge (NACK) signal (unsupported data format)."""
         return ((dw >> A739.SAL_TYPE_SHIFT) & A739.SAL_TYPE_MASK) == A739.NACK
     @staticmethod
+    def get_record_index(dw):
+        """Retrieves the record index echoed in an ACK/SYN/NAK reply (0 when the reply carries none)."""
+        return (dw >> 16) & 0xFF
+    @staticmethod
     def get_request_type(dw): 
         """Retrieves the request type (e.g. data or menu) from the control word."""
         return (dw >> A739.REQUEST_TYPE_SHIFT) & A739.REQUEST_TYPE_MASK
@@ -155,7 +204,7 @@ class ControlEncoder:
 
     def cntrl_B(self, mal_target, *, color, line, col_unused, attr_as_function):
         """Generates an alternative Control B data word when MCDU hardware rejects Control A."""
-        log("************************cntrl_B")
+        log.debug("[send] using CNTRL-B")
         color &= 0x7; lineStart = max(1, min(31, line)); lineCount = 1; function = attr_as_function & 0x7
         payload = ((A739.CNTRL << 16) | ((color & 0x7) << 12) | ((lineCount & 0xF) << 8) | ((function & 0x7) << 5) | (lineStart & 0x1F))
         return ArincLabel.Base.pack_dec_no_sdi_no_ssm(mal_target, payload)
@@ -164,82 +213,263 @@ class ControlEncoder:
         if tag in ('A', 'B'): self._preferred = tag
     def get_preferred(self): return self._preferred
 
-class RobustSender:
-    def __init__(self, dev, channel):
-        self.dev = dev; self.channel = channel; self.ctrl = ControlEncoder()
-
-    def _send_word(self, word):
-        """Sends a single ARINC word to the designated channel, maintaining the required gap delay."""
-        self.dev.send_manual_single_fast(self.channel, word)
-        if ARINC_WORD_GAP_SEC > 0: time.sleep(ARINC_WORD_GAP_SEC)
-
-    def _send_data_words(self, mal_target, text):
-        """Splits text into 3-character payload sequences and dispatches them line by line."""
-        words = A739.num_words_for_text(text); sent = 0
-        for _ in range(words):
-            c1 = ord(text[sent])     if sent     < len(text) else 0
-            c2 = ord(text[sent + 1]) if sent + 1 < len(text) else 0
-            c3 = ord(text[sent + 2]) if sent + 2 < len(text) else 0
-            payload = (c3 << 16) | (c2 << 8) | c1
-            self._send_word(ArincLabel.Base.pack_dec_no_sdi_no_ssm(mal_target, payload))
-            sent += 3
-        return words
+class RecordAssembler:
+    """Builds the STX -> CNTRL -> DATA -> ETX/EOT words of one or more records into a single TX buffer."""
+    def __init__(self, ctrl, channel):
+        self.ctrl = ctrl; self.channel = channel
+        self._words = []
 
-    def _try_send_once(self, mal_target, text, *, line, col, color, disp_attr, last, rec_idx, encoder_tag):
-        """Builds and transmits one complete protocol block (STX -> CNTRL -> DATA -> ETX/EOT)."""
+    def __len__(self): return len(self._words)
+
+    def _append(self, word): self._words.append((self.channel, word))
+
+    def _append_data_words(self, mal_target, text):
+        """Packs text into 3-character payload words (c1 in the low byte) and appends them."""
+        pack = ArincLabel.Base.pack_dec_no_sdi_no_ssm
+        raw = text.encode("latin-1", errors="replace")
+        raw += bytes(-len(raw) % 3)
+        for i in range(0, len(raw), 3):
+            self._append(pack(mal_target, (raw[i + 2] << 16) | (raw[i + 1] << 8) | raw[i]))
+        return len(raw) // 3
+
+    def add_record(self, mal_target, text, *, line, col, color, disp_attr, last, rec_idx, encoder_tag):
+        """Appends one complete record to the buffer and returns the number of words it used."""
         if ENABLE_SPACE_PADDING_FOR_COLUMN and col > 1:
             text_to_send = (" " * (col - 1)) + text; effective_col = 1
         else:
             text_to_send = text; effective_col = col
-        log(f"[send] Line {line} encoded text='{text_to_send}'")
-        data_words = A739.num_words_for_text(text_to_send)
-        self._send_word(self.ctrl.build_stx(mal_target, rec_idx, data_words))
-
+        log.debug("[send] Line %d encoded text=%r", line, text_to_send)
+        start = len(self._words)
+        self._append(self.ctrl.build_stx(mal_target, rec_idx, A739.num_words_for_text(text_to_send)))
         if encoder_tag == 'A':
-            self._send_word(self.ctrl.cntrl_A(mal_target, color=color, line=line, col=effective_col, attr=disp_attr))
+            self._append(self.ctrl.cntrl_A(mal_target, color=color, line=line, col=effective_col, attr=disp_attr))
         else:
-            self._send_word(self.ctrl.cntrl_B(mal_target, color=color, line=line, col_unused=effective_col, attr_as_function=0))
-
-        self._send_data_words(mal_target, text_to_send)
-        self._send_word(self.ctrl.build_etx_eot(mal_target, rec_idx, last))
-        return encoder_tag
-
-    def send_text_adaptive(self, mal_target, text, *, line, col, color, disp_attr, last, rec_idx, rx_labels):
-        """Attempts transmission using preferred Control word encoding, falling back to alternative format on rejection."""
-        preferred = self.ctrl.get_preferred()
-        order = ['A', 'B'] if preferred is None else [preferred, 'B' if preferred == 'A' else 'A']
-        for attempt_tag in order:
-            log(f"[send] rec={rec_idx} try CNTRL-{attempt_tag} line={line} col={col} color={color}")
-            self._try_send_once(mal_target, text, line=line, col=col, color=color, disp_attr=disp_attr, last=last, rec_idx=rec_idx, encoder_tag=attempt_tag)
-            saw_syn = any(A739.is_syn(l) for l, _ in rx_labels)
-            saw_ack = any(A739.is_ack(l) for l, _ in rx_labels)
-            if saw_ack and not saw_syn:
-                self.ctrl.set_preferred(attempt_tag); log(f"[send] CNTRL-{attempt_tag} accepted (ACK)."); return True
-            if saw_syn and not saw_ack:
-                log(f"[send] CNTRL-{attempt_tag} rejected (SYN). Trying alternative..."); continue
+            self._append(self.ctrl.cntrl_B(mal_target, color=color, line=line, col_unused=effective_col, attr_as_function=0))
+        self._append_data_words(mal_target, text_to_send)
+        self._append(self.ctrl.build_etx_eot(mal_target, rec_idx, last))
+        return len(self._words) - start
+
+    def take(self):
+        """Returns the assembled (channel, word) list and clears the buffer."""
+        words = self._words; self._words = []
+        return words
+
+class TxArbiter:
+    """Shares one TX channel between the LRUs.
+
+    Buffers are queued with a priority and an absolute deadline and handed to
+    the card in (priority, deadline) order, coalesced into one driver call per
+    pump. Only TX_LOOKAHEAD_SEC of bus time is kept on the card, so a menu
+    reply submitted while the FMC pushes a page waits for at most the records
+    already on the card. Buffers older than ARBITER_MAX_WAIT_SEC are promoted
+    to PRIORITY_CONTROL so no LRU starves. When the driver raises, the buffers
+    stay queued, in order, for the next pump and their futures stay open.
+    """
+    def __init__(self, dev):
+        self.dev = dev
+        # heap of [priority, deadline, seq, submitted, words, released future]
+        self._queue = []
+        self._seq = 0
+        self._busy_until = 0.0
+        self.send_errors = 0
+
+    def __len__(self): return len(self._queue)
+
+    def submit(self, words, *, priority, deadline=None):
+        """Queues a (channel, word) buffer. Returns a future resolved with the loop time it was handed to the card."""
+        loop = asyncio.get_event_loop(); now = loop.time()
+        fut = loop.create_future()
+        self._seq += 1
+        heapq.heappush(self._queue, [priority, now if deadline is None else deadline, self._seq, now, words, fut])
+        return fut
+
+    def _age(self, now):
+        promoted = False
+        for item in self._queue:
+            if item[0] > PRIORITY_CONTROL and now - item[3] > ARBITER_MAX_WAIT_SEC:
+                item[0] = PRIORITY_CONTROL; promoted = True
+        if promoted: heapq.heapify(self._queue)
+
+    def pump(self):
+        """Hands queued buffers to the card until TX_LOOKAHEAD_SEC of bus time is outstanding."""
+        if not self._queue: return
+        now = asyncio.get_event_loop().time()
+        self._age(now)
+        batch = []; taken = []
+        busy_until = max(self._busy_until, now)
+        while self._queue and busy_until - now < TX_LOOKAHEAD_SEC:
+            item = heapq.heappop(self._queue)
+            if item[5].cancelled(): continue
+            batch += item[4]; taken.append(item)
+            busy_until += len(item[4]) * ARINC_TX_WORD_SEC
+        if not batch: return
+        # Buffers the card has accepted; only their futures are resolved
+        accepted = 0
+        try:
+            if ARINC_WORD_GAP_SEC > 0:
+                for item in taken:
+                    for chnl, word in item[4]:
+                        self.dev.send_manual_single_fast(chnl, word); time.sleep(ARINC_WORD_GAP_SEC)
+                    accepted += 1
+            else:
+                self.dev.send_manual_list_fast(batch); accepted = len(taken)
+        except Exception as e:
+            # Back into the heap: their (priority, deadline, seq) puts them at its head, in order
+            self.send_errors += 1
+            for item in taken[accepted:]: heapq.heappush(self._queue, item)
+            busy_until = now + sum(len(item[4]) for item in taken[:accepted]) * ARINC_TX_WORD_SEC
+            log.warn("[send] TX of %d buffers failed, kept queued: %s", len(taken) - accepted, e)
+        self._busy_until = busy_until
+        for item in taken[:accepted]: item[5].set_result(now)
+
+class RobustSender:
+    def __init__(self, arbiter, channel):
+        self.arbiter = arbiter; self.channel = channel; self.ctrl = ControlEncoder()
+        self.assembler = RecordAssembler(self.ctrl, channel)
+
+    def encoder_tag(self):
+        """Returns the CNTRL encoding to use: the one last accepted by the MCDU, CNTRL-A by default."""
+        return self.ctrl.get_preferred() or 'A'
+
+    def send_word(self, word, *, priority=PRIORITY_CONTROL):
+        """Queues a single control word (RTS, key ACK, heartbeat) on the arbiter."""
+        return self.arbiter.submit([(self.channel, word)], priority=priority)
+
+    def send_records(self, mal_target, records, *, first_idx=1, total=None, priority=PRIORITY_CONTROL, deadline=None):
+        """Assembles the given TextData records and queues them on the arbiter, one buffer per record.
+
+        Records are numbered from `first_idx`; the record numbered `total` is closed with EOT.
+        Returns one release future per record (see TxArbiter.submit).
+        """
+        tag = self.encoder_tag()
+        total = total if total is not None else first_idx + len(records) - 1
+        released = []
+        for i, rec in enumerate(records):
+            rec_idx = first_idx + i
+            self.assembler.add_record(mal_target, rec.text, line=rec.lineIdx, col=rec.initial_col, color=rec.color,
+                                      disp_attr=rec.disp_attr, last=(rec_idx == total), rec_idx=rec_idx, encoder_tag=tag)
+            released.append(self.arbiter.submit(self.assembler.take(), priority=priority, deadline=deadline))
+        log.debug("[send] %d records queued, CNTRL-%s", len(records), tag)
+        return released
+
+    def reject_encoding(self):
+        """Switches to the alternative CNTRL encoding after the MCDU rejected the current one (SYN)."""
+        tag = 'B' if self.encoder_tag() == 'A' else 'A'
+        log.warn("[send] CNTRL encoding rejected (SYN). Switching to CNTRL-%s", tag)
+        self.ctrl.set_preferred(tag)
+
+class A739Link:
+    """Asynchronous record transfer for one LRU.
+
+    Every record sent gets a future that `on_rx` resolves with the ACK, SYN or
+    NAK code the MCDU answers with. `send_page` sends windows of up to the
+    CTS-advertised number of records and awaits the reply to the last record
+    of the window, until its bus time plus RECORD_REPLY_TIMEOUT_SEC after the
+    arbiter released it. A record the arbiter does not release within
+    RECORD_REPLY_TIMEOUT_SEC fails the window like a missing reply. ACKs are cumulative, so per-record ACKs and a single
+    ACK after ETX/EOT both complete the window.
+    """
+    def __init__(self, sender, sal):
+        self.sender = sender; self.sal = sal
+        self.mal_target = None
+        # rec_idx -> [reply future, release future, bus time]; insertion order is send order
+        self._pending = {}
+
+    def on_rx(self, label):
+        """RX demux: resolves pending record futures from an ACK/SYN/NAK addressed to this LRU."""
+        if not self._pending: return
+        if ArincLabel.Base._reverse_label_number(label & 0xFF) != self.sal: return
+        if A739.is_ack(label): code = A739.ACK
+        elif A739.is_syn(label): code = A739.SYN
+        elif A739.is_nack(label): code = A739.NACK
+        else: return
+        # ACKs are cumulative; one without an index acknowledges everything in flight.
+        # A SYN or NAK rejects the whole window, so it resolves every open record.
+        rec_idx = A739.get_record_index(label) if code == A739.ACK else 0
+        for idx, (fut, _, _) in self._pending.items():
+            if (rec_idx == 0 or idx <= rec_idx) and not fut.done(): fut.set_result(code)
+
+    def _send_window(self, records, first, last, total, priority, deadline):
+        """Queues records[first:last] on the arbiter and registers a reply future per record."""
+        loop = asyncio.get_running_loop()
+        released = self.sender.send_records(self.mal_target, records[first:last], first_idx=first + 1, total=total,
+                                            priority=priority, deadline=deadline)
+        for i, rel in zip(range(first, last), released):
+            bus_time = (A739.num_words_for_text(records[i].text) + 3) * ARINC_TX_WORD_SEC
+            self._pending[i + 1] = [loop.create_future(), rel, bus_time]
+
+    def _cancel_pending(self):
+        """Drops the window in flight, withdrawing records the arbiter has not released yet."""
+        for fut, rel, _ in self._pending.values():
+            if not fut.done(): fut.cancel()
+            if not rel.done(): rel.cancel()
+        self._pending.clear()
+
+    async def send_page(self, records, max_recs, *, priority, deadline=None):
+        """Transfers all records, resending the unacknowledged window on SYN, NAK or timeout.
+
+        `priority` and `deadline` are passed to the arbiter for every record of the page.
+        Returns True once the last record is acknowledged, False after RECORD_RETRIES failed windows.
+        """
+        loop = asyncio.get_running_loop()
+        total = len(records); window = max(1, max_recs or total)
+        acked = 0; sent = 0; retries = 0
+        try:
+            while acked < total:
+                if sent < min(total, acked + window):
+                    last = min(total, acked + window)
+                    self._send_window(records, sent, last, total, priority, deadline); sent = last
+                fut, rel, bus_time = self._pending[sent]
+                try:
+                    released_at = await asyncio.wait_for(rel, RECORD_REPLY_TIMEOUT_SEC)
+                except asyncio.TimeoutError:
+                    released_at = None; code = None
+                else:
+                    try:
+                        code = await asyncio.wait_for(asyncio.shield(fut), max(0.0, released_at + bus_time + RECORD_REPLY_TIMEOUT_SEC - loop.time()))
+                    except asyncio.TimeoutError:
+                        code = None
+                if code == A739.ACK:
+                    while acked < sent and self._pending[acked + 1][0].done() and self._pending[acked + 1][0].result() == A739.ACK:
+                        del self._pending[acked + 1]; acked += 1
+                    continue
+                if code == A739.SYN:
+                    log.warn("SYN on recs %d-%d -> retry", acked + 1, sent); self.sender.reject_encoding()
+                elif code == A739.NACK:
+                    log.warn("NAK on recs %d-%d -> retry", acked + 1, sent)
+                elif released_at is None:
+                    log.warn("Recs %d-%d not sent -> retry", acked + 1, sent)
+                else:
+                    log.warn("No reply for recs %d-%d -> retry", acked + 1, sent)
+                retries += 1
+                if retries > RECORD_RETRIES: return False
+                self._cancel_pending(); sent = acked
             return True
-        return False
+        finally:
+            self._cancel_pending()
 
 # =========================
 # XML / display parsing helpers
 # =========================
-_CYRILLIC_TO_NUMBER = {'A':'0','B':'1','B':'2','G':'3','D':'4','E':'5','ZH':'6','Z':'7','I':'8','J':'9'}
-_CYRILLIC_MAP = {'?':'0','?':'1','?':'2','?':'3','?':'4','?':'5','?':'6','?':'7','?':'8','?':'9'}
-_NUMBER_TO_CYRILLIC = {v: k for k, v in _CYRILLIC_MAP.items()}
+# Small-font digits travel through the parser as Cyrillic А..Й. The A739 sets the
+# font per record, so they go back to plain digits on the way out
+_NUMBER_TO_CYRILLIC = str.maketrans("0123456789", "АБВГДЕЖЗИЙ")
+
+# A739 character set: one byte per character. "Ф"/"Ю" (inverse markers) are dropped,
+# "`" is the ProSim degree sign; anything outside Latin-1 would spill into the next
+# character of the data word and is shown as "?"
+A739_GLYPHS = GlyphTable(
+    {ord('Ф'): None, ord('Ю'): None, ord('`'): DEGREE_CHAR,
+     **{ord(c): str(n) for n, c in enumerate("АБВГДЕЖЗИЙ")}},
+    lambda cp: cp if cp < 0x100 else ord('?'))
 
 def _convert_numbers_to_cyrillic(text):
     """Converts numbers in the text to their Cyrillic counterparts for proper MCDU mapping."""
-    return ''.join(_NUMBER_TO_CYRILLIC.get(c, c) for c in text)
+    return text.translate(_NUMBER_TO_CYRILLIC)
 
 def _strip_display_controls(text):
     """Cleans up the text by mapping display controls and special characters to A739-safe equivalents."""
-    result = []
-    for c in text:
-        if c in ('Ф', 'Ю'): continue
-        if c == '`': 
-            result.append(DEGREE_CHAR); continue
-        result.append(_CYRILLIC_MAP.get(c, c))
-    return ''.join(result)
+    return text.translate(A739_GLYPHS)
 
 def _parse_display_line(input_str, lower_case=False):
     """Parses a ProSim display line string, extracting left, center, and right alignments based on the delimiter."""
@@ -288,31 +518,27 @@ def _format_row(left="", center="", right="", cols=MCDU_COLS):
         if 0 <= cs + i < cols: row[cs + i] = ch
     return ''.join(row)
 
+# ProSim markup: "[]" (box), [s]/[S] small font, [1]..[4] colors, [I] inverse and [l] large (no cell)
+_MARKUP = re.compile(r'\[(?:(/?)([sS1-4Il])|)\]')
+_MARKUP_COLORS = {'1': 1, '2': 4, '3': 5, '4': 2}
+
 def _tokenize(s, def_col):
+    """Splits a markup string into (char, color, is_small) cells."""
     tokens = []
-    i = 0
     color = def_col
     is_small = False
-    while i < len(s):
-        if s[i:i+3].lower() == "[s]":
-            is_small = True; i += 3; continue
-        if s[i:i+4].lower() == "[/s]":
-            is_small = False; i += 4; continue
-        m = re.match(r'\[([1234])\]', s[i:i+3])
-        if m:
-            color = {'1':1, '2':4, '3':5, '4':2}.get(m.group(1), def_col)
-            i += 3; continue
-        m = re.match(r'\[/([1234])\]', s[i:i+4])
-        if m:
-            color = def_col; i += 4; continue
-        if s[i:i+3] == "[I]": i += 3; continue
-        if s[i:i+4] == "[/I]": i += 4; continue
-        if s[i:i+3] == "[l]": i += 3; continue
-        if s[i:i+4] == "[/l]": i += 4; continue
-        if s[i:i+2] == "[]":
-            tokens.append((SQUARE_CHAR, color, is_small)); i += 2; continue
-        tokens.append((s[i], color, is_small))
-        i += 1
+    pos = 0
+    for m in _MARKUP.finditer(s):
+        tokens += [(c, color, is_small) for c in s[pos:m.start()] if c not in 'ФЮ']
+        pos = m.end()
+        tag = m.group(2)
+        if tag is None:
+            tokens.append((SQUARE_CHAR, color, is_small))
+        elif tag in 'sS':
+            is_small = not m.group(1)
+        elif tag in _MARKUP_COLORS:
+            color = def_col if m.group(1) else _MARKUP_COLORS[tag]
+    tokens += [(c, color, is_small) for c in s[pos:] if c not in 'ФЮ']
     return tokens
 
 def _parse_rich_display_line(input_str, default_color):
@@ -358,12 +584,38 @@ def _parse_xml(xml_string):
     lines = (lines + [""] * MCDU_DATA_LINES)[:MCDU_DATA_LINES]
     return {"title": txt('title'), "title_page": txt('titlePage'), "scratchpad": txt('scratchpad'), "lines": lines}
 
+def _segment_runs(text, colors, cols=MCDU_COLS):
+    """Splits a screen into color runs. Returns (line, col, color, text) tuples in line order, 1-based.
+
+    `text` holds the rows back to back, `cols` characters each, and `colors` one
+    list of cell colors per row. Blanks look the same in every color, so they
+    take the color of the character before them (the one after them at the
+    start of a line) and a run only ends where the color of visible text
+    changes. Every cell is covered, so each record also clears what the
+    previous page left in its columns.
+    """
+    runs = []
+    for ln, row_colors in enumerate(colors):
+        row = text[ln * cols:(ln + 1) * cols]
+        first = len(row) - len(row.lstrip(' '))
+        if first < len(row):
+            # Forward fill from the first visible cell; leading blanks take its color
+            color = row_colors[first]; filled = []
+            for ch, c in zip(row, row_colors):
+                if ch != ' ': color = c
+                filled.append(color)
+        else:
+            filled = row_colors   # Blank lines keep their own colors
+        col = 0
+        for color, cells in itertools.groupby(filled):
+            end = col + sum(1 for _ in cells)
+            runs.append((ln + 1, col + 1, color, row[col:end])); col = end
+    return runs
+
 def _xml_to_text_data(xml_result):
     """Converts the parsed XML dictionary into a list of TextData records ready for transmission."""
-    records = []
-    log(f"[prosim] raw title: {repr(xml_result['title'])}")
-    for idx, l in enumerate(xml_result['lines']):
-        log(f"[prosim] raw line {idx}: {repr(l)}")
+    log.debug("[prosim] raw title: %r", xml_result['title'])
+    log.debug("[prosim] raw lines: %r", xml_result['lines'])
 
     t_raw = xml_result["title"]
     title_parts = t_raw.split("\u00A8")
@@ -378,65 +630,34 @@ def _xml_to_text_data(xml_result):
     right_str = _convert_numbers_to_cyrillic(xml_result["title_page"]) if xml_result["title_page"] else ""
 
     def_color = ROW_COLORS[0]
-    left_tk = _tokenize(left_str, def_color)
-    center_tk = _tokenize(center_str, def_color)
-    right_tk = _tokenize(right_str, def_color)
-
-    row = _format_rich_row(left_tk, center_tk, right_tk, cols=MCDU_COLS, default_color=def_color)
-
-    current_color = row[0][1]
-    current_text = ""
-    start_col = 1
-
-    for col_idx, (char, color, is_small) in enumerate(row):
-        c = _convert_numbers_to_cyrillic(char)
-
-        if color != current_color:
-            if current_text:
-                records.append(TextData(_strip_display_controls(current_text), current_color, lineIdx=1, initial_col=start_col))
-            current_color = color
-            current_text = c
-            start_col = col_idx + 1
-        else:
-            current_text += c
-
-    if current_text:
-        records.append(TextData(_strip_display_controls(current_text), current_color, lineIdx=1, initial_col=start_col))
-
+    rows = [_format_rich_row(_tokenize(left_str, def_color), _tokenize(center_str, def_color),
+                             _tokenize(right_str, def_color), cols=MCDU_COLS, default_color=def_color)]
     for ln, raw in enumerate(xml_result["lines"]):
         def_color = ROW_COLORS[ln + 1]
         left_tk, center_tk, right_tk = _parse_rich_display_line(raw, def_color)
-        row = _format_rich_row(left_tk, center_tk, right_tk, cols=MCDU_COLS, default_color=def_color)
-
-        current_color = row[0][1]
-        current_text = ""
-        start_col = 1
-
-        for col_idx, (char, color, is_small) in enumerate(row):
-            c = _convert_numbers_to_cyrillic(char)
-
-            if color != current_color:
-                if current_text:
-                    records.append(TextData(_strip_display_controls(current_text), current_color, lineIdx=ln + 2, initial_col=start_col))
-                current_color = color
-                current_text = c
-                start_col = col_idx + 1
-            else:
-                current_text += c
-
-        if current_text:
-            records.append(TextData(_strip_display_controls(current_text), current_color, lineIdx=ln + 2, initial_col=start_col))
+        rows.append(_format_rich_row(left_tk, center_tk, right_tk, cols=MCDU_COLS, default_color=def_color))
 
     sp = _strip_display_controls(xml_result["scratchpad"]).ljust(MCDU_COLS)[:MCDU_COLS]
-    log(f"  -> Scratchpad text built (hex): {[hex(ord(c)) for c in sp]}")
+    log.debug("  -> Scratchpad text built: %r", sp)
 
-    records.append(TextData(sp, ROW_COLORS[13], lineIdx=14, initial_col=1))
-    return records
+    # 14 rows of 24 glyphs and colors; the title and data lines are one translate call
+    text = "".join(c for row in rows for c, _, _ in row).translate(A739_GLYPHS) + sp
+    colors = [[color for _, color, _ in row] for row in rows] + [[ROW_COLORS[13]] * MCDU_COLS]
+    return [TextData(text, color, lineIdx=line, initial_col=col) for line, col, color, text in _segment_runs(text, colors)]
+
+def _records_size(records):
+    """Estimated memory of a record list, for the page cache cap."""
+    return sys.getsizeof(records) + sum(sys.getsizeof(r) + sys.getsizeof(r.text) for r in records)
 
 # =========================
 # LRU base
 # =========================
 class LRU:
+    """One A739 subsystem. `priority` orders its DATA pages on the arbiter, `deadline_sec` is the
+    delivery target of a page relative to the moment it is requested."""
+    priority = 3
+    deadline_sec = 1.0
+
     def __init__(self, name, sal, channel):
         self.name = name; self.sal = sal; self._channel = channel
     @property
@@ -447,21 +668,63 @@ class LRU:
         self._channel = value
     def get_page_records(self): return 0
     def get_page_text(self): return []
+    def handle_key(self, logic, key_code): log.debug("[%s] key code=%d ignored", self.name, key_code)
 
 class ProSimLRU(LRU):
     def __init__(self):
         super().__init__("PROSIM", LRU_SAL, ARINC_CARD_TX_CHNL)
         self._page = []
+        self.page_cache = PageCache(PAGE_CACHE_ENTRIES, PAGE_CACHE_BYTES)
 
     def update_from_xml(self, xml_string):
+        key = PageCache.key(xml_string)
+        page = self.page_cache.get(key)
+        if page is not None:
+            self._page = page
+            log.debug("[prosim] page from cache (%d records)", len(page))
+            return
         try:
             self._page = _xml_to_text_data(_parse_xml(xml_string))
-            log(f"[prosim] page updated ({len(self._page)} records)")
+            self.page_cache.put(key, self._page, _records_size(self._page))
+            log.debug("[prosim] page updated (%d records), cache %d hits / %d misses", len(self._page),
+                      self.page_cache.hits, self.page_cache.misses)
         except Exception as e:
-            log(f"[prosim] XML parse error: {e}")
+            log.error("[prosim] XML parse error: %s", e)
 
     def get_page_records(self): return len(self._page)
     def get_page_text(self): return list(self._page)
+    def handle_key(self, logic, key_code): logic._handle_key(key_code)
+
+class AcarsLRU(LRU):
+    """Placeholder ACARS subsystem: answers the MCDU with a static status page."""
+    priority = 2
+    deadline_sec = 0.5
+
+    def __init__(self):
+        super().__init__("ACARS", ACARS_SAL, ARINC_CARD_TX_CHNL)
+        self._page = [
+            TextData(_format_row(center="ACARS"), COLOR_GREEN, lineIdx=1),
+            TextData(_format_row(left="NO ACTIVE DATALINK"), COLOR_WHITE, lineIdx=3),
+        ]
+
+    def get_page_records(self): return len(self._page)
+    def get_page_text(self): return list(self._page)
+
+class MenuLRU(LRU):
+    """Local status menu listing the controller's subsystems and their link state."""
+    priority = 1
+    deadline_sec = 0.2
+
+    def __init__(self, controller):
+        super().__init__("AVIOLOGIC", MENU_SAL, ARINC_CARD_TX_CHNL)
+        self._controller = controller
+
+    def get_page_text(self):
+        page = [TextData(_format_row(center="AVIOLOGIC MENU"), COLOR_GREEN, lineIdx=1)]
+        for i, lru_data in enumerate(self._controller.lrus):
+            page.append(TextData(_format_row(left=lru_data.lru.name, right=str(lru_data.state)), COLOR_WHITE, lineIdx=3 + 2 * i))
+        return page
+    def get_page_records(self): return len(self.get_page_text())
 
 # =========================
 # State machine
@@ -472,7 +735,6 @@ class LRUData:
         self.next_state = TransmissionState.IDLE
         self.heartbeat_elapsed_time = time.time()
         self.lru = lru
-        self.message_response_elapsed_time = 0.0
         self.message_repeat_count = 0
         self.current_request_type = RequestType.MENU.value
         self.record_count = 1
@@ -480,16 +742,23 @@ class LRUData:
         self.locked_mal = None
         self.repeat = False
         self.sender = None
+        self.link = None
+        self.max_recs = 0
+        self.transfer = None
+        self.page_deadline = None
 
     def queue(self, new_state):
         """Queues a transition to a new transmission state."""
         if new_state != self.state:
-            log(f"Transition: {self.state} -> {new_state}")
+            log.debug("Transition: %s -> %s", self.state, new_state)
             self.next_state = new_state
 
     def update(self, logic, lru_data, rx):
         """Advances the internal state machine based on queued states and incoming labels."""
         if self.next_state != self.state:
+            if self.transfer is not None:
+                # Leaving SEND_DATA (e.g. a new page forced RTS): abandon the running transfer
+                self.transfer.cancel(); self.transfer = None
             self.repeat = False; self.state = self.next_state
         if self.state == TransmissionState.IDLE: self._idle(logic, rx)
         elif self.state == TransmissionState.RTS: self._rts(logic, rx)
@@ -497,17 +766,18 @@ class LRUData:
 
     def _idle(self, logic, rx):
         """Listens for an ENQ signal from the MCDU while in IDLE state, acquiring the target MAL."""
-        if self.sender is None and logic.dev is not None:
-            self.sender = RobustSender(logic.dev, self.lru.channel)
+        if self.sender is None and logic.arbiter is not None:
+            self.sender = RobustSender(logic.arbiter, self.lru.channel)
+            self.link = A739Link(self.sender, self.lru.sal)
         for label, ts in rx:
             p, ssm, data, sdi, label_id = ArincLabel.Base.unpack_dec(label)
             decoded_label = ArincLabel.Base._reverse_label_number(label_id)
             if decoded_label == self.lru.sal and A739.is_enq(label):
                 req = A739.get_request_type(label); mal = A739.get_mal(label)
                 if self.locked_mal is None:
-                    self.locked_mal = mal; log(f"[lock] MAL {oct(mal)}")
+                    self.locked_mal = mal; log.info("[lock] MAL %o", mal)
                 self.mal_target = self.locked_mal; self.current_request_type = req
-                log(f"ENQ Received (req={req}) MAL={oct(mal)}")
+                log.debug("ENQ Received (req=%d) MAL=%o", req, mal)
                 self.queue(TransmissionState.RTS); return
         if not self.repeat:
             self.message_repeat_count = 0; self.repeat = True
@@ -515,9 +785,10 @@ class LRUData:
     def _rts(self, logic, rx):
         """Sends a Request to Send (RTS) and waits for a Clear to Send (CTS) from the MCDU."""
         for label, ts in rx:
-            if A739.is_cts(label):
+            if A739.is_cts(label) and ArincLabel.Base._reverse_label_number(label & 0xFF) == self.lru.sal:
                 max_recs = (ArincLabel.Base.unpack_dec(label)[2] >> 16) & 0x7F
-                log(f"CTS Received (max_recs={max_recs})")
+                log.debug("CTS Received (max_recs=%d)", max_recs)
+                self.max_recs = max_recs
                 self.queue(TransmissionState.SEND_DATA); return
         if not self.repeat:
             if self.current_request_type == RequestType.MENU.value:
@@ -526,28 +797,32 @@ class LRUData:
                 self.record_count = self.lru.get_page_records()
             rts_payload = (A739.DC2 << 16) | ((self.current_request_type & 0xF) << 8) | (self.record_count & 0xFF)
             rts = ArincLabel.Base.pack_dec_no_sdi_no_ssm(self.mal_target, rts_payload)
-            logic.dev.send_manual_single_fast(self.lru.channel, rts)
-            log(f"RTS -> MAL {oct(self.mal_target)} (req={self.current_request_type}, recs={self.record_count})")
+            self.sender.send_word(rts)
+            self.page_deadline = asyncio.get_running_loop().time() + self.lru.deadline_sec
+            log.debug("RTS -> MAL %o (req=%d, recs=%d)", self.mal_target, self.current_request_type, self.record_count)
             self.repeat = True
 
     def _send_data(self, logic, rx):
-        """Transmits the cached page data sequentially and listens for completion or NACK/SYN."""
+        """Starts the page transfer on entry, then waits for the link to report completion or failure."""
         if self.repeat:
-            for label, ts in rx:
-                if A739.is_syn(label): log("SYN -> retry"); self._retry_or_idle(); return
-                if A739.is_ack(label): log("ACK"); self.queue(TransmissionState.IDLE); return
-                if A739.is_nack(label): log("NAK -> retry"); self._retry_or_idle(); return
-            if time.time() - self.message_response_elapsed_time > 1.5: self._retry_or_idle()
+            if not self.transfer.done(): return
+            ok = False
+            if self.transfer.cancelled(): pass
+            elif self.transfer.exception() is not None: log.error("[send] transfer failed: %s", self.transfer.exception())
+            else: ok = self.transfer.result()
+            self.transfer = None
+            if ok: log.debug("ACK"); self.queue(TransmissionState.IDLE)
+            else: self._retry_or_idle()
             return
         if self.current_request_type == RequestType.MENU.value:
-            self.sender.send_text_adaptive(self.mal_target, self.lru.name, line=1, col=1, color=Color.C7, disp_attr=0, last=True, rec_idx=1, rx_labels=rx)
+            records = [TextData(self.lru.name, Color.C7, lineIdx=1, initial_col=1)]
         else:
             records = self.lru.get_page_text()
             if not records: self.queue(TransmissionState.IDLE); return
-            for idx, rec in enumerate(records):
-                ok = self.sender.send_text_adaptive(self.mal_target, rec.text, line=rec.lineIdx, col=rec.initial_col, color=rec.color, disp_attr=rec.disp_attr, last=(idx == len(records) - 1), rec_idx=idx + 1, rx_labels=rx)
-                if not ok: self._retry_or_idle(); return
-        self.message_response_elapsed_time = time.time(); self.repeat = True
+        priority = PRIORITY_MENU_REQUEST if self.current_request_type == RequestType.MENU.value else self.lru.priority
+        self.link.mal_target = self.mal_target
+        self.transfer = asyncio.ensure_future(self.link.send_page(records, self.max_recs, priority=priority, deadline=self.page_deadline))
+        self.repeat = True
 
     def _retry_or_idle(self):
         """Retries transmission up to a threshold limit before yielding to IDLE state."""
@@ -571,7 +846,8 @@ _KEY_MAP = {
     85: "S_CDU1_KEY_U", 86: "S_CDU1_KEY_V", 87: "S_CDU1_KEY_W", 88: "S_CDU1_KEY_X",
     89: "S_CDU1_KEY_Y", 90: "S_CDU1_KEY_Z",
     46: "S_CDU1_KEY_DOT", 47: "S_CDU1_KEY_SLASH", 45: "S_CDU1_KEY_MINUS",
-    43: "S_CDU1_KEY_PLUS", 32: "S_CDU1_KEY_SPACE",
+    # The 737 CDU has a single +/- key; ProSim has no S_CDU1_KEY_PLUS
+    43: "S_CDU1_KEY_MINUS", 32: "S_CDU1_KEY_SPACE",
     112: "S_CDU1_KEY_LSK1L", 113: "S_CDU1_KEY_LSK2L", 114: "S_CDU1_KEY_LSK3L",
     115: "S_CDU1_KEY_LSK4L", 116: "S_CDU1_KEY_LSK5L", 117: "S_CDU1_KEY_LSK6L",
     120: "S_CDU1_KEY_LSK1R", 121: "S_CDU1_KEY_LSK2R", 122: "S_CDU1_KEY_LSK3R",
@@ -589,27 +865,43 @@ _KEY_MAP = {
 # =========================
 class Logic:
     def __init__(self):
-        self.version = "mcdu_a739_prosim_v3.0"
+        self.version = "mcdu_a739_prosim_v3.1"
         self._prosim_lru = ProSimLRU()
         self.lrus = [LRUData(self._prosim_lru)]
+        if ENABLE_ACARS_LRU: self.lrus.append(LRUData(AcarsLRU()))
+        if ENABLE_MENU_LRU: self.lrus.append(LRUData(MenuLRU(self)))
+        self._lru_by_sal = {lru_data.lru.sal: lru_data for lru_data in self.lrus}
         self.mcdu_rx_channel = ARINC_CARD_RX_CHNL
         self.data_recv = False
         self.dev = None
-        self._cdu1_text_prev = ""
+        self.arbiter = None
+        self.dataref_watch = DatarefWatch()
         self._key_q = queue.Queue()
 
+    def hot_reload_state(self) -> dict:
+        """State handed to the new instance when the script is hot reloaded."""
+        pending = []
+        while not self._key_q.empty(): pending.append(self._key_q.get_nowait())
+        return {"locked_mal": {lru_data.lru.sal: lru_data.locked_mal for lru_data in self.lrus}, "pending_keys": pending}
+
+    def hot_reload_restore(self, state: dict):
+        for sal, mal in state["locked_mal"].items():
+            if sal in self._lru_by_sal: self._lru_by_sal[sal].locked_mal = mal
+        # Keys held in the sim by the old instance are released by this one
+        for name in state["pending_keys"]: self._key_q.put(name)
+
     def _handle_key(self, key_code):
         """Translates physical MCDU key presses to simulator dataref commands."""
         dataref_name = _KEY_MAP.get(key_code, "")
         if dataref_name:
-            log(f"[key] {dataref_name} (code={key_code})")
+            log.debug("[key] %s (code=%d)", dataref_name, key_code)
             try:
                 getattr(self.datarefs.prosim, dataref_name).value = 1
                 self._key_q.put(dataref_name)
             except Exception as e:
-                log(f"[key] dataref error: {e}")
+                log.error("[key] dataref error: %s", e)
         else:
-            log(f"[key] unmapped code={key_code}")
+            log.warn("[key] unmapped code=%d", key_code)
 
     def _release_pending_keys(self):
         """Releases previously held simulator keys that have been acknowledged."""
@@ -622,15 +914,17 @@ class Logic:
     async def update(self):
         """Main update loop that processes ARINC queues and syncs the display state."""
         if not hasattr(self, "devices") or self.devices is None or len(self.devices) == 0:
-            log("[wait] No ARINC devices registered yet."); return
+            log.info("[wait] No ARINC devices registered yet."); await asyncio.sleep(LOOP_PERIOD_SEC); return
         if ARINC_CARD_NAME in self.devices:
             dev = self.devices[ARINC_CARD_NAME]
         else:
             first_key = next(iter(self.devices.keys()))
-            log(f"[warn] '{ARINC_CARD_NAME}' not found; using '{first_key}'"); dev = self.devices[first_key]
+            log.warn("'%s' not found; using '%s'", ARINC_CARD_NAME, first_key); dev = self.devices[first_key]
+        if self.arbiter is None or self.arbiter.dev is not dev:
+            self.arbiter = TxArbiter(dev)
         self.dev = dev
         if not self.dev.is_ready:
-            log("[wait] ARINC device exists but isn't ready yet."); return
+            log.info("[wait] ARINC device exists but isn't ready yet."); await asyncio.sleep(LOOP_PERIOD_SEC); return
 
         received_labels = []
         while True:
@@ -649,40 +943,53 @@ class Logic:
 
         if received_labels: self.data_recv = True
 
+        # Demultiplex record replies to the LRU links before the state machines run
+        for lru_data in self.lrus:
+            if lru_data.link is not None:
+                for label, ts in received_labels: lru_data.link.on_rx(label)
+
         self._release_pending_keys()
         for label, ts in received_labels:
             # Handle ARINC 739 DC1 keyboard labels
             if A739.is_keyboard(label):
+                # Keys go to the LRU whose SAL they are addressed to, the FMC otherwise
+                lru_data = self._lru_by_sal.get(ArincLabel.Base._reverse_label_number(label & 0xFF), self.lrus[0])
                 key_code, sequence, repeat = A739.get_key_data(label)
                 if not repeat:
-                    self._handle_key(key_code)
+                    lru_data.lru.handle_key(self, key_code)
 
-                mal = self.lrus[0].locked_mal or self.lrus[0].mal_target
-                if mal is not None:
+                mal = lru_data.locked_mal or lru_data.mal_target
+                if mal is not None and lru_data.sender is not None:
                     # Send ACK to MCDU so it stops repeating the key
                     ack_payload = (A739.ACK << 16) | ((label >> 8) & 0xFFFF)
                     ack_word = ArincLabel.Base.pack_dec_no_sdi_no_ssm(mal, ack_payload)
-                    self.dev.send_manual_single_fast(self.lrus[0].lru.channel, ack_word)
+                    lru_data.sender.send_word(ack_word)
 
         try:
-            xml_string = self.datarefs.prosim.cdu1.value
-            if xml_string and xml_string.startswith("<") and xml_string != self._cdu1_text_prev:
+            cdu1 = self.datarefs.prosim.cdu1
+            xml_string = cdu1.value if self.dataref_watch.changed("cdu1", cdu1) else ""
+            if xml_string and xml_string.startswith("<"):
                 self._prosim_lru.update_from_xml(xml_string)
-                self._cdu1_text_prev = xml_string
                 # Force immediate RTS to push new page data
                 for lru_data in self.lrus:
+                    if lru_data.lru is not self._prosim_lru: continue
                     lru_data.heartbeat_elapsed_time = 0
                     if lru_data.mal_target is not None:
                         lru_data.current_request_type = RequestType.DATA.value
                         lru_data.queue(TransmissionState.RTS)
         except Exception as e:
-            log(f"[prosim] dataref read error: {e}")
+            log.error("[prosim] dataref read error: %s", e)
 
         now = time.time()
         for lru_data in self.lrus:
             if (now - lru_data.heartbeat_elapsed_time) >= HEARTBEAT_SEC and lru_data.state != TransmissionState.SEND_DATA:
                 sal_payload = ArincLabel.Base._reverse_label_number(lru_data.lru.sal)
                 sal_id = ArincLabel.Base.pack_dec_no_sdi_no_ssm(0o172, sal_payload)
-                self.dev.send_manual_single_fast(lru_data.lru.channel, sal_id)
+                self.arbiter.submit([(lru_data.lru.channel, sal_id)], priority=PRIORITY_CONTROL)
                 lru_data.heartbeat_elapsed_time = now
             lru_data.update(self, lru_data, received_labels)
+
+        # Each LRU state machine only queues its words; the arbiter decides what goes on the bus
+        self.arbiter.pump()
+
+        await asyncio.sleep(LOOP_PERIOD_SEC)
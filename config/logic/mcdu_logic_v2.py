@@ -1,17 +1,55 @@
 ﻿import asyncio
 from resources.libs.arinc_lib.arinc_lib import ArincLabel
+import os
+import sys
 import time
 from enum import Enum
 from typing import Callable
 import re
-import xml.etree.ElementTree as ET
 import queue
 
+# The helpers shared by the logic scripts live in config/logic/logic_lib
+_LOGIC_DIR = os.path.dirname(os.path.abspath(__file__))
+if _LOGIC_DIR not in sys.path:
+    sys.path.append(_LOGIC_DIR)
+
+from logic_lib.dataref_watch import DatarefWatch
+from logic_lib.lazy import lazy_import
+from logic_lib.page_cache import PageCache
+from logic_lib.screen_encoder import GE_MCDU_GLYPHS, GE_MCDU_INVERSE_OFF, GE_MCDU_INVERSE_ON, ScreenEncoder
+from logic_lib.script_log import ScriptLog
+from logic_lib.tx_queue import TxQueue
+
+# Parser of the cdu1 XML, loaded with the first page
+ET = lazy_import("xml.etree.ElementTree")
+
 # Setup Definitions
 ARINC_CARD_NAME: str = "arinc_1"
 ARINC_CARD_TX_CHNL: int = 3
 ARINC_CARD_RX_CHNL: int = 3
 
+# Console log level: 10=DEBUG, 20=INFO, 30=WARN, 40=ERROR. With profile mode
+# on, calls below the level are dropped at load instead of checked every frame.
+LOG_LEVEL: int = 20
+LOG_PROFILE_MODE: bool = False
+
+# Rendered pages kept for when ProSim shows them again
+PAGE_CACHE_ENTRIES: int = 32
+PAGE_CACHE_BYTES: int = 512 * 1024
+
+# TX queue (see TxQueue): words queued per channel and bus time handed to the
+# card per pump (a bit more than the 80 ms loop, so the bus never idles
+# between pumps)
+TX_QUEUE_WORDS: int = 1024
+TX_LOOKAHEAD_SEC: float = 0.1
+
+
+log = ScriptLog("mcdu_logic_v2", level=LOG_LEVEL, profile=LOG_PROFILE_MODE)
+
+
+# Digits -> the Cyrillic letters standing for their small-font glyphs
+SMALL_DIGITS_TABLE = str.maketrans("0123456789", "АБВГДЕЖЗИЙ")
+
 
 class MCDU:
     class ArgumentException(Exception):
@@ -28,6 +66,8 @@ class MCDU:
 
             self._sal = sal_octal
             self._block = []
+            # Text block encoder, counting the words saved since start
+            self.encoder = ScreenEncoder(self.COL, self.ROW)
 
         def _apply_par(self, label: int) -> int:
             label = label & 0x7FFFFFFF
@@ -63,22 +103,7 @@ class MCDU:
         def add_text(self, offset: int, text: str, color: int = 0):
             block_base = self._sal | 0x400
             block2_base = block_base | 0x40000
-            control = 0;
-
-            
-             # Mapping of Cyrillic characters to corresponding numbers. Used to show small font numbers
-            cyrillic_to_number = {
-                'А': '0',
-                'Б': '1',
-                'В': '2',
-                'Г': '3',
-                'Д': '4',
-                'Е': '5',
-                'Ж': '6',
-                'З': '7',
-                'И': '8',
-                'Й': '9'
-            }
+            control = 0
 
             if offset < 0:
                 raise Exception("Offset should be bigger than 0")
@@ -90,56 +115,21 @@ class MCDU:
                 self._apply_par(block2_base | ((color & 0x1FF) << 20)),
             ]
 
-            # if len(text) > 0:
-            #     self._block += [
-            #         self._char_label(self._sal, c, control)
-            #         for c in text.encode("iso-8859-5")
-            #     ]
-
-            i = 0
-            while i < len(text):
-                c = text[i]
-
-                # Special case for `#` which is the empty box, add the corresponding int (64)
-                if c == "#":
-                    self._block += [self._char_label(0x04, 64, control)]
-
-                # # Check for the sequence "[I]" (start inverted text)
-                # elif c == "[" and i + 2 < len(text) and text[i + 1:i + 3] == "I]":
-                #     # Add empty space to replace the special wrapper
-          
-                #     self._block += [self._char_label(0x04, b, 0) for b in "        ".encode("iso-8859-5")]
-                #     self._block += [self._char_label(0x04, b, 1) for b in " ".encode("iso-8859-5")]
-                #     control = 1 # Start inverted text
-                #     i += 3  # Skip past "[I]"
-                # # Check for the sequence "[/I]" (ende inverted text)
-                # elif c == "[" and i + 3 < len(text) and text[i + 1:i + 4] == "/I]":
-                #     control = 0 # End inverted tex
-                #     i += 4  # Skip past "[/I]"
-    
-                # Inverted, Color 1, 2, Color 3
-                elif c == "Ф":
+            # "#" is the empty box, "`" the ProSim degrees symbol, Cyrillic А..Й the
+            # small-font digits and "Ф"/"Ю" switch inverted text: all in GE_MCDU_GLYPHS
+            for g in text.translate(GE_MCDU_GLYPHS).encode("latin-1"):
+                if g == GE_MCDU_INVERSE_ON:
                     control = 1 # Start inverted text
-
-                elif c == "Ю":
+                elif g == GE_MCDU_INVERSE_OFF:
                     control = 0 # End inverted text
-
-                elif c == "`":
-                    # for degrees symbol prosim uses `
-                    self._block += [self._char_label(0x04, 36, control)]
-
-                elif c in cyrillic_to_number:
-                    # Map Cyrillic characters to numbers and use the same logic as for digits
-                    n = cyrillic_to_number[c]
-                    self._block += [self._char_label(0x04, 16 + int(n), control)]
-
                 else:
-                    # Encode other characters in ISO-8859-5 and add them to the block
-                    self._block += [self._char_label(0x04, b, control) for b in c.encode("iso-8859-5")]
-
-                i += 1
-
+                    self._block.append(self._char_label(0x04, g, control))
 
+        def set_screen(self, text: str):
+            """Encodes the whole screen (title, 12 lines and scratchpad rows) into the fewest text block words."""
+            words = self.encoder.screen_words(text, self._sal)
+            self._block += [self._apply_par(word) for word in words]
+            log.debug("screen: %d words (%d saved since start)", len(words), self.encoder.words_saved)
 
         def format_row(self, left="", center="", right=""):
             # Start with an empty 24-character line filled with spaces
@@ -152,8 +142,7 @@ class MCDU:
                 max_chars += (right or "").count(char)
 
             row = [' '] * max_chars
-            print("max_chars")
-            print(max_chars);
+            log.debug("max_chars %d", max_chars)
     
             # Add the left text, starting at index 0
             if (left):
@@ -181,22 +170,7 @@ class MCDU:
         # used to convert numbers to a special character that can later
         # be used to be shown as a small font number instead
         def convert_numbers_to_cyrillic(self, text):
-
-            # Mapping of numbers to Cyrillic letters (ISO-8859-5)
-            number_to_cyrillic = {
-                '0': 'А',  # ISO-8859-5 0410
-                '1': 'Б',  # ISO-8859-5 0411
-                '2': 'В',  # ISO-8859-5 0412
-                '3': 'Г',  # ISO-8859-5 0413
-                '4': 'Д',  # ISO-8859-5 0414
-                '5': 'Е',  # ISO-8859-5 0415
-                '6': 'Ж',  # ISO-8859-5 0416
-                '7': 'З',  # ISO-8859-5 0417
-                '8': 'И',  # ISO-8859-5 0418
-                '9': 'Й'   # ISO-8859-5 0419
-            }
-
-            return ''.join(number_to_cyrillic.get(c, c) for c in text)
+            return text.translate(SMALL_DIGITS_TABLE)
 
 
         def parse_display_line(self, input_str, lower_case = False):
@@ -394,6 +368,9 @@ class MCDU:
         # Get reference to receiving queue. This is to make things faster
         self._rx_queue = self._device._rx_chnl[self._rx_chnl]._label_queue
 
+        # Frames waiting for the bus. Counters are in tx.counters()
+        self.tx = TxQueue(self._device, TX_QUEUE_WORDS, TX_LOOKAHEAD_SEC, log=log)
+
         # Ready to update subsystems flag
         self._trig_update = False
 
@@ -515,24 +492,22 @@ class MCDU:
                 for _, subsystem in self._subsystem.items():
 
                     self._tx_buffer += subsystem._block
-                    subsystem._block = []
 
                     file = self._close_frame()
                     # print("file")
                     # print(file)
 
-                    lwc = []
-                    for l in file:
-                        lwc.append((ARINC_CARD_TX_CHNL, l))
-
-                    # print("lwc")
-                    # print(file)
+                    """Update panel queuing the frame for the TX channel"""
+                    if self.tx.put(ARINC_CARD_TX_CHNL, file):
+                        subsystem._block = []
+                    else:
+                        # The block stays for the next tick instead of waiting for the next page
+                        self._trig_update = True
+                        log.warn("TX queue full, frame of %d words kept for the next tick (%d words refused so far)",
+                                 len(file), self.tx.dropped)
 
-                    """Update panel sending the TX buffer"""
-                    try:
-                        self._device.send_manual_list_fast(lwc)
-                    except Exception:
-                        pass
+            # Hand what the bus can take to the card
+            self.tx.pump()
 
             # time.sleep(0.05)
 
@@ -559,6 +534,10 @@ class Logic:
             "xml_scratchpad": ""
         }
         self.run_again = 0
+        self.page_cache = PageCache(PAGE_CACHE_ENTRIES, PAGE_CACHE_BYTES)
+        self.dataref_watch = DatarefWatch()
+        # cdu1 changed since the page was last taken as cdu1_text
+        self.cdu1_stale = False
 
     def key_pressed_callback(self, name):
         if name != 4612:
@@ -589,7 +568,10 @@ class Logic:
         # print(self.cdu1_text)
         # print("")
 
-        xml_string = self.datarefs.prosim.cdu1.value
+        cdu1 = self.datarefs.prosim.cdu1
+        if self.dataref_watch.changed("cdu1", cdu1):
+            self.cdu1_stale = True
+        xml_string = cdu1.value if self.cdu1_stale else ""
         light_exec = self.datarefs.prosim.I_CDU1_EXEC.value
         light_fail = self.datarefs.prosim.I_CDU1_FAIL.value
         light_msg = self.datarefs.prosim.I_CDU1_MSG.value
@@ -603,10 +585,8 @@ class Logic:
         # inverted color
 
 
-        if ( xml_string.startswith("<") and xml_string != self.cdu1_text and self.run_again <= 2):
-            print("xml_string")
-            print(xml_string)
-            print(len(xml_string))
+        if ( xml_string.startswith("<") and self.run_again <= 2):
+            log.debug("xml_string (%d chars): %s", len(xml_string), xml_string)
       #  if (xml_string != self.cdu1_text):
 
             # self.fmc_subsys.add_text(1, "inversed", control=1)
@@ -616,50 +596,64 @@ class Logic:
             # print(xml_string)
             if (self.run_again == 1):
                 self.cdu1_text = xml_string
+                self.cdu1_stale = False
                 self.run_again = 0
 
             offset = 0;
             self.run_again = self.run_again + 1
             
-            xml_result = self.fmc_subsys.parse_xml(xml_string)
-            xml_lines = xml_result["lines"]
-            xml_title_page = xml_result["title_page"]
-            xml_scratchpad = xml_result["scratchpad"]
-            xml_title = self.fmc_subsys.parse_display_line(xml_result["title"])
-            xml_title_spaces = int(xml_title[1]) if xml_title[1] else "" 
-            xml_title_left_align = xml_title[0]  if xml_title[0] else ""
-
-            # Add Page Title. If title has spaces in the xml, then add the spaces and flush to the left
-            # If the title doesn't have spaces then center it.
-            self.fmc_subsys.add_text(0,  
-                self.fmc_subsys.format_row(
-                    ' ' * xml_title_spaces + xml_title[2] if xml_title_left_align == "True" else "",
-                    xml_title[2] if xml_title_left_align == "False" else "", 
-                self.fmc_subsys.convert_numbers_to_cyrillic(xml_title_page) if xml_title_page else "" ))
+            key = PageCache.key(xml_string)
+            cached = self.page_cache.get(key)
+            if cached is not None:
+                words, xml_lines, xml_scratchpad = cached
+                self.fmc_subsys._block += words
+            else:
+                start = len(self.fmc_subsys._block)
+                xml_result = self.fmc_subsys.parse_xml(xml_string)
+                xml_lines = xml_result["lines"]
+                xml_title_page = xml_result["title_page"]
+                xml_scratchpad = xml_result["scratchpad"]
+                xml_title = self.fmc_subsys.parse_display_line(xml_result["title"])
+                xml_title_spaces = int(xml_title[1]) if xml_title[1] else "" 
+                xml_title_left_align = xml_title[0]  if xml_title[0] else ""
+
+                # Add Page Title. If title has spaces in the xml, then add the spaces and flush to the left
+                # If the title doesn't have spaces then center it.
+                rows = [
+                    self.fmc_subsys.format_row(
+                        ' ' * xml_title_spaces + xml_title[2] if xml_title_left_align == "True" else "",
+                        xml_title[2] if xml_title_left_align == "False" else "", 
+                    self.fmc_subsys.convert_numbers_to_cyrillic(xml_title_page) if xml_title_page else "" )
+                ]
             
-            #Add Lines
-            for ln in range(12):
-                # check that the line has changed
-                # if (xml_lines[ln] != self.cdu_xml["xml_lines"][ln]):
-                xml1 = self.fmc_subsys.parse_display_line(xml_lines[ln], ln % 2 == 0)
-                self.fmc_subsys.add_text(offset, 
-                    self.fmc_subsys.format_row(*xml1)
-                )
-                # else:
-                #     offset = offset + 0 #100
-
-            # test with updating loop numbert count
-            # self.fmc_subsys.add_text(0,  
-            #     self.fmc_subsys.format_row(str(self.run_again), "", "")
-            # )
-
-            # check the scratch pad has changed and update
-            # if (self.cdu_xml["xml_scratchpad"] != xml_scratchpad):
-            self.fmc_subsys.add_text(offset,  
-                self.fmc_subsys.format_row(xml_scratchpad, "", "")
-            )
-            # print("offset")
-            # print(offset)
+                #Add Lines
+                for ln in range(12):
+                    # check that the line has changed
+                    # if (xml_lines[ln] != self.cdu_xml["xml_lines"][ln]):
+                    xml1 = self.fmc_subsys.parse_display_line(xml_lines[ln], ln % 2 == 0)
+                    rows.append(self.fmc_subsys.format_row(*xml1))
+                    # else:
+                    #     offset = offset + 0 #100
+
+                # test with updating loop numbert count
+                # self.fmc_subsys.add_text(0,  
+                #     self.fmc_subsys.format_row(str(self.run_again), "", "")
+                # )
+
+                # check the scratch pad has changed and update
+                # if (self.cdu_xml["xml_scratchpad"] != xml_scratchpad):
+                rows.append(self.fmc_subsys.format_row(xml_scratchpad, "", ""))
+
+                # One encoding pass over the whole screen instead of one block per row
+                self.fmc_subsys.set_screen("".join(rows))
+                # print("offset")
+                # print(offset)
+
+                words = self.fmc_subsys._block[start:]
+                # ints of up to 32 bits take 32 bytes each
+                self.page_cache.put(key, (words, xml_lines, xml_scratchpad), sys.getsizeof(words) + 32 * len(words))
+                log.debug("page cache: %d hits, %d misses, %d pages, %d bytes", self.page_cache.hits,
+                          self.page_cache.misses, len(self.page_cache), self.page_cache.bytes)
 
             self.cdu_xml["xml_scratchpad"] = xml_scratchpad;
             self.cdu_xml["xml_lines"] = xml_lines;
@@ -671,9 +665,10 @@ class Logic:
         off_key = self.mcdu.key_queue_pop()
         if (off_key):
             getattr(self.datarefs.prosim, off_key).value = 0
-   
-      
-        time.sleep(0.08)
+
+        # Yield to the event loop: a blocking sleep here stalls every other
+        # logic sharing the loop (the 10 ms EFIS loop) for the whole period
+        await asyncio.sleep(0.08)
         
 
         
\ No newline at end of file
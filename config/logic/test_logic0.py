@@ -1,5 +1,27 @@
+import bisect
 import math
-from scipy import interpolate
+
+
+class Interp1d:
+    """Piecewise linear interpolation, a stand-in for scipy's interp1d(kind="linear").
+
+    scipy takes about a second to import and this script only needs straight
+    lines between points. As with interp1d, x must be increasing and values
+    outside the table raise ValueError.
+    """
+
+    def __init__(self, x: list, y: list):
+        self.x = [float(v) for v in x]
+        self.y = [float(v) for v in y]
+
+    def __call__(self, value: float) -> float:
+        x = self.x
+        if not x[0] <= value <= x[-1]:
+            raise ValueError(f"{value} is outside the interpolation range {x[0]}..{x[-1]}")
+        i = min(bisect.bisect_right(x, value), len(x) - 1)
+        x0, x1 = x[i - 1], x[i]
+        y0, y1 = self.y[i - 1], self.y[i]
+        return y0 + (y1 - y0) * (value - x0) / (x1 - x0)
 
 
 class Logic:
@@ -18,25 +40,25 @@ class Logic:
         flaps_y = [0.0, 0.644, 1.309, 1.922, 2.56, 3.115, 3.655, 4.178, 4.696]
         # Flaps Prosim Values
         flaps_x = [0.0, 1.0, 2.0, 3.0, 4.0, 5.0, 6.0, 7.0, 8.0]
-        self.flpInpl = interpolate.interp1d(flaps_x, flaps_y, kind="linear")
+        self.flpInpl = Interp1d(flaps_x, flaps_y)
 
         # Rudder Angles
         rudder_y = [-0.99, -0.95, -0.8, -0.4, -0.1, 0.24, 0.57, 0.95, 0.99]
         # Rudder prosim Values
         rudder_x = [-17, -15, -10, -5, 0, 5, 10, 15, 17]
-        self.rdsInp = interpolate.interp1d(rudder_x, rudder_y, kind="linear")
+        self.rdsInp = Interp1d(rudder_x, rudder_y)
 
         # SAI Vertical Needle Angles
         sai_needle_vt_y =  [3.0, -1.75, 0, 1.75]
         # SAI Vertical Needle prosim Values
         sai_needle_vt_x = [-40, -39, 0, 40]
-        self.saiNdlVertInp = interpolate.interp1d(sai_needle_vt_x, sai_needle_vt_y, kind="linear")
+        self.saiNdlVertInp = Interp1d(sai_needle_vt_x, sai_needle_vt_y)
 
         # SAI Horizontal Needle Angles
         sai_needle_hz_y =  [1.75, 0, -1.75, 3.0]
         # SAI Horizontal Needle prosim Values
         sai_needle_hz_x = [-25, 0, 24, 25]
-        self.saiNdlHozInp = interpolate.interp1d(sai_needle_hz_x, sai_needle_hz_y, kind="linear")
+        self.saiNdlHozInp = Interp1d(sai_needle_hz_x, sai_needle_hz_y)
 
 
     async def update(self):
@@ -0,0 +1,7 @@
+"""Offline development tools for the AES-Aviologic logic scripts.
+
+These modules run the scripts under config/logic outside the cockpit PC:
+without the ARINC card, without ProSim and without the GUI. Modules that
+load logic scripts need the AES-Aviologic installation on the Python path,
+because the scripts import ``resources.libs.arinc_lib`` from it.
+"""
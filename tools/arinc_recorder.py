@@ -0,0 +1,254 @@
+"""ARINC traffic recorder and replay
+
+Records every RX and TX word of an A429 card to a binary file and plays a
+recording back into the RX queues, at the original speed, faster, or as fast
+as the logic script consumes it.
+
+- File format
+The file is a sequence of fixed 16 byte little-endian records:
+
+    offset  size  field
+    0       8     timestamp (float64, seconds, card clock)
+    8       1     direction (0 = RX, 1 = TX)
+    9       1     channel number
+    10      2     flags (reserved, 0)
+    12      4     ARINC word
+
+The first record is the file header: the 8 byte magic ``A429REC1`` followed
+by the format version and the recording start time (wall clock, whole
+seconds). Because all records have the same size, the reader maps the file
+and indexes it directly; a recording of hours of traffic opens instantly.
+
+- Recording a card
+``ArincRecorder.attach(card)`` wraps the card's ``send_manual_*_fast``
+methods and replaces each RX ``_label_queue`` with a deque that records what
+the driver appends. This works with the virtual card and with any driver
+that appends to ``_label_queue`` through the attribute. Attach before the
+logic script is created: scripts keep a reference to the queue.
+"""
+
+import asyncio
+import collections
+import mmap
+import struct
+import threading
+import time
+from typing import Callable
+
+RECORD = struct.Struct("<dBBHI")
+RECORD_SIZE: int = RECORD.size  # 16
+MAGIC: bytes = b"A429REC1"
+HEADER = struct.Struct("<8sHHI")
+VERSION: int = 1
+
+RX: int = 0
+TX: int = 1
+
+
+class RecordingDeque(collections.deque):
+    """RX label queue that also writes every appended word to a recorder."""
+
+    def __init__(self, recorder: "ArincRecorder", chnl: int, items=()):
+        super().__init__(items)
+        self._recorder = recorder
+        self._chnl = chnl
+
+    def append(self, item):
+        label, timestamp = item
+        self._recorder.write(RX, self._chnl, label, timestamp)
+        super().append(item)
+
+
+class ArincRecorder:
+    """Writes ARINC words to a recording file.
+
+    Args:
+        path (str): output file
+        clock (Callable): time source for TX words (RX words keep the driver timestamp)
+        buffer_records (int): records kept in memory before they are written out
+    """
+
+    def __init__(self, path: str, clock: Callable[[], float] = time.monotonic, buffer_records: int = 4096):
+        self._file = open(path, "wb")
+        self._file.write(HEADER.pack(MAGIC, VERSION, 0, int(time.time())))
+        self._clock = clock
+        self._buffer = bytearray()
+        self._buffer_bytes = buffer_records * RECORD_SIZE
+        # The driver appends RX words from its own thread
+        self._lock = threading.Lock()
+        self.count = 0
+
+    def write(self, direction: int, chnl: int, word: int, timestamp: float = None):
+        record = RECORD.pack(self._clock() if timestamp is None else timestamp, direction, chnl, 0, word & 0xFFFFFFFF)
+        with self._lock:
+            self._buffer += record
+            self.count += 1
+            if len(self._buffer) >= self._buffer_bytes:
+                self._file.write(self._buffer)
+                self._buffer = bytearray()
+
+    def flush(self):
+        with self._lock:
+            self._file.write(self._buffer)
+            self._buffer = bytearray()
+            self._file.flush()
+
+    def close(self):
+        self.flush()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def attach(self, card):
+        """Records all traffic of a card from now on. See the module documentation."""
+        for number, chnl in card._rx_chnl.items():
+            chnl._label_queue = RecordingDeque(self, number, chnl._label_queue)
+
+        send_list = card.send_manual_list_fast
+        send_single = card.send_manual_single_fast
+
+        def send_manual_list_fast(labels: list):
+            send_list(labels)
+            now = self._clock()
+            for chnl, label in labels:
+                self.write(TX, chnl, label, now)
+
+        def send_manual_single_fast(chnl: int, label: int):
+            send_single(chnl, label)
+            self.write(TX, chnl, label)
+
+        card.send_manual_list_fast = send_manual_list_fast
+        card.send_manual_single_fast = send_manual_single_fast
+
+
+class ArincRecording:
+    """Memory-mapped read access to a recording file.
+
+    Indexing returns ``(timestamp, direction, chnl, word)`` tuples.
+    """
+
+    def __init__(self, path: str):
+        self._file = open(path, "rb")
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, _, self.started = HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not an ARINC recording")
+        if version != VERSION:
+            raise ValueError(f"{path}: unsupported recording version {version}")
+        # A recording cut short by a crash may end with a partial record
+        self._len = len(self._map) // RECORD_SIZE - 1
+
+    def __len__(self) -> int:
+        return self._len
+
+    def __getitem__(self, index: int) -> tuple:
+        if index < 0:
+            index += self._len
+        if not 0 <= index < self._len:
+            raise IndexError(index)
+        timestamp, direction, chnl, _, word = RECORD.unpack_from(self._map, (index + 1) * RECORD_SIZE)
+        return timestamp, direction, chnl, word
+
+    def __iter__(self):
+        view = memoryview(self._map)[RECORD_SIZE:(self._len + 1) * RECORD_SIZE]
+        try:
+            for timestamp, direction, chnl, _, word in RECORD.iter_unpack(view):
+                yield timestamp, direction, chnl, word
+        finally:
+            view.release()
+
+    def bisect(self, timestamp: float) -> int:
+        """Index of the first record at or after ``timestamp``."""
+        lo, hi = 0, self._len
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self[mid][0] < timestamp:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    @property
+    def duration(self) -> float:
+        return self[-1][0] - self[0][0] if self._len else 0.0
+
+    def close(self):
+        self._map.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class ArincReplay:
+    """Feeds the RX words of a recording into a card's ``_label_queue``.
+
+    Args:
+        recording (ArincRecording): recording to play
+        card: card whose RX queues receive the words (virtual or real)
+        speed (float): 1.0 plays at the recorded rate, 10.0 ten times faster.
+                       None releases ``batch`` words per step, as fast as the script consumes them
+        channel_map (dict): recorded RX channel -> card RX channel. Defaults to the same numbers
+        start (float): recording time to start from. Defaults to the first record
+        clock (Callable): time source for the paced modes
+        batch (int): words per step when ``speed`` is None
+    """
+
+    def __init__(self, recording: ArincRecording, card, speed: float | None = 1.0, channel_map: dict = None,
+                 start: float = None, clock: Callable[[], float] = time.monotonic, batch: int = 64):
+        self.recording = recording
+        self.speed = speed
+        self.batch = batch
+        self._clock = clock
+        self._queues = {}
+        for number, chnl in card._rx_chnl.items():
+            self._queues[number] = chnl._label_queue
+        self._map = channel_map or {}
+        self._pos = 0 if start is None else recording.bisect(start)
+        self._rec_t0 = recording[self._pos][0] if self._pos < len(recording) else 0.0
+        self._t0 = None
+        self.delivered = 0
+
+    @property
+    def done(self) -> bool:
+        return self._pos >= len(self.recording)
+
+    def step(self, now: float = None):
+        """Delivers the words that are due. Words keep their recorded timestamps."""
+        now = self._clock() if now is None else now
+        if self._t0 is None:
+            self._t0 = now
+        if self.speed is None:
+            limit = None
+            budget = self.batch
+        else:
+            limit = self._rec_t0 + (now - self._t0) * self.speed
+            budget = None
+        rec = self.recording
+        end = len(rec)
+        while self._pos < end and (budget is None or budget > 0):
+            timestamp, direction, chnl, word = rec[self._pos]
+            if limit is not None and timestamp > limit:
+                break
+            self._pos += 1
+            if direction != RX:
+                continue
+            queue = self._queues.get(self._map.get(chnl, chnl))
+            if queue is not None:
+                queue.append((word, timestamp))
+                self.delivered += 1
+                if budget is not None:
+                    budget -= 1
+
+    async def run(self, period_sec: float = 0.001):
+        """Steps the replay until the recording ends. Run it as an asyncio task next to the logic script."""
+        while not self.done:
+            self.step()
+            await asyncio.sleep(period_sec)
@@ -0,0 +1,319 @@
+"""Benchmark harness for logic scripts
+
+Runs one or more logic scripts over the same corpus of dataref frames and
+reports, per script:
+
+- script load time in ms: module import and ``Logic()`` creation
+- ns per ``update()`` call: mean, p50, p99 and max. p99 is null below 100
+  measured calls, where it could only repeat the max
+- ARINC words sent per corpus page
+- memory allocated per tick (tracemalloc): mean and max of the peak bytes
+  allocated during one ``update()``, and the net number of memory blocks
+  left behind per tick
+
+The scripts run in a ``LogicHost`` with virtual cards and the matching panel
+emulator, on a virtual clock that advances ``--tick-ms`` per update. The
+event loop time follows the same clock, so bus pacing and reply timeouts
+behave as on the real bus. The ``asyncio.sleep`` and ``time.sleep`` calls of
+the script only yield to the event loop, so the numbers are the script's own
+CPU time. The first ``--warmup`` ticks are not measured.
+
+A corpus is a JSON list of frames, each a ``{dataref: value}`` object, or a
+dataref recording (``tools.dataref_recorder``). Without ``--corpus`` a few
+built-in cdu1 pages and HGS lines are used.
+
+Usage:
+    python -m tools.bench_logic config/logic/mcdu_logic_v2.py config/logic/mcdu_logic_A739_v3.py -o bench.json
+    python -m tools.bench_logic config/logic/hud_logic.py --baseline bench.json
+
+The output is JSON. With ``--baseline`` the change against a previous output
+is printed for every metric.
+"""
+
+import argparse
+import asyncio
+import gc
+import json
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+import types
+
+from tools.logic_host import LogicHost
+from tools import panel_emulators
+
+DELIM = "¨"
+
+# 50 ticks on each of the 3 built-in pages give the 100+ samples a p99 needs
+TICKS_PER_PAGE: int = 50
+
+BUILTIN_CORPUS = [
+    {
+        "cdu1": "<root><title>False" + DELIM + DELIM + "ACT RTE 1 LEGS</title><titlePage>1/3</titlePage>"
+        + "".join(f"<line>[s]{hdg:03d}`[/s]" + DELIM + f"[s]{nm} NM[/s]</line><line>WPT{i:02d}" + DELIM
+                  + f"[2]{250 + i}/ FL{300 + i * 10}[/2]</line>" for i, (hdg, nm) in enumerate(
+                      [(95, 12), (102, 31), (180, 8), (275, 44), (4, 19)]))
+        + "<line>[l]------------------------[/l]</line><line>&lt;RTE 2 LEGS" + DELIM + "RTE DATA&gt;</line>"
+        + "<scratchpad></scratchpad></root>",
+        "hgscp_display_line1": "PRI", "hgscp_display_line2": "RWY 09L",
+        "hgscp_display_line3": "GS 3.00_", "hgscp_display_line4": "",
+        "I_HGS_AP_FLARE": 0, "I_HGS_AP_APP": 2,
+    },
+    {
+        "cdu1": "<root><title>False" + DELIM + DELIM + "PERF INIT</title><titlePage>1/2</titlePage>"
+        + "<line>[s]GW/CRZ CG[/s]" + DELIM + "[s]TRIP/CRZ ALT[/s]</line><line>[]].[]/ 10.0%" + DELIM
+        + "FL350</line><line>[s]PLAN/FUEL[/s]" + DELIM + "[s]CRZ WIND[/s]</line><line>----.-/  12.4" + DELIM
+        + "---`/---</line><line>[s]ZFW[/s]" + DELIM + "[s]ISA DEV[/s]</line><line>[][][].[]" + DELIM
+        + "---`F ---`C</line><line>[s]RESERVES[/s]" + DELIM + "[s]T/C OAT[/s]</line><line>[][].[]" + DELIM
+        + "-56`C -69`F</line><line>[s]COST INDEX[/s]" + DELIM + "[s]TRANS ALT[/s]</line><line>[][][]" + DELIM
+        + "18000</line><line>------------------------</line><line>&lt;INDEX" + DELIM + "N1 LIMIT&gt;</line>"
+        + "<scratchpad>ENTER ZFW</scratchpad></root>",
+        "hgscp_display_line1": "AIII", "hgscp_display_line2": "RWY 09L",
+        "hgscp_display_line3": "GS 3.00", "hgscp_display_line4": "TEST",
+        "I_HGS_AP_FLARE": 2, "I_HGS_AP_APP": 0,
+    },
+    {
+        "cdu1": "<root><title>False" + DELIM + DELIM + "INIT/REF INDEX</title><titlePage>1/1</titlePage>"
+        + "".join(f"<line></line><line>&lt;{left}" + DELIM + f"{right}&gt;</line>" for left, right in
+                  [("IDENT", "NAV DATA"), ("POS", ""), ("PERF", ""), ("TAKEOFF", ""), ("APPROACH", ""),
+                   ("OFFSET", "MAINT")])
+        + "<scratchpad></scratchpad></root>",
+        "hgscp_display_line1": "", "hgscp_display_line2": "",
+        "hgscp_display_line3": "", "hgscp_display_line4": "",
+        "I_HGS_AP_FLARE": 0, "I_HGS_AP_APP": 0,
+    },
+]
+
+
+def load_corpus(path: str | None) -> list:
+    """Returns a list of ``{dataref: value}`` frames."""
+    if path is None:
+        return BUILTIN_CORPUS
+    if path.endswith(".json"):
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    from tools.dataref_recorder import DatarefRecording
+
+    recording = DatarefRecording(path)
+    frames = []
+    frame_time = None
+    for i in range(len(recording)):
+        timestamp, name, value = recording[i]
+        if timestamp != frame_time:
+            frames.append({})
+            frame_time = timestamp
+        frames[-1][name] = value
+    return frames
+
+
+def _yielding_sleep_shim(module):
+    """Returns a stand-in for the asyncio or time module whose sleep only yields to the event loop."""
+    shim = types.ModuleType(module.__name__)
+    shim.__dict__.update(module.__dict__)
+    if module is asyncio:
+        real_sleep = asyncio.sleep
+
+        async def sleep(delay, result=None):
+            await real_sleep(0)
+            return result
+    else:
+
+        def sleep(secs):
+            pass
+
+    shim.sleep = sleep
+    return shim
+
+
+class _VirtualTimeLoop(asyncio.SelectorEventLoop):
+    """Event loop whose time() is the benchmark's virtual clock."""
+
+    def __init__(self, clock):
+        super().__init__()
+        self._virtual_clock = clock
+
+    def time(self) -> float:
+        return self._virtual_clock()
+
+
+def _percentile(values: list, q: float) -> float | None:
+    """None when there are too few values for the percentile to differ from the max."""
+    if len(values) * (1 - q) < 1:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+async def _run(script_path: str, config_dir: str, corpus: list, now: list, ticks_per_page: int, tick_sec: float,
+               warmup: int, trace_alloc: bool) -> dict:
+    host = LogicHost(script_path, config_dir, clock=lambda: now[0])
+    host.load()
+    module = host.module
+    for name, value in list(vars(module).items()):
+        if value is asyncio or value is time:
+            setattr(module, name, _yielding_sleep_shim(value))
+    emulator = panel_emulators.for_script(next(iter(host.devices.values())), script_path)
+    if emulator is not None:
+        panel_emulators.attach(host, emulator)
+
+    words = [0]
+    for card in host.devices.values():
+        send_list = card.send_manual_list_fast
+        send_single = card.send_manual_single_fast
+
+        def send_manual_list_fast(labels, send_list=send_list):
+            words[0] += len(labels)
+            send_list(labels)
+
+        def send_manual_single_fast(chnl, label, send_single=send_single):
+            words[0] += 1
+            send_single(chnl, label)
+
+        card.send_manual_list_fast = send_manual_list_fast
+        card.send_manual_single_fast = send_manual_single_fast
+
+    logic = host.logic
+    prosim = host.datarefs.prosim
+    update_ns = []
+    page_words = []
+    alloc_peaks = []
+    blocks_before = blocks_after = None
+    for name, value in corpus[0].items():
+        prosim.set(name, value)
+    for _ in range(warmup):
+        now[0] += tick_sec
+        host.step(now[0])
+        await logic.update()
+    words[0] = 0
+    # Leftovers of earlier runs must not be collected inside a measured tick,
+    # and a collection triggered by the harness must not be billed to the script
+    gc.collect()
+    gc.disable()
+    if trace_alloc:
+        tracemalloc.start()
+        blocks_before = sum(s.count for s in tracemalloc.take_snapshot().statistics("filename"))
+    for frame in corpus:
+        for name, value in frame.items():
+            prosim.set(name, value)
+        start_words = words[0]
+        for _ in range(ticks_per_page):
+            now[0] += tick_sec
+            host.step(now[0])
+            if trace_alloc:
+                tracemalloc.reset_peak()
+                base = tracemalloc.get_traced_memory()[0]
+                await logic.update()
+                alloc_peaks.append(tracemalloc.get_traced_memory()[1] - base)
+            else:
+                t0 = time.perf_counter_ns()
+                await logic.update()
+                update_ns.append(time.perf_counter_ns() - t0)
+        page_words.append(words[0] - start_words)
+    gc.enable()
+    if trace_alloc:
+        blocks_after = sum(s.count for s in tracemalloc.take_snapshot().statistics("filename"))
+        tracemalloc.stop()
+        ticks = len(alloc_peaks)
+        return {
+            "peak_bytes_per_tick_mean": statistics.fmean(alloc_peaks),
+            "peak_bytes_per_tick_max": max(alloc_peaks),
+            "net_blocks_per_tick": (blocks_after - blocks_before) / ticks,
+        }
+    return {
+        "script": os.path.basename(script_path),
+        "version": getattr(logic, "version", None),
+        "load_ms": {k: v * 1000 for k, v in host.load_times.items()},
+        "ticks": len(update_ns),
+        "pages": len(corpus),
+        "ns_per_update": {
+            "mean": statistics.fmean(update_ns),
+            "p50": _percentile(update_ns, 0.50),
+            "p99": _percentile(update_ns, 0.99),
+            "max": max(update_ns),
+        },
+        "words_total": sum(page_words),
+        "words_per_page": statistics.fmean(page_words),
+    }
+
+
+async def _cancel_pending():
+    tasks = asyncio.all_tasks() - {asyncio.current_task()}
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
+def bench(script_path: str, config_dir: str, corpus: list, ticks_per_page: int = TICKS_PER_PAGE, tick_sec: float = 0.01,
+          warmup: int = 10) -> dict:
+    """Benchmarks one script. Timing and allocation tracing run as separate passes."""
+    results = []
+    for trace_alloc in (False, True):
+        now = [0.0]
+        loop = _VirtualTimeLoop(lambda: now[0])
+        try:
+            results.append(loop.run_until_complete(
+                _run(script_path, config_dir, corpus, now, ticks_per_page, tick_sec, warmup, trace_alloc)))
+        finally:
+            # Transfers the script left running (e.g. A739 pages) end with the run
+            loop.run_until_complete(_cancel_pending())
+            loop.close()
+    result, result["alloc"] = results
+    return result
+
+
+def _flatten(result: dict, prefix: str = "") -> dict:
+    out = {}
+    for key, value in result.items():
+        if isinstance(value, dict):
+            out.update(_flatten(value, f"{prefix}{key}."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            out[f"{prefix}{key}"] = value
+    return out
+
+
+def compare(results: list, baseline: list) -> list:
+    """Returns ``(script, metric, baseline, current, percent change)`` for the scripts in both runs."""
+    base = {r["script"]: _flatten(r) for r in baseline}
+    rows = []
+    for result in results:
+        old = base.get(result["script"])
+        if old is None:
+            continue
+        for metric, value in _flatten(result).items():
+            if metric in old and old[metric]:
+                rows.append((result["script"], metric, old[metric], value, (value - old[metric]) * 100 / old[metric]))
+    return rows
+
+
+def main(argv: list = None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("scripts", nargs="+", help="logic scripts to benchmark")
+    parser.add_argument("--config", default="config", help="config directory (default: config)")
+    parser.add_argument("--corpus", help="JSON frame list or dataref recording")
+    parser.add_argument("--ticks", type=int, default=TICKS_PER_PAGE,
+                        help=f"update() calls per corpus page (default: {TICKS_PER_PAGE})")
+    parser.add_argument("--tick-ms", type=float, default=10.0, help="virtual time per update() (default: 10)")
+    parser.add_argument("--warmup", type=int, default=10, help="unmeasured update() calls first (default: 10)")
+    parser.add_argument("-o", "--output", help="write the JSON results to this file")
+    parser.add_argument("--baseline", help="previous JSON results to compare against")
+    args = parser.parse_args(argv)
+
+    corpus = load_corpus(args.corpus)
+    results = [bench(s, args.config, corpus, args.ticks, args.tick_ms / 1000, args.warmup) for s in args.scripts]
+    text = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text)
+    else:
+        print(text)
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        for script, metric, old, new, change in compare(results, baseline):
+            print(f"{script:32} {metric:36} {old:14.1f} {new:14.1f} {change:+7.1f}%", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
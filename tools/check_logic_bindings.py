@@ -0,0 +1,408 @@
+"""Static check of logic script bindings
+
+Resolves the references a logic script makes to its environment against the
+configuration, without running the script:
+
+- ``self.vars.<var>.value``: a function of a device in config/device
+  ("var_name", e.g. the synchro outputs).
+- ``self.vars.<equipment>.<label>.<field>``: an equipment linked to a card
+  channel ("link_equipment"); the label must exist in the equipment file and
+  the field must be ``value``, ``packet`` or one of the label's pad bits,
+  or ``fresh``/``age`` for RX labels with "timing_ms" (see
+  ``tools.label_monitor``).
+- ``self.datarefs.prosim.<name>.value``: a dataref of config/sim/prosim.json
+  whose ProSim name is in misc/prosim-datarefs-database.json.
+- ``self.devices[<name>]``: a device "name" of config/device. Module level
+  string constants such as ``ARINC_CARD_NAME`` are resolved.
+
+References through an alias (``ps = self.datarefs.prosim``,
+``self._ann = self.vars.hgs_annunciator.annunciator``) are followed, and so
+are dataref names passed as string literals to methods that end in
+``getattr(self.datarefs.prosim, name)``, like ``send_key_value``, and the
+values of a dict literal a name is looked up in before such a ``getattr``.
+Names computed at run time cannot be checked and are counted as dynamic.
+
+A binding that does not resolve is what fails every loop iteration at run
+time with an ``AttributeError``. Run this before enabling a script:
+
+    python -m tools.check_logic_bindings config/logic/*.py
+
+It exits with status 1 if any binding does not resolve. ``LogicHost`` runs
+the same check before creating the Logic instance when ``check_bindings``
+is set, and resolves the slots the bindings name (the dataref, var, label
+and device objects) once at load.
+"""
+
+import argparse
+import ast
+import json
+import os
+import sys
+
+LABEL_FIELDS = {"value", "packet"}
+MONITOR_FIELDS = {"fresh", "age"}
+VAR_FIELDS = {"value"}
+DATAREF_FIELDS = {"value"}
+
+
+class BindingIndex:
+    """Everything a script can bind to, loaded from a config directory.
+
+    Args:
+        config_dir (str): directory holding device/, arinc/equipment/ and sim/
+        database_path (str): ProSim dataref database; None skips the ProSim name check
+    """
+
+    def __init__(self, config_dir: str, database_path: str = None):
+        # device name -> enabled
+        self.devices = {}
+        # var name -> enabled, for device functions
+        self.vars = {}
+        # equipment namespace -> {label: set of fields}
+        self.equipment = {}
+        # dataref name -> ProSim name
+        self.datarefs = {}
+        self.database = None
+        device_dir = os.path.join(config_dir, "device")
+        for file_name in sorted(os.listdir(device_dir)):
+            if not file_name.endswith(".json"):
+                continue
+            with open(os.path.join(device_dir, file_name), encoding="utf-8") as f:
+                settings = json.load(f).get("settings", {})
+            if "name" in settings:
+                self.devices[settings["name"]] = settings.get("enable", True)
+            for function in settings.get("functions", []):
+                self.vars[function["var_name"]] = function.get("enable", True)
+            for direction in ("RX_channels", "TX_channels"):
+                for chnl in settings.get(direction, {}).values():
+                    for ns_name, equipment_name in chnl.get("link_equipment", {}).items():
+                        self.equipment[ns_name] = self._load_equipment(config_dir, equipment_name)
+        sim_path = os.path.join(config_dir, "sim", "prosim.json")
+        if os.path.exists(sim_path):
+            with open(sim_path, encoding="utf-8") as f:
+                self.datarefs = {name: cfg.get("name") for name, cfg in json.load(f).get("datarefs", {}).items()}
+        if database_path and os.path.exists(database_path):
+            with open(database_path, encoding="utf-8") as f:
+                self.database = set(json.load(f))
+
+    @staticmethod
+    def _load_equipment(config_dir: str, equipment_name: str) -> dict:
+        path = os.path.join(config_dir, "arinc", "equipment", f"{equipment_name}.json")
+        if not os.path.exists(path):
+            return {}
+        with open(path, encoding="utf-8") as f:
+            labels = json.load(f).get("labels", {})
+        return {
+            name: LABEL_FIELDS | set(cfg.get("pad_bits", {}))
+            | (MONITOR_FIELDS if cfg.get("channel_direction", "RX") == "RX" and cfg.get("timing_ms") else set())
+            for name, cfg in labels.items()
+        }
+
+    def check_dataref(self, name: str) -> str | None:
+        """Returns the problem with a dataref name, None if it resolves."""
+        if name not in self.datarefs:
+            return f"dataref '{name}' is not in sim/prosim.json"
+        prosim_name = self.datarefs[name]
+        if self.database is not None and prosim_name not in self.database:
+            return f"dataref '{name}' maps to '{prosim_name}', which is not in the ProSim dataref database"
+        return None
+
+
+def _chain(node: ast.AST) -> list | None:
+    """``self.a.b`` -> ["self", "a", "b"]; None if the expression is not a plain attribute chain."""
+    parts = []
+    while isinstance(node, ast.Attribute):
+        parts.append(node.attr)
+        node = node.value
+    if not isinstance(node, ast.Name):
+        return None
+    parts.append(node.id)
+    return parts[::-1]
+
+
+def _is_env(chain: list) -> bool:
+    return chain is not None and len(chain) >= 2 and chain[0] == "self" and chain[1] in ("vars", "datarefs")
+
+
+class _Scanner:
+    def __init__(self, tree: ast.Module, index: BindingIndex):
+        self.tree = tree
+        self.index = index
+        self.problems = []
+        self.checked = 0
+        self.dynamic = 0
+        # Environment objects the checked bindings resolve to, as paths: ("vars", "EFIS", "BUTTONS_275")
+        self.slots = set()
+        self.constants = {}
+        # alias ("name" or "self.name") -> environment chain
+        self.aliases = {}
+        # dict literals by "name" or "self.name"
+        self.dicts = {}
+        # method name -> positional parameter names (without self)
+        self.params = {}
+        # (method name, parameter name) that end in getattr(self.datarefs.prosim, param)
+        self.forwards = set()
+        self.parents = {}
+
+    def problem(self, node: ast.AST, message: str):
+        self.problems.append((node.lineno, message))
+
+    def _key(self, target: ast.AST) -> str | None:
+        if isinstance(target, ast.Name):
+            return target.id
+        chain = _chain(target)
+        if chain is not None and len(chain) == 2 and chain[0] == "self":
+            return f"self.{chain[1]}"
+        return None
+
+    def _collect(self):
+        for node in self.tree.body:
+            if isinstance(node, (ast.Assign, ast.AnnAssign)) and isinstance(node.value, ast.Constant):
+                targets = node.targets if isinstance(node, ast.Assign) else [node.target]
+                for target in targets:
+                    if isinstance(target, ast.Name) and isinstance(node.value.value, str):
+                        self.constants[target.id] = node.value.value
+        for node in ast.walk(self.tree):
+            for child in ast.iter_child_nodes(node):
+                self.parents[child] = node
+            if isinstance(node, ast.Assign) and len(node.targets) == 1:
+                key = self._key(node.targets[0])
+                if key is None:
+                    continue
+                chain = self._resolve(_chain(node.value))
+                if _is_env(chain):
+                    self.aliases[key] = chain
+                elif isinstance(node.value, ast.Dict):
+                    self.dicts[key] = node.value
+            elif isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+                self.params[node.name] = [a.arg for a in node.args.args if a.arg != "self"]
+
+    def _resolve(self, chain: list | None) -> list | None:
+        """Replaces a leading alias by the chain it stands for."""
+        if chain is None:
+            return None
+        if chain[0] in self.aliases:
+            return self.aliases[chain[0]] + chain[1:]
+        if len(chain) >= 2 and chain[0] == "self" and f"self.{chain[1]}" in self.aliases:
+            return self.aliases[f"self.{chain[1]}"] + chain[2:]
+        return chain
+
+    def _is_prosim(self, node: ast.AST) -> bool:
+        return self._resolve(_chain(node)) == ["self", "datarefs", "prosim"]
+
+    def _string(self, node: ast.AST) -> str | None:
+        if isinstance(node, ast.Constant) and isinstance(node.value, str):
+            return node.value
+        if isinstance(node, ast.Name):
+            return self.constants.get(node.id)
+        return None
+
+    def _function_of(self, node: ast.AST):
+        while node is not None and not isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            node = self.parents.get(node)
+        return node
+
+    def _find_forwards(self):
+        """Methods whose parameters are dataref names, directly or through another such method."""
+        calls = []
+        for node in ast.walk(self.tree):
+            if not isinstance(node, ast.Call):
+                continue
+            func = self._function_of(node)
+            if func is None:
+                continue
+            if isinstance(node.func, ast.Name) and node.func.id == "getattr" and len(node.args) >= 2 \
+                    and self._is_prosim(node.args[0]) and isinstance(node.args[1], ast.Name):
+                self.forwards.add((func.name, node.args[1].id))
+            else:
+                callee = _chain(node.func)
+                if callee is not None and len(callee) == 2 and callee[0] == "self":
+                    calls.append((func.name, callee[1], node))
+        changed = True
+        while changed:
+            changed = False
+            for caller, callee, node in calls:
+                for param, arg in self._call_args(callee, node):
+                    if isinstance(arg, ast.Name) and (callee, param) in self.forwards \
+                            and (caller, arg.id) not in self.forwards and arg.id in self.params.get(caller, ()):
+                        self.forwards.add((caller, arg.id))
+                        changed = True
+
+    def _call_args(self, callee: str, node: ast.Call):
+        params = self.params.get(callee, [])
+        for i, arg in enumerate(node.args):
+            if i < len(params):
+                yield params[i], arg
+        for keyword in node.keywords:
+            if keyword.arg is not None:
+                yield keyword.arg, keyword.value
+
+    def _check_dataref(self, node: ast.AST, name: str):
+        self.checked += 1
+        message = self.index.check_dataref(name)
+        if message:
+            self.problem(node, message)
+        else:
+            self.slots.add(("datarefs", "prosim", name))
+
+    def _check_chain(self, node: ast.AST, chain: list):
+        self.checked += 1
+        index = self.index
+        if chain[1] == "datarefs":
+            if len(chain) < 3:
+                return
+            if chain[2] != "prosim":
+                self.problem(node, f"unknown sim '{chain[2]}'")
+            elif len(chain) >= 4:
+                self.checked -= 1
+                self._check_dataref(node, chain[3])
+                if len(chain) >= 5 and chain[4] not in DATAREF_FIELDS:
+                    self.problem(node, f"dataref '{chain[3]}' has no field '{chain[4]}'")
+            return
+        if len(chain) < 3:
+            return
+        name = chain[2]
+        if name in index.vars:
+            if not index.vars[name]:
+                self.problem(node, f"var '{name}' is disabled in its device")
+            if len(chain) >= 4 and chain[3] not in VAR_FIELDS:
+                self.problem(node, f"var '{name}' has no field '{chain[3]}'")
+            self.slots.add(("vars", name))
+        elif name in index.equipment:
+            if len(chain) < 4:
+                return
+            labels = index.equipment[name]
+            if chain[3] not in labels:
+                self.problem(node, f"equipment '{name}' has no label '{chain[3]}'")
+                return
+            if len(chain) >= 5 and chain[4] not in labels[chain[3]]:
+                self.problem(node, f"label '{name}.{chain[3]}' has no field or pad bit '{chain[4]}'")
+            self.slots.add(("vars", name, chain[3]))
+        else:
+            self.problem(node, f"no device function or linked equipment provides var '{name}'")
+
+    def _check_getattr(self, node: ast.Call):
+        arg = node.args[1]
+        name = self._string(arg)
+        if name is not None:
+            self._check_dataref(node, name)
+            return
+        func = self._function_of(node)
+        if isinstance(arg, ast.Name) and func is not None:
+            if arg.id in self.params.get(func.name, ()):
+                # Checked at the call sites
+                return
+            values = self._lookup_values(func, arg.id)
+            if values is not None:
+                for value in values:
+                    self._check_dataref(node, value)
+                return
+        self.dynamic += 1
+
+    def _lookup_values(self, func: ast.AST, name: str) -> list | None:
+        """String values of the dict literal ``name`` was looked up in, if that is how it was assigned."""
+        for node in ast.walk(func):
+            if not (isinstance(node, ast.Assign) and len(node.targets) == 1
+                    and isinstance(node.targets[0], ast.Name) and node.targets[0].id == name):
+                continue
+            value = node.value
+            if isinstance(value, ast.Call) and isinstance(value.func, ast.Attribute) and value.func.attr == "get":
+                source = value.func.value
+            elif isinstance(value, ast.Subscript):
+                source = value.value
+            else:
+                return None
+            key = self._key(source)
+            if key not in self.dicts:
+                return None
+            return [v.value for v in self.dicts[key].values
+                    if isinstance(v, ast.Constant) and isinstance(v.value, str) and v.value]
+        return None
+
+    def _check_device(self, node: ast.Subscript):
+        self.checked += 1
+        name = self._string(node.slice)
+        if name is None:
+            self.checked -= 1
+            self.dynamic += 1
+        elif name not in self.index.devices:
+            self.problem(node, f"no device is named '{name}'")
+        elif not self.index.devices[name]:
+            self.problem(node, f"device '{name}' is disabled")
+        else:
+            self.slots.add(("devices", name))
+
+    def scan(self):
+        self._collect()
+        self._find_forwards()
+        for node in ast.walk(self.tree):
+            if isinstance(node, ast.Attribute):
+                parent = self.parents.get(node)
+                # Only the outermost attribute of a chain
+                if isinstance(parent, ast.Attribute) and parent.value is node:
+                    continue
+                chain = _chain(node)
+                # The alias itself was checked where it was assigned
+                if chain is not None and len(chain) == 2 and self._key(node) in self.aliases:
+                    continue
+                resolved = self._resolve(chain)
+                if _is_env(resolved) and len(resolved) >= 3:
+                    self._check_chain(node, resolved)
+            elif isinstance(node, ast.Subscript) and self._resolve(_chain(node.value)) == ["self", "devices"]:
+                self._check_device(node)
+            elif isinstance(node, ast.Call):
+                if isinstance(node.func, ast.Name) and node.func.id == "getattr" and len(node.args) >= 2 \
+                        and self._is_prosim(node.args[0]):
+                    self._check_getattr(node)
+                    continue
+                callee = _chain(node.func)
+                if callee is None or len(callee) != 2 or callee[0] != "self":
+                    continue
+                for param, arg in self._call_args(callee[1], node):
+                    if (callee[1], param) not in self.forwards:
+                        continue
+                    name = self._string(arg)
+                    if name is not None:
+                        self._check_dataref(node, name)
+                    elif not (isinstance(arg, ast.Name) and (self._function_of(node).name, arg.id) in self.forwards):
+                        self.dynamic += 1
+        self.problems.sort()
+
+
+def check_script(script_path: str, index: BindingIndex) -> dict:
+    """Checks one script. Returns {"problems": [(line, message)], "checked": n, "dynamic": n, "slots": [path]}.
+
+    "slots" are the datarefs, vars, labels and devices the script binds to, as
+    attribute paths from the environment: ("datarefs", "prosim", name),
+    ("vars", name), ("vars", equipment, label) and ("devices", name).
+    """
+    with open(script_path, encoding="utf-8-sig") as f:
+        tree = ast.parse(f.read(), script_path)
+    scanner = _Scanner(tree, index)
+    scanner.scan()
+    return {"problems": scanner.problems, "checked": scanner.checked, "dynamic": scanner.dynamic,
+            "slots": sorted(scanner.slots)}
+
+
+def main(argv: list = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("scripts", nargs="+", help="logic scripts to check")
+    parser.add_argument("--config", default="config", help="config directory (default: config)")
+    parser.add_argument("--database", default=os.path.join("misc", "prosim-datarefs-database.json"),
+                        help="ProSim dataref database (default: misc/prosim-datarefs-database.json)")
+    args = parser.parse_args(argv)
+
+    index = BindingIndex(args.config, args.database)
+    failed = 0
+    for script in args.scripts:
+        result = check_script(script, index)
+        for line, message in result["problems"]:
+            print(f"{script}:{line}: {message}")
+        status = "FAIL" if result["problems"] else "ok"
+        print(f"{script}: {status}, {result['checked']} bindings checked, {result['dynamic']} dynamic", file=sys.stderr)
+        failed += bool(result["problems"])
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
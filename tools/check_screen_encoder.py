@@ -0,0 +1,178 @@
+"""Round-trip and optimality check of the GE MCDU screen encoding
+
+Encodes screens with the shared ``ScreenEncoder`` of
+config/logic/logic_lib/screen_encoder.py, the one mcdu_logic.py and
+mcdu_logic_v2.py use, and checks for every screen that:
+
+- round trip: fed to the ``GeMcduPanel`` emulator as one frame, the words
+  leave every cell with exactly the (glyph, control) that was encoded.
+  Every screen is drawn over a full screen of text without runs, so each
+  cell it leaves out shows. Both screen sizes are checked: the 14 rows of
+  mcdu_logic_v2.py and the 13 of mcdu_logic.py.
+- optimal: the block list has as few words as the best split found by a
+  quadratic search over every block start.
+
+The screens are a blank page (a single run over the whole screen), the
+text background itself, a typical LEGS page with small digits, inverted
+text, the empty box and the degree sign, and random screens of a few
+characters with long runs. For each screen it reports the words sent, the
+words of one literal block per row and the words saved against those.
+
+    python -m tools.check_screen_encoder
+
+It exits with status 1 if any screen does not come back identical or is
+not encoded with the fewest words.
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+
+from tools.logic_host import with_parity
+from tools.panel_emulators import GeMcduPanel
+from tools.virtual_arinc import VirtualA429Card
+
+LOGIC_DIR: str = os.path.join("config", "logic")
+CHANNEL: int = 3
+SAL: int = 0x04
+END_OF_FRAME: int = 0x1F00
+
+COLS: int = GeMcduPanel.COLS
+ROWS: int = GeMcduPanel.ROWS
+
+# Screen shown before the one checked: no two neighbouring cells alike
+BACKGROUND: str = ("ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789" * 10)[:COLS * ROWS]
+
+# Characters of the random screens: spaces, dashes, small digits, the empty box and the degree sign
+RANDOM_CHARS: str = "  ---ABАБ1#`"
+
+LEGS_PAGE: list = [
+    "      ACT RTE 1 LEGS 1/2",
+    " 283`      2.1NM        ",
+    "KSEA      160/ 2000     ",
+    " 274`      4.5NM        ",
+    "SUMMA     ФВДЕЮ/ 4000     ",  # "Ф"/"Ю" take no cell
+    "                        ",
+    "ALKIA     ----/-----    ",
+    "                        ",
+    "ONETA     ----/-----    ",
+    "                        ",
+    "##########    ##########",
+    "<RTE 2 LEGS      RNP/ACT",
+    "------------------------",
+    "                        ",
+]
+
+
+def screens(count: int, seed: int) -> dict:
+    """Name -> screen text of ``COLS * ROWS`` cells; "Ф"/"Ю" do not take a cell."""
+    out = {
+        "blank": " " * (COLS * ROWS),
+        "background": BACKGROUND,
+        "legs": "".join(LEGS_PAGE),
+    }
+    rng = random.Random(seed)
+    for n in range(count):
+        text = []
+        while len(text) < COLS * ROWS:
+            text += rng.choice(RANDOM_CHARS) * rng.choice((1, 1, 2, 3, 8, 30))
+        text = text[:COLS * ROWS]
+        # Inverted stretches, ended before the row end or by it
+        for _ in range(rng.randrange(3)):
+            start = rng.randrange(len(text))
+            text.insert(start, "Ф")
+            text.insert(min(start + rng.randrange(1, 12), len(text)), "Ю")
+        out[f"random_{n}"] = "".join(text)
+    return out
+
+
+def optimal_word_count(cells: list) -> int:
+    """Fewest words of any block split, over every block start: the reference for ``encode``."""
+    n = len(cells)
+    best = [0] + [None] * n
+    for j in range(1, n + 1):
+        for i in range(j):
+            run = 1
+            while i + run < j and cells[i + run] == cells[i]:
+                run += 1
+            cost = best[i] + 2 + (j - i - run)
+            if best[j] is None or cost < best[j]:
+                best[j] = cost
+    return best[n]
+
+
+def _draw(panel: GeMcduPanel, words: list):
+    for word in words:
+        panel._on_word(with_parity(word), 0.0)
+    panel._on_word(with_parity(SAL | END_OF_FRAME), 0.0)
+
+
+def round_trip(encoder, background_encoder, text: str) -> tuple:
+    """Draws ``text`` over the full-screen background on the panel. Returns (cells shown, words sent)."""
+    card = VirtualA429Card(clock=lambda: 0.0)
+    card.add_tx_channel(CHANNEL)
+    card.add_rx_channel(CHANNEL)
+    panel = GeMcduPanel(card, CHANNEL, CHANNEL, sal=SAL)
+    _draw(panel, background_encoder.screen_words(BACKGROUND, SAL))
+    words = encoder.screen_words(text, SAL)
+    _draw(panel, words)
+    return list(panel.cells), len(words)
+
+
+def check(logic_dir: str, count: int, seed: int) -> dict:
+    if logic_dir not in sys.path:
+        sys.path.append(logic_dir)
+    from logic_lib.screen_encoder import ScreenEncoder
+
+    background_encoder = ScreenEncoder(COLS, ROWS)
+    results = {}
+    totals = {"words": 0, "baseline_words": 0, "words_saved": 0}
+    for name, text in screens(count, seed).items():
+        result = {"ok": True}
+        for rows in (ROWS, ROWS - 1):
+            encoder = ScreenEncoder(COLS, rows)
+            cells = ScreenEncoder.cells(text, COLS)[:COLS * rows]
+            # The rows not encoded keep the background
+            expected = cells + ScreenEncoder.cells(BACKGROUND, COLS)[len(cells):]
+            shown, words = round_trip(encoder, background_encoder, text)
+            wrong = [pos for pos, (e, s) in enumerate(zip(expected, shown)) if e != s]
+            optimal = optimal_word_count(cells)
+            if wrong or words != optimal:
+                result["ok"] = False
+            if wrong:
+                result[f"wrong_cells_{rows}_rows"] = wrong[:10]
+            if words != optimal:
+                result[f"words_{rows}_rows"] = {"sent": words, "optimal": optimal}
+            if rows == ROWS:
+                baseline = rows * (COLS + 2)
+                result.update(words=words, baseline_words=baseline, words_saved=baseline - words)
+                totals["words"] += words
+                totals["baseline_words"] += baseline
+                totals["words_saved"] += baseline - words
+        results[name] = result
+    return {"screens": results, "totals": totals}
+
+
+def main(argv: list = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--logic-dir", default=LOGIC_DIR, help=f"directory holding logic_lib (default: {LOGIC_DIR})")
+    parser.add_argument("--random", type=int, default=50, help="random screens (default: 50)")
+    parser.add_argument("--seed", type=int, default=1, help="seed of the random screens (default: 1)")
+    args = parser.parse_args(argv)
+
+    report = check(args.logic_dir, args.random, args.seed)
+    results = report["screens"]
+    failed = [name for name, r in results.items() if not r["ok"]]
+    for name, result in results.items():
+        if name in failed or not name.startswith("random_"):
+            print(f"{name}: {json.dumps(result, ensure_ascii=False)}")
+    totals = report["totals"]
+    print(f"{len(results) - len(failed)}/{len(results)} screens ok, {totals['words']} words sent, "
+          f"{totals['words_saved']} saved against {totals['baseline_words']} in one block per row")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
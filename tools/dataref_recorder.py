@@ -0,0 +1,314 @@
+"""ProSim dataref recorder and replay sim
+
+Captures the datarefs listed in config/sim/prosim.json during a flight and
+serves them back later at 1x to 100x speed, so a logic script can be run
+over a whole recorded flight offline.
+
+- File format
+A recording is a header line ``DREC1`` followed by chunks. Each chunk is
+
+    uint32  length of the JSON chunk header
+    uint32  number of samples n
+    JSON    {"names": [...], "strings": [...]}
+    float64[n]  timestamp
+    uint16[n]   dataref name index
+    int32[n]    string index, -1 for numeric values
+    float64[n]  numeric value
+
+All numbers are little-endian. Names and string values are interned: a
+chunk header only lists the names and strings that first appear in it, and
+the columns refer to them by index across the whole file. The cdu1 XML of a
+page that is shown again costs 4 bytes instead of a copy of the page.
+
+- Replay sim
+``ReplaySim`` is the playback backend. It is configured like the other sim
+files, with "sim_type" set to "replay":
+
+    {
+        "sim_type": "replay",
+        "recording": "flight.drec",
+        "speed": 10.0,
+        "datarefs": { ...same as prosim.json... }
+    }
+
+A dataref with "read_interval_ms" is published at that interval, with the
+latest recorded value, as the sim poller reads it. The poll timers run on a
+``tools.timer_wheel.TimerWheel``, shared with the cards when given the
+host's ``timers``. Datarefs without an interval are published as recorded.
+
+The application's sim backends are not part of this tree; ``ReplaySim``
+writes into the ``Datarefs`` namespace of ``tools.logic_host``.
+"""
+
+import array
+import json
+import struct
+import sys
+import time
+from typing import Callable
+
+from tools.logic_host import Datarefs
+from tools.timer_wheel import TimerWheel
+
+MAGIC: bytes = b"DREC1\n"
+CHUNK = struct.Struct("<II")
+CHUNK_SAMPLES: int = 8192
+
+SPEED_MIN: float = 1.0
+SPEED_MAX: float = 100.0
+
+_UNSET = object()
+
+
+def _columns():
+    return array.array("d"), array.array("H"), array.array("i"), array.array("d")
+
+
+def _to_le(column: array.array) -> bytes:
+    if sys.byteorder != "little":
+        column = array.array(column.typecode, column)
+        column.byteswap()
+    return column.tobytes()
+
+
+class DatarefRecorder:
+    """Records dataref changes to a columnar file.
+
+    Args:
+        path (str): output file
+        names (list): dataref names to record, usually the keys of prosim.json "datarefs"
+        clock (Callable): time source
+    """
+
+    def __init__(self, path: str, names: list, clock: Callable[[], float] = time.monotonic):
+        self._file = open(path, "wb")
+        self._file.write(MAGIC)
+        self.names = list(names)
+        self._clock = clock
+        self._name_ids = {}
+        self._string_ids = {}
+        self._new_names = []
+        self._new_strings = []
+        self._cols = _columns()
+        # name -> last value seen by poll()
+        self._last = {}
+        self._name_set = set(self.names)
+        # Datarefs.seq at the previous poll(), None before the first one
+        self._seq = None
+        self.count = 0
+
+    @classmethod
+    def from_sim_config(cls, path: str, sim_config_path: str, clock: Callable[[], float] = time.monotonic):
+        with open(sim_config_path, encoding="utf-8") as f:
+            return cls(path, list(json.load(f).get("datarefs", {})), clock=clock)
+
+    def _name_id(self, name: str) -> int:
+        idx = self._name_ids.get(name)
+        if idx is None:
+            idx = self._name_ids[name] = len(self._name_ids)
+            self._new_names.append(name)
+        return idx
+
+    def _string_id(self, text: str) -> int:
+        idx = self._string_ids.get(text)
+        if idx is None:
+            idx = self._string_ids[text] = len(self._string_ids)
+            self._new_strings.append(text)
+        return idx
+
+    def write(self, name: str, value, timestamp: float = None):
+        """Records one sample."""
+        t, n, s, v = self._cols
+        t.append(self._clock() if timestamp is None else timestamp)
+        n.append(self._name_id(name))
+        if isinstance(value, str):
+            s.append(self._string_id(value))
+            v.append(0.0)
+        else:
+            s.append(-1)
+            v.append(float(value))
+        self.count += 1
+        if len(t) >= CHUNK_SAMPLES:
+            self._write_chunk()
+
+    def poll(self, datarefs, now: float = None):
+        """Samples every recorded dataref of a ``datarefs.prosim`` namespace and records the changed ones.
+
+        With a namespace that keeps change sequence numbers (``changed_since``),
+        only the datarefs changed since the previous poll are read. The first
+        poll reads all of them.
+        """
+        now = self._clock() if now is None else now
+        last = self._last
+        names = self.names
+        if isinstance(datarefs, Datarefs):
+            if self._seq is not None:
+                names = [name for name in datarefs.changed_since(self._seq) if name in self._name_set]
+            self._seq = datarefs.seq
+        for name in names:
+            value = getattr(datarefs, name).value
+            prev = last.get(name, _UNSET)
+            # Identity first: unchanged strings are usually the same object
+            if value is prev or value == prev:
+                continue
+            last[name] = value
+            self.write(name, value, now)
+
+    def _write_chunk(self):
+        t = self._cols[0]
+        if not t and not self._new_names and not self._new_strings:
+            return
+        header = json.dumps({"names": self._new_names, "strings": self._new_strings}).encode("utf-8")
+        self._file.write(CHUNK.pack(len(header), len(t)))
+        self._file.write(header)
+        for column in self._cols:
+            self._file.write(_to_le(column))
+        self._new_names = []
+        self._new_strings = []
+        self._cols = _columns()
+
+    def close(self):
+        self._write_chunk()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class DatarefRecording:
+    """A recording loaded into memory as columns."""
+
+    def __init__(self, path: str):
+        self.names = []
+        self.strings = []
+        self.times, self.name_ids, self.string_ids, self.numbers = _columns()
+        with open(path, "rb") as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"{path} is not a dataref recording")
+            while True:
+                head = f.read(CHUNK.size)
+                if len(head) < CHUNK.size:
+                    break
+                header_len, count = CHUNK.unpack(head)
+                header = json.loads(f.read(header_len))
+                self.names += header["names"]
+                self.strings += header["strings"]
+                for column in (self.times, self.name_ids, self.string_ids, self.numbers):
+                    chunk = array.array(column.typecode)
+                    chunk.frombytes(f.read(count * chunk.itemsize))
+                    if sys.byteorder != "little":
+                        chunk.byteswap()
+                    column.extend(chunk)
+
+    def __len__(self) -> int:
+        return len(self.times)
+
+    def __getitem__(self, index: int) -> tuple:
+        """Returns ``(timestamp, name, value)``."""
+        sid = self.string_ids[index]
+        value = self.strings[sid] if sid >= 0 else self.numbers[index]
+        return self.times[index], self.names[self.name_ids[index]], value
+
+    @property
+    def duration(self) -> float:
+        return self.times[-1] - self.times[0] if self.times else 0.0
+
+
+class ReplaySim:
+    """Playback sim backend serving a recording into a datarefs namespace.
+
+    Args:
+        recording (DatarefRecording): recording to serve
+        datarefs: ``Datarefs`` namespace the logic script reads (``host.datarefs.prosim``)
+        speed (float): playback speed, clamped to 1x..100x
+        clock (Callable): time source
+        read_intervals (dict): dataref name -> poll interval in seconds
+        timers (TimerWheel): wheel running the polls, a new one if None
+    """
+
+    def __init__(self, recording: DatarefRecording, datarefs, speed: float = 1.0,
+                 clock: Callable[[], float] = time.monotonic, read_intervals: dict = None,
+                 timers: TimerWheel = None):
+        self.recording = recording
+        self.datarefs = datarefs
+        self.speed = min(SPEED_MAX, max(SPEED_MIN, speed))
+        self._clock = clock
+        self._pos = 0
+        self._t0 = None
+        self._rec_t0 = recording.times[0] if len(recording) else 0.0
+        self.timers = timers if timers is not None else TimerWheel(now=clock())
+        # name -> value recorded since the last poll of a polled dataref
+        self._pending = {}
+        self._polls = {}
+        for name, interval in (read_intervals or {}).items():
+            self._polls[name] = self.timers.call_later(interval, self._poller(name), interval)
+
+    def _poller(self, name: str) -> Callable[[float], None]:
+        def poll(due: float):
+            value = self._pending.pop(name, _UNSET)
+            if value is not _UNSET:
+                self.datarefs.set(name, value)
+
+        return poll
+
+    @classmethod
+    def from_config(cls, config_path: str, datarefs, clock: Callable[[], float] = time.monotonic,
+                    timers: TimerWheel = None) -> "ReplaySim":
+        with open(config_path, encoding="utf-8") as f:
+            config = json.load(f)
+        if config.get("sim_type") != "replay":
+            raise ValueError(f'{config_path}: sim_type is "{config.get("sim_type")}", expected "replay"')
+        read_intervals = {}
+        for name, cfg in config.get("datarefs", {}).items():
+            datarefs.set(name, cfg.get("reset_value", 0))
+            if cfg.get("read_interval_ms"):
+                read_intervals[name] = cfg["read_interval_ms"] / 1000
+        return cls(DatarefRecording(config["recording"]), datarefs, config.get("speed", 1.0), clock,
+                   read_intervals, timers)
+
+    def close(self):
+        """Stops the poll timers."""
+        for timer in self._polls.values():
+            self.timers.cancel(timer)
+        self._polls.clear()
+
+    @property
+    def done(self) -> bool:
+        return self._pos >= len(self.recording)
+
+    @property
+    def position(self) -> float:
+        """Recording time served so far."""
+        return self.recording.times[self._pos - 1] if self._pos else self._rec_t0
+
+    def step(self, now: float = None):
+        """Serves all samples up to the current playback time, then runs the due polls."""
+        now = self._clock() if now is None else now
+        if self._t0 is None:
+            self._t0 = now
+        limit = self._rec_t0 + (now - self._t0) * self.speed
+        rec = self.recording
+        times, name_ids, string_ids, numbers = rec.times, rec.name_ids, rec.string_ids, rec.numbers
+        end = len(times)
+        pos = self._pos
+        polls, pending = self._polls, self._pending
+        while pos < end and times[pos] <= limit:
+            sid = string_ids[pos]
+            if sid >= 0:
+                value = rec.strings[sid]
+            else:
+                value = numbers[pos]
+                # Whole numbers are served as int, as ProSim does for switches and lights
+                if value.is_integer():
+                    value = int(value)
+            name = rec.names[name_ids[pos]]
+            if name in polls:
+                pending[name] = value
+            else:
+                self.datarefs.set(name, value)
+            pos += 1
+        self._pos = pos
+        self.timers.advance(now)
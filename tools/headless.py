@@ -0,0 +1,383 @@
+"""Headless runtime
+
+Runs the enabled logic scripts of a cockpit without the GUI: no Qt, no
+style sheets, no window. It loads
+
+- settings/app-settings.json: "config_path", used when it exists here
+- settings/settings-manager.json: the enabled logics ("LogicBase:<name>"
+  entries with "is_enable", or the older entries keyed by script path)
+- config/device, config/arinc/equipment and config/sim, through
+  ``tools.logic_host``
+
+and runs every enabled script's ``update()`` loop on one asyncio loop, with
+one set of cards, datarefs and vars shared by all scripts. A script that
+raises is restarted after ``ERROR_BACKOFF_SEC``; the others keep running.
+Scripts whose bindings do not resolve are not started (see
+``LogicHost.check_bindings``) and are reported in "skipped".
+The first error of each kind (exception type and the line that raised it)
+is logged with its traceback. Repeats of it are counted and logged as one
+line per ``ERROR_REPORT_SEC``, so a binding that fails on every iteration
+does not flood the log.
+
+The cards are the virtual cards of ``tools.virtual_arinc`` and the sim is
+either the replay sim of ``tools.dataref_recorder`` (``--sim`` with a
+"replay" sim config) or none, with the datarefs at their reset values. The
+application's hardware drivers and ProSim connector are not part of this
+tree.
+
+- Worker processes
+A logic with "isolated": true in its settings-manager.json entry, or named
+with ``--isolate``, runs in a worker process of its own instead (see
+``tools.logic_worker``), so a CPU-heavy script runs on another core. It
+sees the same cards, datarefs and vars through shared memory.
+
+- Control socket
+A TCP socket on 127.0.0.1 (``--port``) takes one command per line and
+answers with one JSON line:
+
+    status   uptime, per logic update count and rate and errors (and the
+             worker process and ring counters of isolated logics), card
+             counters, RX label states and the loaded GUI modules (none)
+    quit     stops the runtime
+
+Usage:
+    python -m tools.headless --settings settings --config config
+    python -m tools.headless --sim replay.json --port 47329 --duration 60
+    python -m tools.headless --isolate mcdu_logic_v2
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+import traceback
+from typing import Callable
+
+from tools.dataref_recorder import ReplaySim
+from tools.logic_host import LogicHost
+from tools.logic_worker import LogicWorker
+
+CONTROL_HOST: str = "127.0.0.1"
+CONTROL_PORT: int = 47329
+
+PUMP_PERIOD_SEC: float = 0.001
+ERROR_BACKOFF_SEC: float = 1.0
+ERROR_REPORT_SEC: float = 60.0
+
+LOGIC_PREFIX: str = "LogicBase:"
+
+# Module prefixes of the GUI stack, reported by "status" to show that none was imported
+GUI_MODULES = ("PyQt5", "PyQt6", "PySide2", "PySide6", "qdarkstyle")
+
+
+def _script_name(key: str) -> str:
+    """Logic name of a settings entry keyed by script path. The GUI writes Windows paths."""
+    return os.path.splitext(key.replace("\\", "/").rsplit("/", 1)[-1])[0]
+
+
+def enabled_logics(settings_manager: dict) -> list:
+    """Names of the enabled logic scripts, in settings order.
+
+    The "LogicBase:<name>" entries win over the older entries keyed by script path.
+    """
+    names = [key[len(LOGIC_PREFIX):] for key, cfg in settings_manager.items()
+             if key.startswith(LOGIC_PREFIX) and cfg.get("is_enable")]
+    if any(key.startswith(LOGIC_PREFIX) for key in settings_manager):
+        return names
+    for key, cfg in settings_manager.items():
+        if key.endswith(".py") and cfg.get("is_enable"):
+            name = _script_name(key)
+            if name not in names:
+                names.append(name)
+    return names
+
+
+def isolated_logics(settings_manager: dict) -> set:
+    """Names of the logics whose settings entry has "isolated": true."""
+    names = set()
+    for key, cfg in settings_manager.items():
+        if not cfg.get("isolated"):
+            continue
+        if key.startswith(LOGIC_PREFIX):
+            names.add(key[len(LOGIC_PREFIX):])
+        elif key.endswith(".py"):
+            names.add(_script_name(key))
+    return names
+
+
+class ErrorLimiter:
+    """Rate limit of the error reports of one update loop.
+
+    An error of a kind not seen before is printed with its traceback. Repeats
+    are counted and printed as one line with the count once ``period_sec``
+    has passed since the last report of that kind.
+
+    Args:
+        name (str): logic name, prefixed to the reports
+        clock (Callable): time source
+        period_sec (float): shortest time between two reports of one kind
+    """
+
+    def __init__(self, name: str, clock: Callable[[], float], period_sec: float = ERROR_REPORT_SEC):
+        self.name = name
+        self.clock = clock
+        self.period_sec = period_sec
+        # (type name, file, line) -> [repeats not reported yet, time of the last report]
+        self._kinds = {}
+        self.repeated = 0
+
+    def report(self, e: Exception):
+        frames = traceback.extract_tb(e.__traceback__)
+        where = (frames[-1].filename, frames[-1].lineno) if frames else (None, None)
+        kind = (type(e).__name__,) + where
+        now = self.clock()
+        entry = self._kinds.get(kind)
+        if entry is None:
+            self._kinds[kind] = [0, now]
+            print(f"[headless] {self.name}: update() failed, restarting in {ERROR_BACKOFF_SEC} s")
+            traceback.print_exception(e)
+            return
+        entry[0] += 1
+        self.repeated += 1
+        if now - entry[1] >= self.period_sec:
+            print(f"[headless] {self.name}: {type(e).__name__}: {e} "
+                  f"(line {kind[2]}) repeated {entry[0]} times in {now - entry[1]:.0f} s")
+            entry[0], entry[1] = 0, now
+
+
+class LogicTask:
+    """One logic script run by the headless runtime."""
+
+    def __init__(self, name: str, host: LogicHost):
+        self.name = name
+        self.host = host
+        self.updates = 0
+        self.errors = 0
+        self.last_error = None
+        self.started = None
+        self.error_log = None
+
+    async def run(self, clock: Callable[[], float]):
+        self.started = clock()
+        self.error_log = ErrorLimiter(self.name, clock)
+        while True:
+            try:
+                await self.host.logic.update()
+                self.updates += 1
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.errors += 1
+                self.last_error = f"{type(e).__name__}: {e}"
+                self.error_log.report(e)
+                await asyncio.sleep(ERROR_BACKOFF_SEC)
+
+    def status(self, now: float) -> dict:
+        elapsed = now - self.started if self.started is not None else 0.0
+        return {
+            "version": getattr(self.host.logic, "version", None),
+            "updates": self.updates,
+            "updates_per_sec": self.updates / elapsed if elapsed else None,
+            "errors": self.errors,
+            "errors_repeated": self.error_log.repeated if self.error_log is not None else 0,
+            "last_error": self.last_error,
+            "load_ms": {k: v * 1000 for k, v in self.host.load_times.items()},
+        }
+
+
+class HeadlessApp:
+    """Enabled logics, their shared cards and datarefs, the sim and the control socket.
+
+    Args:
+        settings_dir (str): directory with app-settings.json and settings-manager.json
+        config_dir (str): config directory, default "config_path" of app-settings.json if it exists here
+        sim_config (str): sim config with "sim_type" "replay", optional
+        clock (Callable): time source; worker processes always use time.monotonic
+        isolate (list): names of logics to run in worker processes, besides the "isolated" ones
+    """
+
+    def __init__(self, settings_dir: str, config_dir: str = None, sim_config: str = None,
+                 clock: Callable[[], float] = time.monotonic, isolate: list = ()):
+        t0 = time.perf_counter()
+        self.settings_dir = settings_dir
+        app_settings = self._load_settings("app-settings.json")
+        if config_dir is None:
+            config_dir = app_settings.get("config_path")
+            if not config_dir or not os.path.isdir(config_dir):
+                config_dir = "config"
+        self.config_dir = config_dir
+        self.clock = clock
+        self.logics = {}
+        # Logic name -> LogicWorker of the isolated logics
+        self.workers = {}
+        # Logic name -> reason it was not started
+        self.skipped = {}
+        settings_manager = self._load_settings("settings-manager.json")
+        isolated = isolated_logics(settings_manager) | set(isolate)
+        host = None
+        for name in enabled_logics(settings_manager):
+            path = os.path.join(config_dir, "logic", f"{name}.py")
+            if not os.path.exists(path):
+                self.skipped[name] = "script not found"
+                continue
+            try:
+                candidate = LogicHost(path, config_dir, clock=clock, share=host)
+                if name in isolated:
+                    worker = LogicWorker(name, candidate)
+                    worker.start()
+                else:
+                    candidate.check_bindings = True
+                    candidate.load()
+            except Exception as e:
+                self.skipped[name] = f"{type(e).__name__}: {e}"
+                print(f"[headless] {name}: load failed")
+                traceback.print_exc()
+                continue
+            host = host or candidate
+            if name in isolated:
+                self.workers[name] = worker
+            else:
+                self.logics[name] = LogicTask(name, candidate)
+        # The first host steps the cards, timers and RX labels shared by all of them
+        self.host = host
+        self.sim = None
+        if sim_config is not None and host is not None:
+            self.sim = ReplaySim.from_config(sim_config, host.datarefs.prosim, clock=clock, timers=host.timers)
+        self.startup_ms = (time.perf_counter() - t0) * 1000
+        self.started = None
+        self._stop = None
+        # Control connections: writer -> handler task
+        self._clients = {}
+
+    def _load_settings(self, file_name: str) -> dict:
+        path = os.path.join(self.settings_dir, file_name)
+        if not os.path.exists(path):
+            return {}
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+
+    def status(self) -> dict:
+        now = self.clock()
+        host = self.host
+        return {
+            "uptime_sec": now - self.started if self.started is not None else 0.0,
+            "startup_ms": self.startup_ms,
+            "logics": {
+                **{name: task.status(now) for name, task in self.logics.items()},
+                **{name: worker.status(now) for name, worker in self.workers.items()},
+            },
+            "skipped": self.skipped,
+            "devices": {} if host is None else {
+                name: {
+                    "ready": card.is_ready,
+                    "tx": {n: {"sent": tx.sent, "rejected": tx.rejected, "fifo": tx.fifo_level}
+                           for n, tx in card._tx_chnl.items()},
+                    "rx": {n: {"received": rx.received, "overflows": rx.overflows}
+                           for n, rx in card._rx_chnl.items()},
+                }
+                for name, card in host.devices.items()
+            },
+            "labels": {} if host is None else {
+                name: {label: stats["state"] for label, stats in monitor.summary(now).items()}
+                for name, monitor in host.label_monitors.items()
+            },
+            "sim": None if self.sim is None else {"position": self.sim.position, "done": self.sim.done},
+            "gui_modules": sorted(m for m in sys.modules if m.split(".")[0] in GUI_MODULES),
+        }
+
+    async def _pump(self, period_sec: float):
+        while True:
+            now = self.clock()
+            if self.sim is not None:
+                self.sim.step(now)
+            for worker in self.workers.values():
+                worker.step(now)
+            self.host.step(now)
+            await asyncio.sleep(period_sec)
+
+    async def _on_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self._clients[writer] = asyncio.current_task()
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                command = line.decode("utf-8", "replace").strip().lower()
+                if command == "status":
+                    reply = self.status()
+                elif command == "quit":
+                    reply = {"ok": True}
+                    self._stop.set()
+                else:
+                    reply = {"error": f"unknown command {command!r}", "commands": ["status", "quit"]}
+                writer.write((json.dumps(reply) + "\n").encode("utf-8"))
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            self._clients.pop(writer, None)
+            writer.close()
+
+    async def run(self, port: int = CONTROL_PORT, duration_sec: float = None, period_sec: float = PUMP_PERIOD_SEC):
+        """Runs the logics until "quit" on the control socket or for ``duration_sec``. ``port`` 0 disables the socket."""
+        if self.host is None:
+            raise RuntimeError(f"no enabled logic could be loaded: {self.skipped}")
+        self._stop = asyncio.Event()
+        self.started = self.clock()
+        tasks = [asyncio.ensure_future(self._pump(period_sec))]
+        tasks += [asyncio.ensure_future(task.run(self.clock)) for task in self.logics.values()]
+        server = await asyncio.start_server(self._on_client, CONTROL_HOST, port) if port else None
+        try:
+            if duration_sec is None:
+                await self._stop.wait()
+            else:
+                try:
+                    await asyncio.wait_for(self._stop.wait(), duration_sec)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            if server is not None:
+                server.close()
+                # Closing the connections ends their handlers at the next read
+                clients = list(self._clients.values())
+                for writer in list(self._clients):
+                    writer.close()
+                await asyncio.gather(*clients, return_exceptions=True)
+                await server.wait_closed()
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            for worker in self.workers.values():
+                worker.stop()
+
+
+def main(argv: list = None):
+    parser = argparse.ArgumentParser(description="Runs the enabled logic scripts without the GUI")
+    parser.add_argument("--settings", default="settings", help="settings directory (default: settings)")
+    parser.add_argument("--config", help="config directory (default: config_path of app-settings.json, else config)")
+    parser.add_argument("--sim", help="replay sim config (sim_type \"replay\")")
+    parser.add_argument("--port", type=int, default=CONTROL_PORT,
+                        help=f"control socket port on {CONTROL_HOST}, 0 for none (default: {CONTROL_PORT})")
+    parser.add_argument("--duration", type=float, help="seconds to run (default: until quit)")
+    parser.add_argument("--period-ms", type=float, default=PUMP_PERIOD_SEC * 1000,
+                        help="bus step period (default: 1)")
+    parser.add_argument("--isolate", action="append", default=[], metavar="LOGIC",
+                        help="run this logic in a worker process (repeatable)")
+    args = parser.parse_args(argv)
+
+    app = HeadlessApp(args.settings, args.config, args.sim, isolate=args.isolate)
+    print(f"[headless] {len(app.logics)} logics loaded in {app.startup_ms:.0f} ms: {', '.join(app.logics)}")
+    if app.workers:
+        print(f"[headless] in worker processes: {', '.join(app.workers)}")
+    for name, reason in app.skipped.items():
+        print(f"[headless] {name} skipped: {reason}")
+    if args.port:
+        print(f"[headless] control socket on {CONTROL_HOST}:{args.port}")
+    asyncio.run(app.run(args.port, args.duration, args.period_ms / 1000))
+    print(json.dumps(app.status(), indent=2))
+
+
+if __name__ == "__main__":
+    main()
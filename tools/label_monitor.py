@@ -0,0 +1,188 @@
+"""RX label rate and freshness monitor
+
+Checks received labels against the "timing_ms" min/max of their equipment
+JSON. The driver timestamp of every received word updates the statistics
+of its label: word count, time since the last word and the shortest,
+longest and average interval between words. ``step(now)`` then puts each
+label in one of these states:
+
+    waiting  no word received yet
+    ok       the last word is younger than timing_ms max
+    bursty   the last interval was shorter than BURST_FACTOR x timing_ms min
+    late     no word for longer than timing_ms max
+    stale    no word for STALE_FACTOR x timing_ms max: the sender is gone
+
+A label is fresh while it is ok or bursty. The EFIS sends its button labels
+every 100..200 ms, so a dead panel shows as late after 200 ms and stale
+after 600 ms, where the HUD's channel timeout takes 5 s.
+
+``tools.logic_host`` keeps one monitor per linked RX equipment and exposes
+it to the script as ``self.vars.<equipment>.<label>.fresh`` and ``.age``.
+"""
+
+import collections
+import time
+from typing import Callable
+
+BURST_FACTOR: float = 0.5
+STALE_FACTOR: float = 3.0
+# State changes kept in LabelMonitor.events; a flapping label would otherwise grow it for the whole run
+EVENTS_KEPT: int = 256
+
+WAITING: str = "waiting"
+OK: str = "ok"
+BURSTY: str = "bursty"
+LATE: str = "late"
+STALE: str = "stale"
+
+
+class LabelStats:
+    """Arrival statistics of one RX label. Intervals are in seconds."""
+
+    __slots__ = ("name", "label", "sdi", "min_sec", "max_sec", "count", "last", "interval",
+                 "interval_min", "interval_max", "interval_mean", "bursts", "lates", "state")
+
+    # Weight of the newest interval in interval_mean
+    MEAN_WEIGHT: float = 0.1
+
+    def __init__(self, name: str, label: int, sdi: int, min_sec: float, max_sec: float):
+        self.name = name
+        self.label = label
+        self.sdi = sdi
+        self.min_sec = min_sec
+        self.max_sec = max_sec
+        self.count = 0
+        self.last = None
+        self.interval = None
+        self.interval_min = None
+        self.interval_max = None
+        self.interval_mean = None
+        # Intervals shorter than BURST_FACTOR x min and gaps longer than max
+        self.bursts = 0
+        self.lates = 0
+        self.state = WAITING
+
+    def observe(self, timestamp: float):
+        if self.last is not None:
+            interval = timestamp - self.last
+            self.interval = interval
+            if self.interval_min is None:
+                self.interval_min = self.interval_max = self.interval_mean = interval
+            else:
+                self.interval_min = min(self.interval_min, interval)
+                self.interval_max = max(self.interval_max, interval)
+                self.interval_mean += (interval - self.interval_mean) * self.MEAN_WEIGHT
+            if interval < self.min_sec * BURST_FACTOR:
+                self.bursts += 1
+            elif interval > self.max_sec:
+                self.lates += 1
+        self.last = timestamp
+        self.count += 1
+
+    def age(self, now: float) -> float | None:
+        """Seconds since the last word, None if none was received."""
+        return None if self.last is None else now - self.last
+
+    def classify(self, now: float) -> str:
+        if self.last is None:
+            return WAITING
+        age = now - self.last
+        if age > self.max_sec * STALE_FACTOR:
+            return STALE
+        if age > self.max_sec:
+            return LATE
+        if self.interval is not None and self.interval < self.min_sec * BURST_FACTOR:
+            return BURSTY
+        return OK
+
+    @property
+    def fresh(self) -> bool:
+        return self.state in (OK, BURSTY)
+
+
+class LabelMonitor:
+    """Arrival monitor for the RX labels of one equipment.
+
+    Args:
+        clock (Callable): time source, the same as the card's
+    """
+
+    def __init__(self, clock: Callable[[], float] = time.monotonic):
+        self._clock = clock
+        # (label, sdi) -> LabelStats
+        self._labels = {}
+        self._by_name = {}
+        # (time, label name, old state, new state) of the last EVENTS_KEPT changes
+        self.events = collections.deque(maxlen=EVENTS_KEPT)
+        # Called with (name, old state, new state, now) on every state change
+        self.listeners = []
+
+    @classmethod
+    def from_equipment(cls, equipment: dict, clock: Callable[[], float] = time.monotonic) -> "LabelMonitor":
+        """Monitor for the RX labels of an equipment JSON that have "timing_ms"."""
+        monitor = cls(clock)
+        for name, cfg in equipment.get("labels", {}).items():
+            timing = cfg.get("timing_ms")
+            if cfg.get("channel_direction", "RX") == "RX" and timing:
+                monitor.add(name, int(cfg["label"], 8), int(cfg.get("sdi", 0)), timing["min"], timing["max"])
+        return monitor
+
+    def add(self, name: str, label: int, sdi: int, min_ms: float, max_ms: float) -> LabelStats:
+        stats = LabelStats(name, label, sdi, min_ms / 1000, max_ms / 1000)
+        self._labels[(label, sdi)] = stats
+        self._by_name[name] = stats
+        return stats
+
+    def __getitem__(self, name: str) -> LabelStats:
+        return self._by_name[name]
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._by_name
+
+    def observe(self, label: int, sdi: int, timestamp: float):
+        """Records a received word by label number and SDI, with its driver timestamp."""
+        stats = self._labels.get((label, sdi))
+        if stats is None:
+            stats = self._labels.get((label, 0))
+        if stats is not None:
+            stats.observe(timestamp)
+
+    def step(self, now: float = None):
+        """Updates the state of every label and reports the changes."""
+        now = self._clock() if now is None else now
+        for stats in self._by_name.values():
+            state = stats.classify(now)
+            if state != stats.state:
+                old, stats.state = stats.state, state
+                self.events.append((now, stats.name, old, state))
+                for callback in self.listeners:
+                    callback(stats.name, old, state, now)
+
+    def fresh(self, name: str) -> bool:
+        """True while the label arrives within its timing_ms max, as of the last ``step()``."""
+        return self._by_name[name].fresh
+
+    def age(self, name: str, now: float = None) -> float | None:
+        """Seconds since the last word of the label, None if none was received."""
+        return self._by_name[name].age(self._clock() if now is None else now)
+
+    def summary(self, now: float = None) -> dict:
+        """Per label: state, word count, age and interval min/mean/max in ms, bursts and late gaps."""
+        now = self._clock() if now is None else now
+
+        def ms(sec):
+            return None if sec is None else sec * 1000
+
+        return {
+            stats.name: {
+                "state": stats.state,
+                "count": stats.count,
+                "age_ms": ms(stats.age(now)),
+                "interval_ms": {"min": ms(stats.interval_min), "mean": ms(stats.interval_mean),
+                                "max": ms(stats.interval_max)},
+                "timing_ms": {"min": ms(stats.min_sec), "max": ms(stats.max_sec)},
+                "bursts": stats.bursts,
+                "lates": stats.lates,
+            }
+            for stats in self._by_name.values()
+        }
@@ -0,0 +1,510 @@
+"""Logic script host
+
+Loads a logic script from config/logic and runs its ``Logic`` class the way
+the application does, with everything the script expects injected:
+
+- ``self.devices``: virtual A429 cards (see ``tools.virtual_arinc``) built
+  from config/device.
+- ``self.datarefs.prosim.<name>.value``: in-memory datarefs created from
+  config/sim/prosim.json. The last ``WRITES_KEPT`` writes from the script
+  are kept with their timestamp in ``Datarefs.writes``; ``listeners`` see
+  every one (e.g. ``EfisPanel.watch()``). Each dataref carries the
+  change sequence number ``seq`` of its last change.
+- ``self.vars.<equipment>.<label>``: the labels of the equipment linked to
+  the card channels ("link_equipment"). RX labels are decoded from the
+  channel queue into ``value``, ``packet`` and the pad bit names. Writing a
+  TX label re-encodes the word into the channel timetable. RX labels with
+  "timing_ms" also have ``fresh`` and ``age``, from the arrival monitor of
+  their equipment (see ``tools.label_monitor``) in ``label_monitors``.
+
+Panel emulators (see ``tools.panel_emulators``) attach to the same cards.
+The cards, the replay sim and anything else with a deadline share one timer
+wheel, ``timers`` (see ``tools.timer_wheel``), advanced on every ``step()``.
+
+With ``check_bindings`` set, ``load()`` and ``reload()`` refuse scripts whose
+vars, datarefs or devices do not resolve against the configuration (see
+``tools.check_logic_bindings``) instead of failing on every update. The
+objects those bindings name are then looked up once, before the Logic
+instance is created, into ``slots``: a path such as
+``("vars", "EFIS", "BUTTONS_275")`` -> the LabelVar. A slot the config
+declares but the running environment lacks (e.g. a card that did not open)
+refuses the script too.
+
+- Hot reload
+``reload()`` imports the script again and swaps the new ``Logic`` instance
+in place of the old one. Cards, datarefs and vars are kept, so the panel
+does not see a reconnect. A script keeps selected state across the swap by
+defining two optional methods on ``Logic``:
+
+    def hot_reload_state(self) -> dict: ...      # called on the old instance
+    def hot_reload_restore(self, state: dict): ...  # called on the new one
+
+After the swap the asyncio tasks of the old script (e.g. page transfers in
+flight) are cancelled and its ``ScriptLog`` writer threads are stopped.
+
+``run(..., watch=True)`` checks the script file between updates and reloads
+it when it changes, so the swap happens within one loop period. If the new
+script fails to import or start, the old instance keeps running.
+"""
+
+import asyncio
+import collections
+import importlib.util
+import json
+import os
+import sys
+import time
+import traceback
+from typing import Callable
+
+from tools.check_logic_bindings import BindingIndex, check_script
+from tools.label_monitor import LabelMonitor
+from tools.timer_wheel import TimerWheel
+from tools.virtual_arinc import load_devices
+
+ARINC_PARITY_MASK: int = 0x80000000
+ARINC_DATA_POS: int = 10
+ARINC_DATA_MASK: int = 0x7FFFF
+
+WATCH_PERIOD_SEC: float = 0.25
+# Script writes kept in Datarefs.writes; the headless runtime runs for days
+WRITES_KEPT: int = 4096
+
+
+def reverse_label(label: int) -> int:
+    """Reverses the bit order of an 8 bit label number (ARINC sends the label MSB first)."""
+    return int(f"{label & 0xFF:08b}"[::-1], 2)
+
+
+def with_parity(word: int) -> int:
+    """Sets bit 32 so the word has odd parity."""
+    word &= 0x7FFFFFFF
+    return word | (0 if bin(word).count("1") % 2 else ARINC_PARITY_MASK)
+
+
+def pad_field(bits: str) -> tuple:
+    """Converts an equipment "bits" string ("18" or "19:16", ARINC bit numbers) to (shift, mask)."""
+    if ":" in bits:
+        msb, lsb = (int(b) for b in bits.split(":"))
+    else:
+        msb = lsb = int(bits)
+    return lsb - 1, (1 << (msb - lsb + 1)) - 1
+
+
+class Dataref:
+    """One simulator dataref. Writes are recorded by the owning ``Datarefs``.
+
+    ``seq`` is the change sequence number of the last change of the value, 0 if
+    it never changed. A script compares it with the one it saw last instead
+    of comparing the value.
+    """
+
+    def __init__(self, owner: "Datarefs", name: str, value=0):
+        self._owner = owner
+        self._name = name
+        self._value = value
+        self.seq = 0
+
+    @property
+    def value(self):
+        if self._owner.read_listeners:
+            self._owner._read(self._name)
+        return self._value
+
+    @value.setter
+    def value(self, value):
+        if value is not self._value and value != self._value:
+            self._owner._changed(self)
+        self._value = value
+        self._owner._written(self._name, value)
+
+
+class Datarefs:
+    """``self.datarefs.prosim`` namespace. Unknown names are created on first use.
+
+    Every change of a value takes the next number of a sequence counter:
+    ``seq`` is the last number handed out and ``changed_since(seq)`` returns
+    the names changed after a given number.
+    """
+
+    def __init__(self, sim_config: dict = None, clock: Callable[[], float] = time.monotonic):
+        object.__setattr__(self, "_clock", clock)
+        object.__setattr__(self, "_refs", {})
+        object.__setattr__(self, "seq", 0)
+        # name -> seq of its last change, oldest change first
+        object.__setattr__(self, "_changes", collections.OrderedDict())
+        # (timestamp, name, value) of the last WRITES_KEPT writes done by the logic script
+        object.__setattr__(self, "writes", collections.deque(maxlen=WRITES_KEPT))
+        # Callbacks for script writes, simulator sets and script reads (tracing)
+        object.__setattr__(self, "listeners", [])
+        object.__setattr__(self, "set_listeners", [])
+        object.__setattr__(self, "read_listeners", [])
+        for name, cfg in (sim_config or {}).get("datarefs", {}).items():
+            value = cfg.get("reset_value", 0)
+            if "length" in cfg and not isinstance(value, str):
+                # String datarefs (HGS lines, cdu1) are declared with a length
+                value = ""
+            self._refs[name] = Dataref(self, name, value)
+
+    def __getattr__(self, name: str) -> Dataref:
+        try:
+            return self._refs[name]
+        except KeyError:
+            ref = self._refs[name] = Dataref(self, name)
+            return ref
+
+    def set(self, name: str, value):
+        """Sets a dataref from the simulator side. Not recorded as a script write."""
+        ref = getattr(self, name)
+        if value is not ref._value and value != ref._value:
+            self._changed(ref)
+        ref._value = value
+        for callback in self.set_listeners:
+            callback(name, value, self._clock())
+
+    def changed_since(self, seq: int) -> set:
+        """Names of the datarefs whose value changed after sequence number ``seq``."""
+        changed = set()
+        for name, change_seq in reversed(self._changes.items()):
+            if change_seq <= seq:
+                break
+            changed.add(name)
+        return changed
+
+    def _changed(self, ref: Dataref):
+        seq = self.seq + 1
+        object.__setattr__(self, "seq", seq)
+        ref.seq = seq
+        self._changes[ref._name] = seq
+        self._changes.move_to_end(ref._name)
+
+    def _read(self, name: str):
+        for callback in self.read_listeners:
+            callback(name)
+
+    def _written(self, name: str, value):
+        now = self._clock()
+        self.writes.append((now, name, value))
+        for callback in self.listeners:
+            callback(name, value, now)
+
+
+class LabelVar:
+    """One equipment label: ``value`` is the data field, ``packet`` the raw word, pad names are bit fields."""
+
+    def __init__(self, name: str, cfg: dict, on_change: Callable = None):
+        object.__setattr__(self, "_name", name)
+        object.__setattr__(self, "_label", int(cfg["label"], 8))
+        object.__setattr__(self, "_sdi", int(cfg.get("sdi", 0)))
+        object.__setattr__(self, "_pads", {p: pad_field(b["bits"]) for p, b in cfg.get("pad_bits", {}).items()})
+        object.__setattr__(self, "_on_change", on_change)
+        # LabelMonitor of an RX label with timing_ms
+        object.__setattr__(self, "_monitor", None)
+        object.__setattr__(self, "packet", 0)
+
+    @property
+    def fresh(self) -> bool:
+        """False once the label stops arriving within its timing_ms max. Always True without timing."""
+        return self._monitor is None or self._monitor.fresh(self._name)
+
+    @property
+    def age(self) -> float | None:
+        """Seconds since the label was last received, None if never or not monitored."""
+        return None if self._monitor is None else self._monitor.age(self._name)
+
+    @property
+    def value(self) -> int:
+        return (self.packet >> ARINC_DATA_POS) & ARINC_DATA_MASK
+
+    @value.setter
+    def value(self, value: int):
+        data = (int(value) & ARINC_DATA_MASK) << ARINC_DATA_POS
+        self.packet = (self.packet & ~(ARINC_DATA_MASK << ARINC_DATA_POS)) | data
+
+    def __getattr__(self, name: str):
+        try:
+            shift, mask = self._pads[name]
+        except KeyError:
+            raise AttributeError(f"Label {self._name} has no pad '{name}'") from None
+        return (self.packet >> shift) & mask
+
+    def __setattr__(self, name: str, value):
+        if name == "packet":
+            if value != self.packet:
+                object.__setattr__(self, "packet", value)
+                if self._on_change is not None:
+                    self._on_change(self)
+        elif name in self._pads:
+            shift, mask = self._pads[name]
+            self.packet = (self.packet & ~(mask << shift)) | ((int(value) & mask) << shift)
+        else:
+            object.__setattr__(self, name, value)
+
+    def encode(self) -> int:
+        """Returns the word to transmit: packet with the label number, SDI and parity applied."""
+        word = (self.packet & 0x7FFFFC00) | (self._sdi << 8) | reverse_label(self._label)
+        return with_parity(word)
+
+    def decode(self, word: int):
+        """Stores a received word."""
+        object.__setattr__(self, "packet", word)
+
+
+class Namespace:
+    """Plain attribute container for ``self.vars`` and its equipment."""
+
+    def __init__(self, **items):
+        self.__dict__.update(items)
+
+
+def _retire(module):
+    """Cancels the asyncio tasks started by a script module and closes its ``ScriptLog`` writers.
+
+    A task belongs to the module when its coroutine is defined there. The
+    cancellation is delivered at the next pass of the event loop.
+    """
+    script_log = sys.modules.get("logic_lib.script_log")
+    for value in list(vars(module).values()):
+        if script_log is not None and isinstance(value, script_log.ScriptLog):
+            value.close()
+    try:
+        tasks = asyncio.all_tasks()
+    except RuntimeError:
+        # No running loop, so no tasks either
+        return
+    for task in tasks:
+        frame = getattr(task.get_coro(), "cr_frame", None)
+        if frame is not None and frame.f_globals is vars(module):
+            task.cancel()
+
+
+class LogicHost:
+    """Runs one logic script against virtual devices.
+
+    Args:
+        script_path (str): path of the logic script
+        config_dir (str): config directory with device, arinc/equipment and sim sub-directories
+        clock (Callable): time source shared by the cards and the recorded events
+        share (LogicHost): host of another script of the same cockpit. Its cards, datarefs,
+            vars and timers are used instead of new ones, and its ``step()`` serves both
+    """
+
+    def __init__(self, script_path: str, config_dir: str, clock: Callable[[], float] = time.monotonic,
+                 share: "LogicHost" = None):
+        self.script_path = script_path
+        self.config_dir = config_dir
+        self.clock = clock
+        # (card, rx channel number, {(label, sdi): LabelVar}, LabelMonitor) decoded every step
+        self._rx_links = []
+        if share is None:
+            # Timetables, dataref polls and other deadlines of the cockpit
+            self.timers = TimerWheel(now=clock())
+            self.devices = load_devices(os.path.join(config_dir, "device"), clock=clock, force_virtual=True,
+                                        timers=self.timers)
+            self.datarefs = Namespace(prosim=Datarefs(self._load_json("sim", "prosim.json"), clock=clock))
+            self.vars = Namespace()
+            # Equipment name -> LabelMonitor of its RX labels
+            self.label_monitors = {}
+            self._link_equipment()
+        else:
+            self.timers = share.timers
+            self.devices = share.devices
+            self.datarefs = share.datarefs
+            self.vars = share.vars
+            self.label_monitors = share.label_monitors
+        self.module = None
+        self.logic = None
+        # Seconds spent in load(): {"import": ..., "init": ...}
+        self.load_times = {}
+        self.reloads = 0
+        # Refuse to load scripts with bindings that do not resolve (see tools.check_logic_bindings)
+        self.check_bindings = False
+        # Slot path -> environment object, filled at load when check_bindings is set
+        self.slots = {}
+        self._mtime = None
+        self._next_watch = 0.0
+        # Emulators and other objects with step(now), called on every host step
+        self.peers = []
+
+    def _load_json(self, *parts: str) -> dict:
+        path = os.path.join(self.config_dir, *parts)
+        if not os.path.exists(path):
+            return {}
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+
+    def _link_equipment(self):
+        for file_name in sorted(os.listdir(os.path.join(self.config_dir, "device"))):
+            device = self._load_json("device", file_name) if file_name.endswith(".json") else {}
+            settings = device.get("settings", {})
+            card = self.devices.get(settings.get("name"))
+            if card is None:
+                continue
+            for direction in ("RX_channels", "TX_channels"):
+                for number, chnl in settings.get(direction, {}).items():
+                    for ns_name, equipment_name in chnl.get("link_equipment", {}).items():
+                        equipment = self._load_json("arinc", "equipment", f"{equipment_name}.json")
+                        self._add_equipment(card, direction, int(number), ns_name, equipment)
+
+    def _add_equipment(self, card, direction: str, number: int, ns_name: str, equipment: dict):
+        ns = Namespace()
+        setattr(self.vars, ns_name, ns)
+        table = {}
+        monitor = LabelMonitor.from_equipment(equipment, clock=self.clock)
+        for name, cfg in equipment.get("labels", {}).items():
+            if direction == "TX_channels":
+                period = cfg.get("timing_ms", {}).get("min", 100.0) / 1000
+
+                def on_change(var, card=card, number=number, period=period):
+                    card.timetable_set(number, var._name, var.encode(), period)
+
+                var = LabelVar(name, cfg, on_change)
+            else:
+                var = LabelVar(name, cfg)
+                table[(var._label, var._sdi)] = var
+                if name in monitor:
+                    object.__setattr__(var, "_monitor", monitor)
+            setattr(ns, name, var)
+        if table:
+            self._rx_links.append((card, number, table, monitor))
+            self.label_monitors[ns_name] = monitor
+
+    def _create(self):
+        name = os.path.splitext(os.path.basename(self.script_path))[0]
+        mtime = os.stat(self.script_path).st_mtime
+        slots = {}
+        if self.check_bindings:
+            database = os.path.join(os.path.dirname(os.path.abspath(self.config_dir)), "misc",
+                                    "prosim-datarefs-database.json")
+            result = check_script(self.script_path, BindingIndex(self.config_dir, database))
+            problems = result["problems"]
+            if problems:
+                raise ValueError(f"{self.script_path} has unresolved bindings:\n"
+                                 + "\n".join(f"  line {line}: {message}" for line, message in problems))
+            slots = self._resolve_slots(result["slots"])
+        t0 = time.perf_counter()
+        spec = importlib.util.spec_from_file_location(name, self.script_path)
+        module = importlib.util.module_from_spec(spec)
+        try:
+            spec.loader.exec_module(module)
+            t1 = time.perf_counter()
+            # The app sets these before __init__ runs, as the scripts use them there
+            module.Logic.devices = self.devices
+            module.Logic.datarefs = self.datarefs
+            module.Logic.vars = self.vars
+            logic = module.Logic()
+        except BaseException:
+            _retire(module)
+            raise
+        self.slots = slots
+        return module, logic, mtime, {"import": t1 - t0, "init": time.perf_counter() - t1}
+
+    def _resolve_slots(self, paths: list) -> dict:
+        """Looks up each slot path in the environment. Datarefs not in the sim config are created here."""
+        env = {"devices": self.devices, "datarefs": self.datarefs, "vars": self.vars}
+        slots = {}
+        missing = []
+        for path in paths:
+            obj = env[path[0]]
+            try:
+                for part in path[1:]:
+                    obj = obj[part] if isinstance(obj, dict) else getattr(obj, part)
+            except (AttributeError, KeyError):
+                missing.append(".".join(path))
+                continue
+            slots[tuple(path)] = obj
+        if missing:
+            raise ValueError(f"{self.script_path} binds to objects missing at run time: {', '.join(missing)}")
+        return slots
+
+    def load(self):
+        """Imports the script and creates its Logic instance with the environment injected."""
+        self.module, self.logic, self._mtime, self.load_times = self._create()
+        return self.logic
+
+    def reload(self) -> bool:
+        """Imports the script again and swaps in a new Logic instance, keeping cards, datarefs and vars.
+
+        Returns False, with the old instance left running, if the new script fails.
+        """
+        try:
+            module, logic, mtime, load_times = self._create()
+        except Exception:
+            # Do not retry a broken file until it is saved again
+            self._mtime = os.stat(self.script_path).st_mtime
+            print(f"[logic_host] reload of {self.script_path} failed, keeping the running instance")
+            traceback.print_exc()
+            return False
+        old = self.logic
+        if old is not None and hasattr(old, "hot_reload_state") and hasattr(logic, "hot_reload_restore"):
+            logic.hot_reload_restore(old.hot_reload_state())
+        if self.module is not None:
+            # The old instance's transfers must not keep driving the card next to the new one
+            _retire(self.module)
+        self.module, self.logic, self._mtime, self.load_times = module, logic, mtime, load_times
+        self.reloads += 1
+        return True
+
+    def unload(self):
+        """Cancels the tasks of the running script and stops its log writers."""
+        if self.module is not None:
+            _retire(self.module)
+        self.module = self.logic = None
+
+    def check_reload(self) -> bool:
+        """Reloads the script if its file changed. Returns True when a new instance was swapped in."""
+        now = self.clock()
+        if now < self._next_watch:
+            return False
+        self._next_watch = now + WATCH_PERIOD_SEC
+        try:
+            mtime = os.stat(self.script_path).st_mtime
+        except OSError:
+            # The editor may be replacing the file
+            return False
+        return mtime != self._mtime and self.reload()
+
+    def step(self, now: float = None):
+        """Moves the wire forward, decodes linked RX labels into vars and steps the peers."""
+        now = self.clock() if now is None else now
+        self.timers.advance(now)
+        for card in self.devices.values():
+            card.step(now)
+        for card, number, table, monitor in self._rx_links:
+            queue = card._rx_chnl[number]._label_queue
+            while queue:
+                word, timestamp = queue.popleft()
+                label, sdi = reverse_label(word & 0xFF), (word >> 8) & 0x3
+                var = table.get((label, sdi))
+                if var is None:
+                    var = table.get((label, 0))
+                if var is not None:
+                    var.decode(word)
+                    monitor.observe(var._label, var._sdi, timestamp)
+            monitor.step(now)
+        for peer in self.peers:
+            peer.step(now)
+
+    async def _pump(self, period_sec: float):
+        while True:
+            self.step()
+            await asyncio.sleep(period_sec)
+
+    async def run(self, duration_sec: float, period_sec: float = 0.001, watch: bool = False):
+        """Calls update() repeatedly for ``duration_sec`` while the bus is stepped every ``period_sec``.
+
+        With ``watch`` the script is reloaded when its file changes.
+        """
+        if self.logic is None:
+            self.load()
+        pump = asyncio.ensure_future(self._pump(period_sec))
+        end = self.clock() + duration_sec
+        try:
+            while self.clock() < end:
+                # Scripts that never await inside update() would starve the pump task
+                self.step()
+                if watch:
+                    self.check_reload()
+                await self.logic.update()
+        finally:
+            pump.cancel()
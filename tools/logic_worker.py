@@ -0,0 +1,394 @@
+"""Logic scripts in worker processes
+
+Runs one logic script in its own process, so a CPU-heavy script (the MCDU
+page parse) runs on another core instead of delaying the 10 ms loops of
+the scripts sharing the headless runtime's event loop (see
+``tools.headless``, ``--isolate``).
+
+The worker runs the script in a ``LogicHost`` of its own, built from the
+same config. The runtime keeps the real cards, datarefs and vars, and the
+two processes exchange, through shared memory only:
+
+- RX words: every word received on a runtime card channel is pushed, with
+  its timestamp, into ``rx`` (``tools.spsc_ring``), and the worker injects
+  it into the same channel of its card. Linked labels, ``fresh`` and the
+  scripts' own ``_label_queue`` reads work as in the runtime.
+- TX words: the worker's cards have no wire of their own (word time 0), so
+  a word the script sends or a timetable repeats is pushed into ``tx`` at
+  once and the runtime queues it on its card's channel FIFO.
+- Dataref values: the runtime writes each changed dataref into ``values``
+  (``tools.shared_values``), and the worker copies the changed slots into
+  its datarefs. The table also carries the card ready flags and the stop
+  request.
+- Dataref writes: every value the script writes is pushed into ``writes``,
+  in order, so a key pressed and released within one update reaches the
+  runtime as two writes. Strings go through the ``written`` table, which
+  holds only the latest one per dataref.
+- Worker state: update and error counts, the last error and the script
+  version, in ``status``.
+
+Both processes poll the rings: the worker every ``WORKER_PUMP_PERIOD_SEC``,
+the runtime on its bus step. A word crosses in at most one poll period of
+the receiving side.
+
+Datarefs not declared in config/sim/prosim.json have no slot. The worker
+loads the script with ``check_bindings`` set, so a script using one is
+refused at start.
+"""
+
+import asyncio
+import multiprocessing
+import time
+import traceback
+
+from tools.logic_host import LogicHost
+from tools.shared_values import (TAG_BOOL, TAG_FLOAT, TAG_INT, TAG_NONE, TAG_STR, SharedValues,
+                                 sim_slots)
+from tools.spsc_ring import SpscRing
+
+# Card index, channel, word, timestamp
+WORD_RECORD: str = "<HHId"
+# Dataref slot, value tag, number
+WRITE_RECORD: str = "<IId"
+
+RING_WORDS: int = 4096
+RING_WRITES: int = 1024
+
+WORKER_PUMP_PERIOD_SEC: float = 0.0005
+START_TIMEOUT_SEC: float = 10.0
+STOP_TIMEOUT_SEC: float = 2.0
+# How often the worker checks that the runtime is still there
+PARENT_CHECK_SEC: float = 1.0
+
+STATUS_SLOTS = [
+    ("state", 16),
+    ("version", 64),
+    ("updates", 8),
+    ("errors", 8),
+    ("errors_repeated", 8),
+    ("last_error", 512),
+    ("load_import_ms", 8),
+    ("load_init_ms", 8),
+    ("tx_dropped", 8),
+    ("writes_dropped", 8),
+]
+
+STARTING: str = "starting"
+RUNNING: str = "running"
+FAILED: str = "failed"
+STOPPED: str = "stopped"
+
+
+def _control_slots(cards: list) -> list:
+    return [("stop", 8)] + [(f"ready:{name}", 8) for name in cards]
+
+
+def _encode_number(value) -> tuple:
+    """(tag, number) of a dataref value written through the ``writes`` ring."""
+    if value is None:
+        return TAG_NONE, 0.0
+    if isinstance(value, bool):
+        return TAG_BOOL, float(value)
+    if isinstance(value, int):
+        return TAG_INT, float(value)
+    if isinstance(value, float):
+        return TAG_FLOAT, value
+    raise TypeError(f"{type(value).__name__} dataref values cannot be passed to the runtime")
+
+
+def _decode_number(tag: int, number: float):
+    if tag == TAG_INT:
+        return int(number)
+    if tag == TAG_BOOL:
+        return bool(number)
+    if tag == TAG_NONE:
+        return None
+    return number
+
+
+class LogicWorker:
+    """Runtime side of one logic script running in a worker process.
+
+    Args:
+        name (str): logic name
+        host (LogicHost): host whose cards, datarefs and vars the worker mirrors;
+            its own script is not loaded
+    """
+
+    def __init__(self, name: str, host: LogicHost):
+        self.name = name
+        self.host = host
+        self.process = None
+        self.started = None
+        self.start_ms = None
+        card_names = sorted(host.devices)
+        self._cards = [host.devices[card_name] for card_name in card_names]
+        slots = sim_slots(host._load_json("sim", "prosim.json"))
+        self._refs = len(slots)
+        self.values = SharedValues(slots + _control_slots(card_names))
+        self.written = SharedValues(slots)
+        self.status_values = SharedValues(STATUS_SLOTS)
+        self.status_values.write(self.status_values.index["state"], STARTING)
+        self.rx = SpscRing(WORD_RECORD, RING_WORDS)
+        self.tx = SpscRing(WORD_RECORD, RING_WORDS)
+        self.writes = SpscRing(WRITE_RECORD, RING_WRITES)
+        # Words the runtime card could not queue: card not ready or channel disabled
+        self.tx_rejected = 0
+        self._ready = [None] * len(self._cards)
+        self._seq = 0
+        self._final = None
+        prosim = host.datarefs.prosim
+        for i, (ref_name, _) in enumerate(slots):
+            self.values.write(i, getattr(prosim, ref_name)._value)
+        self._seq = prosim.seq
+        self._publish_ready()
+        # (rx channel, callback) added to the runtime cards
+        self._listeners = []
+        for i, card in enumerate(self._cards):
+            for number, rx in card._rx_chnl.items():
+
+                def forward(label, timestamp, i=i, number=number):
+                    self.rx.push(i, number, label, timestamp)
+
+                rx.listeners.append(forward)
+                self._listeners.append((rx, forward))
+
+    def _blocks(self) -> dict:
+        return {
+            "values": self.values.name, "written": self.written.name, "status": self.status_values.name,
+            "rx": self.rx.name, "tx": self.tx.name, "writes": self.writes.name,
+        }
+
+    def _status(self, slot_name: str):
+        return self.status_values.read(self.status_values.index[slot_name])
+
+    def start(self, timeout_sec: float = START_TIMEOUT_SEC):
+        """Starts the worker process and waits until the script runs. Raises RuntimeError if it does not."""
+        t0 = time.perf_counter()
+        context = multiprocessing.get_context("spawn")
+        self.process = context.Process(target=_worker_main, name=f"logic:{self.name}", daemon=True,
+                                       args=(self.name, self.host.script_path, self.host.config_dir, self._blocks()))
+        self.process.start()
+        deadline = time.monotonic() + timeout_sec
+        while self._status("state") == STARTING:
+            if not self.process.is_alive() or time.monotonic() > deadline:
+                break
+            time.sleep(0.01)
+        state = self._status("state")
+        if state != RUNNING:
+            reason = self._status("last_error") or f"worker {state}, exit code {self.process.exitcode}"
+            self.stop()
+            raise RuntimeError(f"{self.name}: {reason}")
+        self.started = time.monotonic()
+        self.start_ms = (time.perf_counter() - t0) * 1000
+
+    def _publish_ready(self):
+        for i, card in enumerate(self._cards):
+            ready = card.is_ready
+            if ready != self._ready[i]:
+                self._ready[i] = ready
+                self.values.write(self._refs + 1 + i, ready)
+
+    def step(self, now: float):
+        """Applies the worker's dataref writes and TX words and publishes the changed datarefs."""
+        prosim = self.host.datarefs.prosim
+        names = self.written.names
+        for i, tag, number in self.writes.pop_all():
+            value = self.written.read(i) if tag == TAG_STR else _decode_number(tag, number)
+            getattr(prosim, names[i]).value = value
+        for i, number, word, _ in self.tx.pop_all():
+            card = self._cards[i]
+            tx = card._tx_chnl[number]
+            if not card.is_ready or not tx.enable:
+                self.tx_rejected += 1
+                continue
+            try:
+                tx.push(word, now)
+            except BufferError:
+                # Counted in the channel's "rejected", as for a script in the runtime
+                pass
+        if prosim.seq != self._seq:
+            index = self.written.index
+            for ref_name in prosim.changed_since(self._seq):
+                i = index.get(ref_name)
+                if i is not None:
+                    self.values.write(i, getattr(prosim, ref_name)._value)
+            self._seq = prosim.seq
+        self._publish_ready()
+
+    def status(self, now: float) -> dict:
+        if self._final is not None:
+            return self._final
+        elapsed = time.monotonic() - self.started if self.started is not None else 0.0
+        updates = self._status("updates") or 0
+        return {
+            "version": self._status("version"),
+            "updates": updates,
+            "updates_per_sec": updates / elapsed if elapsed else None,
+            "errors": self._status("errors") or 0,
+            "errors_repeated": self._status("errors_repeated") or 0,
+            "last_error": self._status("last_error"),
+            "load_ms": {"import": self._status("load_import_ms"), "init": self._status("load_init_ms")},
+            "worker": {
+                "pid": self.process.pid if self.process is not None else None,
+                "alive": self.process is not None and self.process.is_alive(),
+                "state": self._status("state"),
+                "start_ms": self.start_ms,
+                "rx_dropped": self.rx.dropped,
+                "tx_dropped": self._status("tx_dropped") or 0,
+                "tx_rejected": self.tx_rejected,
+                "writes_dropped": self._status("writes_dropped") or 0,
+            },
+        }
+
+    def stop(self, timeout_sec: float = STOP_TIMEOUT_SEC):
+        """Stops the worker process and frees the shared memory. The last status stays available."""
+        if self._final is not None:
+            return
+        for rx, callback in self._listeners:
+            rx.listeners.remove(callback)
+        self._listeners = []
+        if self.process is not None:
+            self.values.write(self._refs, 1)
+            self.process.join(timeout_sec)
+            if self.process.is_alive():
+                self.process.terminate()
+                self.process.join()
+        self._final = self.status(None)
+        self._final["worker"]["alive"] = False
+        for block in (self.values, self.written, self.status_values, self.rx, self.tx, self.writes):
+            block.close()
+
+
+class _WorkerSide:
+    """Worker process side: bridges the worker's LogicHost to the shared memory of a ``LogicWorker``."""
+
+    def __init__(self, name: str, host: LogicHost, blocks: dict):
+        self.name = name
+        self.host = host
+        card_names = sorted(host.devices)
+        self._cards = [host.devices[card_name] for card_name in card_names]
+        slots = sim_slots(host._load_json("sim", "prosim.json"))
+        self._refs = len(slots)
+        self.values = SharedValues(slots + _control_slots(card_names), blocks["values"])
+        self.written = SharedValues(slots, blocks["written"])
+        self.status_values = SharedValues(STATUS_SLOTS, blocks["status"])
+        self.rx = SpscRing(WORD_RECORD, RING_WORDS, blocks["rx"])
+        self.tx = SpscRing(WORD_RECORD, RING_WORDS, blocks["tx"])
+        self.writes = SpscRing(WRITE_RECORD, RING_WRITES, blocks["writes"])
+        self.stopped = False
+        self.updates = 0
+        self.errors = 0
+        self._seqs = [0] * len(self.values.names)
+        self._version = None
+        for i, card in enumerate(self._cards):
+            for number, tx in card._tx_chnl.items():
+                # The runtime card's FIFO paces the words on the wire
+                tx.word_time = 0.0
+
+                def forward(label, timestamp, i=i, number=number):
+                    if not self.tx.push(i, number, label, timestamp):
+                        self.set_status("tx_dropped", self.tx.dropped)
+
+                tx.listeners.append(forward)
+        host.datarefs.prosim.listeners.append(self._on_write)
+
+    def set_status(self, slot_name: str, value):
+        self.status_values.write(self.status_values.index[slot_name], value)
+
+    def _on_write(self, ref_name: str, value, now: float):
+        i = self.written.index.get(ref_name)
+        if i is None:
+            raise AttributeError(f"dataref '{ref_name}' is not in the sim config, so it has no shared slot")
+        if isinstance(value, str):
+            self.written.write(i, value)
+            tag, number = TAG_STR, 0.0
+        else:
+            tag, number = _encode_number(value)
+        if not self.writes.push(i, tag, number):
+            self.set_status("writes_dropped", self.writes.dropped)
+
+    def pull(self):
+        """Takes the RX words, changed datarefs, card ready flags and stop request of the runtime."""
+        for i, number, word, timestamp in self.rx.pop_all():
+            self._cards[i].inject(number, word, timestamp)
+        version = self.values.version
+        if version == self._version:
+            return
+        self._version = version
+        prosim = self.host.datarefs.prosim
+        for i in self.values.changed(self._seqs):
+            value = self.values.read(i)
+            if i < self._refs:
+                prosim.set(self.values.names[i], value)
+            elif i == self._refs:
+                self.stopped = bool(value)
+            else:
+                self._cards[i - self._refs - 1].is_ready = bool(value)
+
+    async def _update_loop(self):
+        # Imported here: tools.headless imports this module
+        from tools.headless import ERROR_BACKOFF_SEC, ErrorLimiter
+
+        error_log = ErrorLimiter(self.name, time.monotonic)
+        while True:
+            try:
+                await self.host.logic.update()
+                self.updates += 1
+                self.set_status("updates", self.updates)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.errors += 1
+                self.set_status("errors", self.errors)
+                self.set_status("last_error", f"{type(e).__name__}: {e}"[:500])
+                error_log.report(e)
+                self.set_status("errors_repeated", error_log.repeated)
+                await asyncio.sleep(ERROR_BACKOFF_SEC)
+
+    async def run(self):
+        """Steps the worker's bus and runs the script until the runtime asks to stop or goes away."""
+        parent = multiprocessing.parent_process()
+        next_check = time.monotonic() + PARENT_CHECK_SEC
+        task = asyncio.ensure_future(self._update_loop())
+        try:
+            while not self.stopped:
+                self.pull()
+                self.host.step()
+                await asyncio.sleep(WORKER_PUMP_PERIOD_SEC)
+                if time.monotonic() >= next_check:
+                    next_check = time.monotonic() + PARENT_CHECK_SEC
+                    if parent is not None and not parent.is_alive():
+                        break
+        finally:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+
+    def close(self):
+        for block in (self.values, self.written, self.status_values, self.rx, self.tx, self.writes):
+            block.close()
+
+
+def _worker_main(name: str, script_path: str, config_dir: str, blocks: dict):
+    host = LogicHost(script_path, config_dir)
+    host.check_bindings = True
+    side = _WorkerSide(name, host, blocks)
+    try:
+        # The script sees the runtime's values from its __init__ on
+        side.pull()
+        try:
+            host.load()
+        except Exception as e:
+            side.set_status("last_error", f"{type(e).__name__}: {e}"[:500])
+            side.set_status("state", FAILED)
+            traceback.print_exc()
+            return
+        side.set_status("version", str(getattr(host.logic, "version", ""))[:60])
+        side.set_status("load_import_ms", host.load_times["import"] * 1000)
+        side.set_status("load_init_ms", host.load_times["init"] * 1000)
+        side.set_status("state", RUNNING)
+        asyncio.run(side.run())
+        side.set_status("state", STOPPED)
+        host.unload()
+    finally:
+        side.close()
@@ -0,0 +1,465 @@
+"""Scripted panel emulators
+
+Each emulator sits on the panel side of a virtual A429 card (see
+``tools.virtual_arinc``). It listens to the logic script's TX channel,
+decodes what the panel would display and answers on the RX channel with the
+panel's protocol:
+
+- ``HudPanel``: Flight Dynamics HUD control panel. Sends the keypad label
+  192 as its alive stream and decodes the display, LED and brightness labels.
+- ``GeMcduPanel``: GE MCDU used by mcdu_logic.py and mcdu_logic_v2.py.
+  Sends label 4 keys and the frame acceptance word and decodes text blocks.
+- ``A739Panel``: ARINC 739 MCDU used by mcdu_logic_A739_v3.py. Polls an LRU
+  with ENQ, answers RTS with CTS, ACKs the records and sends DC1 keys.
+- ``EfisPanel``: EFIS control panel sending labels 272..275.
+
+Emulators are driven by a script: a list of ``(time, action, *args)``
+entries with times relative to ``start()``. Every key press is recorded in
+``keys`` and every display change in ``displays`` as ``(time, snapshot)``, so
+``latencies()`` gives the keypress to display time of each scripted key.
+
+``for_script()`` picks the emulator of a logic script by its file name, for
+the tools that run any script against its panel.
+"""
+
+import json
+import os
+
+from tools.logic_host import pad_field, reverse_label, with_parity
+
+
+def _earliest(*times) -> float | None:
+    pending = [t for t in times if t is not None]
+    return min(pending) if pending else None
+
+
+class PanelEmulator:
+    """Common part of the emulators: script playback and event recording.
+
+    Args:
+        card (VirtualA429Card): card shared with the logic script
+        tx_chnl (int): card TX channel the logic script sends on (panel input), None for send-only panels
+        rx_chnl (int): card RX channel the logic script reads (panel output)
+        script (list): ``(time, action, *args)`` entries; action is a method name of the emulator
+    """
+
+    def __init__(self, card, tx_chnl: int | None, rx_chnl: int, script: list = None):
+        self.card = card
+        self.tx_chnl = tx_chnl
+        self.rx_chnl = rx_chnl
+        self._script = sorted(script or [], key=lambda entry: entry[0])
+        self._script_pos = 0
+        self._t0 = None
+        self._now = 0.0
+        # (timestamp, key) of every key press
+        self.keys = []
+        # (timestamp, snapshot) of every display change
+        self.displays = []
+        if tx_chnl is not None:
+            card.add_tx_listener(tx_chnl, self._on_word)
+
+    def start(self, now: float = None):
+        self._t0 = self.card._clock() if now is None else now
+        self._now = self._t0
+
+    def send(self, word: int, now: float = None):
+        self.card.inject(self.rx_chnl, with_parity(word), self._now if now is None else now)
+
+    def step(self, now: float):
+        """Runs the due script entries and the panel's periodic traffic."""
+        if self._t0 is None:
+            self.start(now)
+        self._now = now
+        script = self._script
+        while self._script_pos < len(script) and self._t0 + script[self._script_pos][0] <= now:
+            _, action, *args = script[self._script_pos]
+            self._script_pos += 1
+            getattr(self, action)(*args)
+        self._periodic(now)
+
+    @property
+    def script_done(self) -> bool:
+        return self._script_pos >= len(self._script)
+
+    def next_deadline(self) -> float | None:
+        """Time of the next script entry or periodic word, None if nothing is pending."""
+        if self._t0 is None or self.script_done:
+            return None
+        return self._t0 + self._script[self._script_pos][0]
+
+    def _periodic(self, now: float):
+        pass
+
+    def _on_word(self, word: int, timestamp: float):
+        pass
+
+    def _record_display(self, snapshot, timestamp: float):
+        if not self.displays or self.displays[-1][1] != snapshot:
+            self.displays.append((timestamp, snapshot))
+
+    def _record_key(self, key, timestamp: float = None):
+        self.keys.append((self._now if timestamp is None else timestamp, key))
+
+    def latencies(self) -> list:
+        """Returns ``(key, seconds)`` from each key press to the first display change after it."""
+        out = []
+        d = 0
+        for t_key, key in self.keys:
+            while d < len(self.displays) and self.displays[d][0] < t_key:
+                d += 1
+            if d < len(self.displays):
+                out.append((key, self.displays[d][0] - t_key))
+        return out
+
+
+class HudPanel(PanelEmulator):
+    """Flight Dynamics HUD control panel (hud_logic.py).
+
+    Script actions: ``("press", button_mask, hold_sec)`` with the
+    ``HUD.ButtonEnum`` values, ``("set_alive", bool)``.
+    """
+
+    KEYPAD_LABEL: int = 192
+    ALIVE_PERIOD_SEC: float = 0.05
+    LINE_ID = (21, 41, 61, 101)
+    COLS: int = 8
+
+    def __init__(self, card, tx_chnl: int = 1, rx_chnl: int = 1, script: list = None):
+        super().__init__(card, tx_chnl, rx_chnl, script)
+        # Display label number -> (row, label column)
+        self._display_labels = {
+            int(str(line + col), 8): (row, col) for row, line in enumerate(self.LINE_ID) for col in range(4)
+        }
+        self._screen = [[" "] * self.COLS for _ in self.LINE_ID]
+        self.indicators = 0
+        self.brightness = None
+        self._buttons = 0
+        self._release_at = {}
+        self._alive = True
+        self._next_alive = 0.0
+
+    def press(self, button: int, hold_sec: float = 0.1):
+        self._buttons |= button
+        self._release_at[button] = self._now + hold_sec
+        self._record_key(button)
+        self._send_keypad(self._now)
+
+    def set_alive(self, alive: bool):
+        self._alive = alive
+
+    def next_deadline(self) -> float | None:
+        return _earliest(super().next_deadline(), self._next_alive if self._alive else None,
+                         *self._release_at.values())
+
+    def _send_keypad(self, now: float):
+        self.send((self._buttons & 0x0FFFFF00) | self.KEYPAD_LABEL, now)
+        self._next_alive = now + self.ALIVE_PERIOD_SEC
+
+    def _periodic(self, now: float):
+        for button, release in list(self._release_at.items()):
+            if release <= now:
+                self._buttons &= ~button
+                del self._release_at[button]
+        if self._alive and now >= self._next_alive:
+            self._send_keypad(now)
+
+    @staticmethod
+    def _char(code: int) -> str:
+        code &= 0x7F  # Bit 8 is the blink flag
+        if code == 8:
+            return "\xb0"
+        return bytes([code]).decode("iso-8859-5", errors="replace")
+
+    def _on_word(self, word: int, timestamp: float):
+        label = reverse_label(word & 0xFF)
+        if label in self._display_labels:
+            row, col = self._display_labels[label]
+            self._screen[row][col * 2] = self._char(word >> 13)
+            self._screen[row][col * 2 + 1] = self._char(word >> 21)
+            self._record_display(tuple("".join(line) for line in self._screen), timestamp)
+        elif label == 1:
+            self.indicators = word & 0x07800000
+        elif label == 3:
+            self.brightness = (word >> 18) & 0x7F
+
+
+class GeMcduPanel(PanelEmulator):
+    """GE MCDU (mcdu_logic.py, mcdu_logic_v2.py).
+
+    A frame is the size header, the lights and scratchpad words, text blocks
+    and the end of frame word. Text blocks are an offset header with a run
+    length, a fill header with the glyph and control of that run, then one
+    word per literal cell. The run length is 9 bits from bit 13, enough for
+    a run over the whole 336-cell screen; glyphs are 7 bits from bit 13 and
+    controls 9 bits from bit 20. ``cells`` holds the (glyph, control) of
+    every cell, ``displays`` the text. The panel answers every complete frame with the
+    acceptance word, which is also what makes the script send the next one.
+
+    Script actions: ``("press", key_code)`` with the codes of ``MCDU.key_map``.
+    """
+
+    ACCEPT_WORD: int = 0x1204
+    ALIVE_PERIOD_SEC: float = 0.5
+    COLS: int = 24
+    ROWS: int = 14
+    RUN_LENGTH_MASK: int = 0x1FF
+    GLYPH_MASK: int = 0x7F
+    CONTROL_MASK: int = 0x1FF
+    SMALL_DIGITS: str = "АБВГДЕЖЗИЙ"
+
+    def __init__(self, card, tx_chnl: int = 3, rx_chnl: int = 3, script: list = None, sal: int = 0x04):
+        super().__init__(card, tx_chnl, rx_chnl, script)
+        self.sal = sal
+        # (glyph, control) of every screen cell, as last drawn
+        self.cells = [(0x20, 0)] * (self.COLS * self.ROWS)
+        self._frame = []
+        self._next_alive = 0.0
+        self.lights = 0
+        self.frames = 0
+
+    def press(self, key_code: int):
+        self._record_key(key_code)
+        self.send(((key_code & 0xFF) << 12) | self.sal)
+
+    def next_deadline(self) -> float | None:
+        return _earliest(super().next_deadline(), None if self.frames else self._next_alive)
+
+    def _periodic(self, now: float):
+        # Until the first frame arrives the panel keeps announcing itself
+        if not self.frames and now >= self._next_alive:
+            self.send(self.ACCEPT_WORD | self.sal, now)
+            self._next_alive = now + self.ALIVE_PERIOD_SEC
+
+    def glyph_char(self, glyph: int) -> str:
+        if glyph == 64:
+            return "#"
+        if glyph == 36:
+            return "`"
+        if 16 <= glyph <= 25:
+            return self.SMALL_DIGITS[glyph - 16]
+        return bytes([glyph]).decode("iso-8859-5", errors="replace")
+
+    def _on_word(self, word: int, timestamp: float):
+        if word & 0xFF != self.sal:
+            return
+        kind = (word >> 8) & 0x1F
+        if kind == 0x1F:
+            self._end_frame(timestamp)
+        else:
+            self._frame.append(word)
+
+    def _end_frame(self, timestamp: float):
+        frame, self._frame = self._frame, []
+        cells = self.cells
+        pos = 0
+        header = None
+        for word in frame:
+            kind = (word >> 8) & 0x1F
+            if kind == 1:
+                self.lights = word & 0x7FFFF000
+            elif kind == 4:
+                if header is None:
+                    header = (word >> 13) & self.RUN_LENGTH_MASK
+                else:
+                    fill = ((word >> 13) & self.GLYPH_MASK, (word >> 20) & self.CONTROL_MASK)
+                    end = min(pos + header, len(cells))
+                    cells[pos:end] = [fill] * (end - pos)
+                    pos += header
+                    header = None
+            elif kind == 3:
+                if pos < len(cells):
+                    cells[pos] = ((word >> 13) & self.GLYPH_MASK, (word >> 20) & self.CONTROL_MASK)
+                pos += 1
+        self.frames += 1
+        cols = self.COLS
+        text = "".join(self.glyph_char(glyph) for glyph, _ in cells)
+        self._record_display(tuple(text[r * cols:(r + 1) * cols] for r in range(self.ROWS)), timestamp)
+        self.send(self.ACCEPT_WORD | self.sal, timestamp)
+
+
+class A739Panel(PanelEmulator):
+    """ARINC 739 MCDU (mcdu_logic_A739_v3.py).
+
+    The panel polls one LRU at a time with ENQ from its MAL. RTS from the LRU
+    is answered with CTS; records are ACKed after each ETX/EOT and the page
+    is complete on EOT. ``syn_records`` makes the panel reject that many
+    records with SYN first, to exercise the retry path.
+
+    Script actions: ``("enq", sal, request_type)``, ``("press", key_code)``,
+    ``("select", sal)``.
+    """
+
+    ENQ = 0b0000101
+    DC1 = 0b0010001
+    DC2 = 0b0010010
+    DC3 = 0b0010011
+    SYN = 0b0010110
+    CNTRL = 0b1
+    STX = 0b10
+    ETX = 0b11
+    EOT = 0b100
+    ACK = 0b110
+    COLS: int = 24
+    ROWS: int = 14
+
+    def __init__(self, card, tx_chnl: int = 3, rx_chnl: int = 3, script: list = None, mal: int = 0o100,
+                 sal: int = 0o300, max_recs: int = 7, syn_records: int = 0):
+        super().__init__(card, tx_chnl, rx_chnl, script)
+        self.mal = mal
+        self.sal = sal
+        self.max_recs = max_recs
+        self.syn_records = syn_records
+        self._seq = 0
+        self._record = None
+        self._rows = [" " * self.COLS] * self.ROWS
+        # Counters
+        self.pages = 0
+        self.records = 0
+        self.key_acks = 0
+        self.heartbeats = 0
+
+    def _send_control(self, sal: int, payload: int):
+        self.send((payload << 8) | reverse_label(sal))
+
+    def select(self, sal: int):
+        self.sal = sal
+
+    def enq(self, sal: int = None, request_type: int = 0):
+        self.sal = self.sal if sal is None else sal
+        self._send_control(self.sal, (self.ENQ << 16) | ((request_type & 0xF) << 8) | reverse_label(self.mal))
+
+    def press(self, key_code: int):
+        self._record_key(key_code)
+        self._seq = (self._seq + 1) & 0x7F
+        self._send_control(self.sal, (self.DC1 << 16) | ((key_code & 0x7F) << 8) | self._seq)
+
+    def _on_word(self, word: int, timestamp: float):
+        label = reverse_label(word & 0xFF)
+        payload = (word >> 8) & 0x7FFFFF
+        if label == 0o172:
+            self.heartbeats += 1
+            return
+        if label != self.mal:
+            return
+        code = (payload >> 16) & 0x7F
+        if code == self.DC2:
+            self._send_control(self.sal, (self.DC3 << 16) | ((self.max_recs & 0x7F) << 8))
+        elif code == self.ACK:
+            self.key_acks += 1
+        elif code == self.STX:
+            self._record = {"idx": (payload >> 8) & 0xFF, "line": 1, "col": 1, "text": []}
+        elif self._record is None:
+            return
+        elif code == self.CNTRL and not self._record["text"]:
+            if payload & 0x8000:
+                # Control A: font bit set, line and column
+                self._record["line"] = (payload >> 8) & 0x1F
+                self._record["col"] = payload & 0x1F
+            else:
+                # Control B: start line, whole line
+                self._record["line"] = payload & 0x1F
+                self._record["col"] = 1
+        elif code in (self.ETX, self.EOT):
+            self._end_record(code == self.EOT, timestamp)
+        else:
+            self._record["text"] += [payload & 0xFF, (payload >> 8) & 0xFF, (payload >> 16) & 0xFF]
+
+    def _end_record(self, last: bool, timestamp: float):
+        record, self._record = self._record, None
+        if self.syn_records:
+            self.syn_records -= 1
+            self._send_control(self.sal, (self.SYN << 16) | (record["idx"] << 8))
+            return
+        self.records += 1
+        if record["idx"] == 1:
+            self._rows = [" " * self.COLS] * self.ROWS
+        text = bytes(c for c in record["text"] if c).decode("latin-1")
+        row = record["line"] - 1
+        if 0 <= row < self.ROWS:
+            col = record["col"] - 1
+            line = self._rows[row]
+            self._rows[row] = (line[:col] + text + line[col + len(text):])[:self.COLS]
+        self._send_control(self.sal, (self.ACK << 16) | (record["idx"] << 8))
+        if last:
+            self.pages += 1
+            self._record_display(tuple(self._rows), timestamp)
+
+
+class EfisPanel(PanelEmulator):
+    """EFIS control panel (efis_logic.py). Sends the discrete labels of its equipment file.
+
+    Script actions: ``("set", label_name, pad_name, value)``, ``("pulse",
+    label_name, pad_name, hold_sec)``, ``("set_alive", bool)``. The EFIS has
+    no display; the logic's dataref writes are recorded through ``watch()``
+    instead.
+    """
+
+    PERIOD_SEC: float = 0.1
+
+    def __init__(self, card, equipment_path: str, rx_chnl: int = 0, script: list = None):
+        super().__init__(card, None, rx_chnl, script)
+        with open(equipment_path, encoding="utf-8") as f:
+            equipment = json.load(f)
+        self._labels = {}
+        for name, cfg in equipment.get("labels", {}).items():
+            if cfg.get("channel_direction", "RX") == "RX":
+                pads = {p: pad_field(b["bits"]) for p, b in cfg.get("pad_bits", {}).items()}
+                self._labels[name] = [int(cfg["label"], 8), pads, 0]
+        self._release_at = {}
+        self._next_send = 0.0
+        self._alive = True
+
+    def set(self, label_name: str, pad_name: str, value: int = 1):
+        label = self._labels[label_name]
+        shift, mask = label[1][pad_name]
+        label[2] = (label[2] & ~(mask << shift)) | ((int(value) & mask) << shift)
+        self._record_key((label_name, pad_name, value))
+        self._next_send = self._now
+
+    def pulse(self, label_name: str, pad_name: str, hold_sec: float = 0.2):
+        self.set(label_name, pad_name, 1)
+        self._release_at[(label_name, pad_name)] = self._now + hold_sec
+
+    def set_alive(self, alive: bool):
+        """Stops or restarts the periodic labels, as a panel losing power would."""
+        self._alive = alive
+        self._next_send = self._now
+
+    def next_deadline(self) -> float | None:
+        return _earliest(super().next_deadline(), self._next_send if self._alive else None,
+                         *self._release_at.values())
+
+    def watch(self, datarefs):
+        """Records the dataref writes of the logic script as the panel's display."""
+        datarefs.listeners.append(lambda name, value, now: self.displays.append((now, (name, value))))
+
+    def _periodic(self, now: float):
+        for (label_name, pad_name), release in list(self._release_at.items()):
+            if release <= now:
+                del self._release_at[(label_name, pad_name)]
+                self.set(label_name, pad_name, 0)
+        if self._alive and now >= self._next_send:
+            for label, _, data in self._labels.values():
+                self.send((data & 0x7FFFFC00) | reverse_label(label), now)
+            self._next_send = now + self.PERIOD_SEC
+
+
+def for_script(card, script_path: str) -> PanelEmulator | None:
+    """Emulator of the panel a logic script drives, by script name; None if it has none.
+
+    The A739 panel starts by polling the script with ENQ, as the real MCDU does.
+    """
+    name = os.path.basename(script_path).lower()
+    if name.startswith("hud"):
+        return HudPanel(card)
+    if "a739" in name:
+        return A739Panel(card, script=[(0.0, "enq", 0o300, 0)])
+    if name.startswith("mcdu"):
+        return GeMcduPanel(card)
+    return None
+
+
+def attach(host, emulator: PanelEmulator) -> PanelEmulator:
+    """Adds an emulator to a ``LogicHost`` so it is stepped with the bus."""
+    host.peers.append(emulator)
+    return emulator
@@ -0,0 +1,149 @@
+"""Dataref values in shared memory
+
+A table of named values, one slot per dataref, that one process writes and
+other processes read (see ``tools.logic_worker``). Each slot has a 64-bit
+sequence number used as a seqlock: the writer makes it odd, writes the
+value, then makes it even again. A reader retries while the number is odd
+or changed under it, so it never sees half a value.
+
+Slots keep the Python type of the value: int, float, bool, str or None.
+Numbers take 8 bytes. Datarefs declared with a "length" in the sim config
+(HGS lines, cdu1) are strings, stored UTF-8 in ``STRING_SLOT_BYTES``
+bytes. ``version`` counts the writes to the whole table, so a reader finds
+out that nothing changed with one read.
+
+Both processes build the slots from the same sim config, so slot ``i`` is
+the same dataref on both sides. Like ``tools.spsc_ring``, the seqlock relies
+on stores becoming visible in program order (x86, x86-64).
+"""
+
+import struct
+from multiprocessing import shared_memory
+
+# Bytes for a string dataref. The cdu1 page XML is 2..4 kB
+STRING_SLOT_BYTES: int = 16384
+NUMBER_BYTES: int = 8
+
+TAG_NONE: int = 0
+TAG_INT: int = 1
+TAG_FLOAT: int = 2
+TAG_BOOL: int = 3
+TAG_STR: int = 4
+
+# Slot header: sequence number, value tag, string length
+_HEADER = struct.Struct("<QII")
+_INT = struct.Struct("<q")
+_FLOAT = struct.Struct("<d")
+# Table header: version
+_VERSION = struct.Struct("<Q")
+
+
+def _align(n: int) -> int:
+    return (n + 7) & ~7
+
+
+def sim_slots(sim_config: dict) -> list:
+    """``(name, bytes)`` of every dataref of a sim config, in config order."""
+    return [(name, STRING_SLOT_BYTES if "length" in cfg else NUMBER_BYTES)
+            for name, cfg in sim_config.get("datarefs", {}).items()]
+
+
+class SharedValues:
+    """Seqlock-protected value table in a shared memory block.
+
+    Args:
+        slots (list): ``(name, bytes)`` per slot, see ``sim_slots()``
+        name (str): name of an existing table to attach to; None creates a new one
+    """
+
+    def __init__(self, slots: list, name: str = None):
+        self.names = [slot_name for slot_name, _ in slots]
+        self.index = {slot_name: i for i, slot_name in enumerate(self.names)}
+        # Byte offset and data size of each slot
+        self._offsets = []
+        self._sizes = []
+        offset = _VERSION.size
+        for _, size in slots:
+            self._offsets.append(offset)
+            self._sizes.append(size)
+            offset = _align(offset + _HEADER.size + size)
+        self._owner = name is None
+        if self._owner:
+            self._shm = shared_memory.SharedMemory(create=True, size=offset)
+        else:
+            self._shm = shared_memory.SharedMemory(name=name)
+        self._buf = self._shm.buf
+
+    @property
+    def name(self) -> str:
+        """Name to attach to the table from another process."""
+        return self._shm.name
+
+    @property
+    def version(self) -> int:
+        return _VERSION.unpack_from(self._buf, 0)[0]
+
+    def write(self, i: int, value):
+        """Stores ``value`` in slot ``i``. Only the one process writing the table may call this."""
+        if value is None:
+            tag, data = TAG_NONE, b""
+        elif isinstance(value, bool):
+            tag, data = TAG_BOOL, _INT.pack(value)
+        elif isinstance(value, int):
+            tag, data = TAG_INT, _INT.pack(value)
+        elif isinstance(value, float):
+            tag, data = TAG_FLOAT, _FLOAT.pack(value)
+        elif isinstance(value, str):
+            tag, data = TAG_STR, value.encode("utf-8")
+        else:
+            raise TypeError(f"dataref '{self.names[i]}': {type(value).__name__} values cannot be shared")
+        if len(data) > self._sizes[i]:
+            raise ValueError(f"dataref '{self.names[i]}': {len(data)} bytes do not fit its {self._sizes[i]} byte slot")
+        offset = self._offsets[i]
+        seq = _HEADER.unpack_from(self._buf, offset)[0]
+        _HEADER.pack_into(self._buf, offset, seq + 1, tag, len(data))
+        start = offset + _HEADER.size
+        self._buf[start:start + len(data)] = data
+        _HEADER.pack_into(self._buf, offset, seq + 2, tag, len(data))
+        _VERSION.pack_into(self._buf, 0, self.version + 1)
+
+    def read(self, i: int):
+        """Returns the value of slot ``i`` as it was after one complete write."""
+        offset = self._offsets[i]
+        start = offset + _HEADER.size
+        while True:
+            seq, tag, length = _HEADER.unpack_from(self._buf, offset)
+            if seq & 1:
+                continue
+            if tag == TAG_STR:
+                value = bytes(self._buf[start:start + length])
+            elif tag == TAG_FLOAT:
+                value = _FLOAT.unpack_from(self._buf, start)[0]
+            else:
+                value = _INT.unpack_from(self._buf, start)[0]
+            if _HEADER.unpack_from(self._buf, offset)[0] == seq:
+                break
+        if tag == TAG_STR:
+            return value.decode("utf-8")
+        if tag == TAG_BOOL:
+            return bool(value)
+        if tag == TAG_NONE:
+            return None
+        return value
+
+    def changed(self, seqs: list) -> list:
+        """Indexes of the slots whose sequence number differs from ``seqs``, which is updated in place."""
+        out = []
+        for i, offset in enumerate(self._offsets):
+            seq = _HEADER.unpack_from(self._buf, offset)[0]
+            if seq != seqs[i] and not seq & 1:
+                seqs[i] = seq
+                out.append(i)
+        return out
+
+    def close(self):
+        """Detaches from the block; the creating process also removes it."""
+        self._buf = None
+        self._shm.close()
+        if self._owner:
+            self._shm.unlink()
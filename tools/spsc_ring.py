@@ -0,0 +1,95 @@
+"""Single-producer single-consumer ring of fixed-size records in shared memory
+
+Carries ARINC words and dataref writes between the headless runtime and a
+logic worker process (see ``tools.logic_worker``) without locks: exactly
+one process pushes and exactly one process pops.
+
+The block holds two 64-bit counters, each on its own cache line, then the
+records:
+
+    head   records pushed so far, written only by the producer
+    tail   records popped so far, written only by the consumer
+
+Both only grow; record ``n`` lives in slot ``n % capacity``. The producer
+writes the record before it stores the new head, and the consumer reads
+the records before it stores the new tail, so each side only ever reads
+slots the other one has finished with. That ordering relies on the stores
+of one process becoming visible to the other in program order, as on
+x86 and x86-64 (total store order).
+
+A full ring refuses the record: ``push()`` returns False and counts it in
+``dropped``. Nothing blocks.
+"""
+
+import struct
+from multiprocessing import shared_memory
+
+CACHE_LINE: int = 64
+HEAD: int = 0
+# Index of the tail counter in the 64-bit view: one cache line after the head
+TAIL: int = CACHE_LINE // 8
+HEADER_SIZE: int = 2 * CACHE_LINE
+
+
+class SpscRing:
+    """Ring of ``struct`` records in a shared memory block.
+
+    Args:
+        record (str): ``struct`` format of one record, e.g. ``"<HHId"``
+        capacity (int): records the ring holds, rounded up to a power of two
+        name (str): name of an existing ring to attach to; None creates a new one
+    """
+
+    def __init__(self, record: str, capacity: int, name: str = None):
+        self._record = struct.Struct(record)
+        capacity = 1 << max(0, capacity - 1).bit_length()
+        self.capacity = capacity
+        self._mask = capacity - 1
+        size = HEADER_SIZE + capacity * self._record.size
+        self._owner = name is None
+        if self._owner:
+            self._shm = shared_memory.SharedMemory(create=True, size=size)
+        else:
+            self._shm = shared_memory.SharedMemory(name=name)
+        self._buf = self._shm.buf
+        self._counters = self._buf[:HEADER_SIZE].cast("Q")
+        self.dropped = 0
+
+    @property
+    def name(self) -> str:
+        """Name to attach to the ring from another process."""
+        return self._shm.name
+
+    def __len__(self) -> int:
+        return self._counters[HEAD] - self._counters[TAIL]
+
+    def push(self, *fields) -> bool:
+        """Appends one record. Returns False, and counts it in ``dropped``, when the ring is full."""
+        head = self._counters[HEAD]
+        if head - self._counters[TAIL] >= self.capacity:
+            self.dropped += 1
+            return False
+        self._record.pack_into(self._buf, HEADER_SIZE + (head & self._mask) * self._record.size, *fields)
+        self._counters[HEAD] = head + 1
+        return True
+
+    def pop_all(self) -> list:
+        """Removes and returns every record pushed so far, oldest first, as tuples."""
+        tail = self._counters[TAIL]
+        head = self._counters[HEAD]
+        if head == tail:
+            return []
+        unpack_from = self._record.unpack_from
+        size = self._record.size
+        mask = self._mask
+        out = [unpack_from(self._buf, HEADER_SIZE + (n & mask) * size) for n in range(tail, head)]
+        self._counters[TAIL] = head
+        return out
+
+    def close(self):
+        """Detaches from the block; the creating process also removes it."""
+        self._counters.release()
+        self._buf = None
+        self._shm.close()
+        if self._owner:
+            self._shm.unlink()
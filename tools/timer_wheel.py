@@ -0,0 +1,307 @@
+"""Hierarchical timer wheel
+
+One scheduler for the many independent deadlines of a cockpit: label
+timetables ("timing_ms"), dataref poll intervals ("read_interval_ms"),
+heartbeats and timeouts. Inserting and cancelling a timer is O(1) and
+advancing the clock costs O(1) per expired timer, however many timers
+are pending, where a heap pays O(log n) for each.
+
+- Layout
+Time is counted in ticks of ``tick_sec``. Level 0 has one slot per tick
+for the current ``slots`` ticks, level 1 one slot per ``slots`` ticks for
+the current ``slots ** 2`` ticks, and so on. A timer goes in the lowest
+level whose current range holds its deadline. When the clock enters the
+range of a higher level slot, the timers of that slot are moved down a
+level (cascade). Deadlines beyond the top level wait in an overflow list.
+With the defaults (1 ms ticks, 256 slots, 4 levels) that is 49 days.
+
+A timer never fires early. It fires on the first ``advance(now)`` at or
+after its deadline rounded up to the next tick. Periodic timers keep their
+phase and skip missed periods when the clock jumps by more than one
+period, as the card timetable does.
+
+``python -m tools.timer_wheel`` runs the scaling benchmark against a heap.
+In CPython the heap is C code and stays ahead up to around 10,000 periodic
+timers; at 100,000 the wheel fires them in about half the time. Its cost
+per fired timer stays flat as timers are added, the heap's grows.
+"""
+
+import argparse
+import heapq
+import math
+import random
+import time
+from typing import Callable
+
+
+class Timer:
+    """A scheduled callback. ``deadline`` is the next time it is due."""
+
+    __slots__ = ("deadline", "period", "callback", "_expiry", "_level", "_slot")
+
+    def __init__(self, deadline: float, callback: Callable[[float], None], period: float = None):
+        self.deadline = deadline
+        self.period = period
+        self.callback = callback
+        self._expiry = 0
+        self._level = None
+        # Slot dict holding the timer, None when not scheduled
+        self._slot = None
+
+    @property
+    def active(self) -> bool:
+        return self._slot is not None
+
+
+class TimerWheel:
+    """Hierarchical timer wheel. See the module documentation.
+
+    Args:
+        tick_sec (float): resolution
+        slots (int): slots per level, a power of 2
+        levels (int): number of levels
+        now (float): current time, the clock of the owner
+    """
+
+    def __init__(self, tick_sec: float = 0.001, slots: int = 256, levels: int = 4, now: float = 0.0):
+        if slots & (slots - 1):
+            raise ValueError(f"slots must be a power of 2, got {slots}")
+        self.tick_sec = tick_sec
+        self._ticks_per_sec = 1 / tick_sec
+        self.levels = levels
+        self._bits = slots.bit_length() - 1
+        self._mask = slots - 1
+        # Ticks covered by one slot of each level, and by the whole top level
+        self._spans = [slots ** level for level in range(levels + 1)]
+        self._wheel = [[{} for _ in range(slots)] for _ in range(levels)]
+        self._counts = [0] * levels
+        # Bit i set while level 0 slot i holds timers
+        self._occupied = 0
+        self._overflow = {}
+        self._len = 0
+        self._tick = math.floor(now * self._ticks_per_sec + 1e-6)
+        # Time advance() is moving the wheel to
+        self._advance_to = now
+        self.fired = 0
+
+    def __len__(self) -> int:
+        return self._len
+
+    @property
+    def now(self) -> float:
+        """Time of the last tick the wheel advanced to."""
+        return self._tick * self.tick_sec
+
+    def schedule(self, deadline: float, callback: Callable[[float], None], period: float = None) -> Timer:
+        """Calls ``callback(due)`` at ``deadline``, then every ``period`` seconds if given."""
+        timer = Timer(deadline, callback, period)
+        self._insert(timer)
+        return timer
+
+    def call_later(self, delay: float, callback: Callable[[float], None], period: float = None) -> Timer:
+        return self.schedule(self.now + delay, callback, period)
+
+    def cancel(self, timer: Timer):
+        slot = timer._slot
+        if slot is None:
+            return
+        del slot[timer]
+        timer._slot = None
+        if timer._level is not None:
+            self._counts[timer._level] -= 1
+            if timer._level == 0 and not slot:
+                self._occupied &= ~(1 << (timer._expiry & self._mask))
+        self._len -= 1
+
+    def reschedule(self, timer: Timer, deadline: float):
+        """Moves a timer to a new deadline. Also restarts a fired or cancelled timer."""
+        self.cancel(timer)
+        timer.deadline = deadline
+        self._insert(timer)
+
+    def _insert(self, timer: Timer):
+        # Round up: never early. A deadline at or before the current tick is due on the next one
+        expiry = math.ceil(timer.deadline * self._ticks_per_sec - 1e-6)
+        if expiry <= self._tick:
+            expiry = self._tick + 1
+        timer._expiry = expiry
+        self._place(timer)
+        self._len += 1
+
+    def _place(self, timer: Timer):
+        expiry = timer._expiry
+        # Lowest level whose current range holds the expiry: above the highest bit that differs from now
+        level = (((expiry ^ self._tick) | 1).bit_length() - 1) // self._bits
+        if level < self.levels:
+            index = (expiry >> (self._bits * level)) & self._mask
+            slot = self._wheel[level][index]
+            self._counts[level] += 1
+            if not level:
+                self._occupied |= 1 << index
+        else:
+            slot = self._overflow
+            level = None
+        timer._level = level
+        slot[timer] = None
+        timer._slot = slot
+
+    def _cascade(self, level: int, index: int):
+        slot = self._wheel[level][index]
+        if not slot:
+            return
+        self._wheel[level][index] = {}
+        self._counts[level] -= len(slot)
+        for timer in slot:
+            self._place(timer)
+
+    def advance(self, now: float) -> int:
+        """Fires every timer due up to ``now`` in deadline order. Returns how many fired."""
+        target = math.floor(now * self._ticks_per_sec + 1e-6)
+        self._advance_to = now
+        fired = self.fired
+        spans, levels, mask = self._spans, self.levels, self._mask
+        while self._tick < target:
+            if not self._len:
+                self._tick = target
+                break
+            if self._counts[0]:
+                # Next occupied level 0 slot: all of them are ahead of the current tick
+                ahead = self._occupied >> ((self._tick & mask) + 1)
+                tick = self._tick + (ahead & -ahead).bit_length()
+            else:
+                # Levels below the first one holding timers stay empty until the next cascade into them
+                step = spans[1]
+                for level in range(1, levels):
+                    if self._counts[level]:
+                        break
+                    step = spans[level + 1]
+                tick = (self._tick // step + 1) * step
+            if tick > target:
+                self._tick = target
+                break
+            self._tick = tick
+            if tick % spans[levels] == 0 and self._overflow:
+                overflow, self._overflow = self._overflow, {}
+                for timer in overflow:
+                    self._place(timer)
+            for level in range(levels - 1, 0, -1):
+                if tick % spans[level] == 0:
+                    self._cascade(level, (tick // spans[level]) & mask)
+            self._fire(tick)
+        return self.fired - fired
+
+    def _fire(self, tick: int):
+        index = tick & self._mask
+        slot = self._wheel[0][index]
+        if not slot:
+            return
+        self._wheel[0][index] = {}
+        self._occupied &= ~(1 << index)
+        now = self._advance_to
+        insert = self._insert
+        for timer in list(slot):
+            # Skip timers cancelled by a callback fired before them
+            if timer._slot is not slot:
+                continue
+            timer._slot = None
+            self._counts[0] -= 1
+            self._len -= 1
+            due = timer.deadline
+            if timer.period is not None:
+                timer.deadline = due + timer.period
+                if timer.deadline <= now:
+                    timer.deadline = now + timer.period
+                insert(timer)
+            self.fired += 1
+            timer.callback(due)
+
+    def next_deadline(self) -> float | None:
+        """Time of the tick the earliest pending timer fires on, None if there is none.
+
+        This is the deadline rounded up to the tick, so ``advance()`` to the
+        returned time always fires the timer.
+        """
+        bits, mask, tick_sec = self._bits, self._mask, self.tick_sec
+        for level in range(self.levels):
+            if not self._counts[level]:
+                continue
+            slots = self._wheel[level]
+            for index in range((self._tick >> (bits * level)) & mask, mask + 1):
+                if slots[index]:
+                    return min(timer._expiry for timer in slots[index]) * tick_sec
+        if self._overflow:
+            return min(timer._expiry for timer in self._overflow) * tick_sec
+        return None
+
+
+class _HeapScheduler:
+    """Reference scheduler for the benchmark: the same API on a heap."""
+
+    def __init__(self):
+        self._heap = []
+        self._seq = 0
+        self.fired = 0
+
+    def schedule(self, deadline: float, callback: Callable[[float], None], period: float = None):
+        self._seq += 1
+        heapq.heappush(self._heap, (deadline, self._seq, callback, period))
+
+    def advance(self, now: float):
+        heap = self._heap
+        while heap and heap[0][0] <= now:
+            deadline, _, callback, period = heapq.heappop(heap)
+            if period is not None:
+                due = deadline + period
+                self.schedule(due if due > now else now + period, callback, period)
+            self.fired += 1
+            callback(deadline)
+
+
+def benchmark(timers: int, duration_sec: float, step_sec: float, seed: int = 1) -> dict:
+    """Periodic timers with random periods and phases, as a cockpit's labels and datarefs.
+
+    Both schedulers get the same timers and clock steps. Returns ns per
+    insert and per fired timer for each.
+    """
+    rng = random.Random(seed)
+    periods = [rng.choice((0.025, 0.05, 0.1, 0.2, 0.5, 0.9, 1.0, 1.5, 5.0)) for _ in range(timers)]
+    phases = [rng.random() * p for p in periods]
+    results = {}
+    for name, scheduler in (("wheel", TimerWheel()), ("heap", _HeapScheduler())):
+        def noop(due):
+            pass
+
+        t0 = time.perf_counter_ns()
+        for period, phase in zip(periods, phases):
+            scheduler.schedule(phase, noop, period)
+        t1 = time.perf_counter_ns()
+        now = 0.0
+        while now < duration_sec:
+            now += step_sec
+            scheduler.advance(now)
+        t2 = time.perf_counter_ns()
+        results[name] = {
+            "insert_ns": (t1 - t0) / timers,
+            "fired": scheduler.fired,
+            "ns_per_fired": (t2 - t1) / max(scheduler.fired, 1),
+            "advance_ms": (t2 - t1) / 1e6,
+        }
+    return results
+
+
+def main(argv: list = None) -> int:
+    parser = argparse.ArgumentParser(description="Timer wheel scaling benchmark")
+    parser.add_argument("--timers", type=int, nargs="+", default=[100, 1000, 10000])
+    parser.add_argument("--duration", type=float, default=10.0, help="simulated seconds (default: 10)")
+    parser.add_argument("--step-ms", type=float, default=1.0, help="clock step (default: 1)")
+    args = parser.parse_args(argv)
+    print(f"{'timers':>8} {'scheduler':>9} {'insert ns':>10} {'fired':>9} {'ns/fired':>9} {'advance ms':>11}")
+    for count in args.timers:
+        for name, result in benchmark(count, args.duration, args.step_ms / 1000).items():
+            print(f"{count:>8} {name:>9} {result['insert_ns']:>10.0f} {result['fired']:>9} "
+                  f"{result['ns_per_fired']:>9.0f} {result['advance_ms']:>11.1f}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,182 @@
+"""End-to-end latency tracing
+
+Follows a dataref change from the simulator to the ARINC word on the wire.
+Every simulator update of a dataref starts a trace with its own ID. The
+trace is stamped at each stage it reaches:
+
+    sim receive    the simulator sets the dataref
+    logic read     the logic script first reads the new value
+    encode         the script hands words to the driver (send_manual_* call
+                   or timetable update) after having read it
+    driver submit  the driver call returns
+    card TX        the last of those words is completely on the wire
+
+Words submitted while traces are waiting after ``logic read`` carry those
+traces. The card TX time comes from the virtual card's wire model; traces
+sent through a timetable channel get the time of the next slot of that
+timetable entry.
+
+``Tracer.export_chrome(path)`` writes the Chrome trace event format: open it
+in chrome://tracing or https://ui.perfetto.dev. Each trace is one row with a
+span for the whole trace and one span from each stage to the next.
+"""
+
+import itertools
+import json
+import time
+from typing import Callable
+
+STAGES = ("sim receive", "logic read", "encode", "driver submit", "card TX")
+
+
+class Trace:
+    __slots__ = ("trace_id", "name", "value", "stamps")
+
+    def __init__(self, trace_id: int, name: str, value):
+        self.trace_id = trace_id
+        self.name = name
+        self.value = value
+        # stage -> timestamp
+        self.stamps = {}
+
+    @property
+    def latency(self) -> float | None:
+        """Seconds from sim receive to card TX, None if the trace did not reach the wire."""
+        if "card TX" in self.stamps:
+            return self.stamps["card TX"] - self.stamps["sim receive"]
+        return None
+
+
+class Tracer:
+    """Collects traces for one ``LogicHost``.
+
+    Args:
+        clock (Callable): time source, the same as the host's
+        names (set): datarefs to trace; None traces every dataref
+        max_wait_sec (float): traces read but not followed by a TX within this time are dropped
+    """
+
+    def __init__(self, clock: Callable[[], float] = time.monotonic, names: set = None, max_wait_sec: float = 1.0):
+        self._clock = clock
+        self._names = names
+        self.max_wait_sec = max_wait_sec
+        self._ids = itertools.count(1)
+        self.traces = []
+        # dataref name -> trace waiting for the logic read
+        self._unread = {}
+        # traces read by the logic and waiting for a TX
+        self._read = []
+
+    def instrument(self, host):
+        """Hooks the host's datarefs and virtual cards. Call before ``host.run()``."""
+        prosim = host.datarefs.prosim
+        prosim.set_listeners.append(self._on_set)
+        prosim.read_listeners.append(self._on_read)
+        for card in host.devices.values():
+            self._wrap_card(card)
+
+    def _on_set(self, name: str, value, now: float):
+        if self._names is not None and name not in self._names:
+            return
+        trace = Trace(next(self._ids), name, value)
+        trace.stamps["sim receive"] = now
+        self.traces.append(trace)
+        # A newer value supersedes one the script has not read yet
+        self._unread[name] = trace
+
+    def _on_read(self, name: str):
+        trace = self._unread.pop(name, None)
+        if trace is not None:
+            trace.stamps["logic read"] = self._clock()
+            self._read.append(trace)
+
+    def _take_read(self, now: float) -> list:
+        traces = [t for t in self._read if now - t.stamps["logic read"] <= self.max_wait_sec]
+        self._read = []
+        return traces
+
+    def _wrap_card(self, card):
+        send_list = card.send_manual_list_fast
+        send_single = card.send_manual_single_fast
+        timetable_set = card.timetable_set
+        tracer = self
+
+        def submitted(traces: list, chnls, submit_start: float):
+            now = tracer._clock()
+            on_wire = max(card._tx_chnl[c]._wire_free_at for c in chnls)
+            for trace in traces:
+                trace.stamps["encode"] = submit_start
+                trace.stamps["driver submit"] = now
+                trace.stamps["card TX"] = on_wire
+
+        def send_manual_list_fast(labels: list):
+            traces = tracer._take_read(tracer._clock()) if tracer._read else None
+            start = tracer._clock()
+            send_list(labels)
+            if traces:
+                submitted(traces, {c for c, _ in labels}, start)
+
+        def send_manual_single_fast(chnl: int, label: int):
+            traces = tracer._take_read(tracer._clock()) if tracer._read else None
+            start = tracer._clock()
+            send_single(chnl, label)
+            if traces:
+                submitted(traces, (chnl,), start)
+
+        def traced_timetable_set(chnl: int, key, label: int, period_sec: float):
+            traces = tracer._take_read(tracer._clock()) if tracer._read else None
+            start = tracer._clock()
+            timetable_set(chnl, key, label, period_sec)
+            if traces:
+                now = tracer._clock()
+                tx = card._tx_chnl[chnl]
+                on_wire = max(tx._timetable[key][2].deadline, now) + tx.word_time
+                for trace in traces:
+                    trace.stamps["encode"] = start
+                    trace.stamps["driver submit"] = now
+                    trace.stamps["card TX"] = on_wire
+
+        card.send_manual_list_fast = send_manual_list_fast
+        card.send_manual_single_fast = send_manual_single_fast
+        card.timetable_set = traced_timetable_set
+
+    def summary(self) -> dict:
+        """Per dataref: number of traces, traces on the wire and latency min/mean/max in ms."""
+        out = {}
+        for trace in self.traces:
+            entry = out.setdefault(trace.name, {"traces": 0, "on_wire": 0, "latencies": []})
+            entry["traces"] += 1
+            if trace.latency is not None:
+                entry["on_wire"] += 1
+                entry["latencies"].append(trace.latency * 1000)
+        for entry in out.values():
+            lat = entry.pop("latencies")
+            if lat:
+                entry.update(min_ms=min(lat), mean_ms=sum(lat) / len(lat), max_ms=max(lat))
+        return out
+
+    def chrome_events(self) -> list:
+        if not self.traces:
+            return []
+        t0 = min(t.stamps["sim receive"] for t in self.traces)
+        events = []
+        for trace in self.traces:
+            stamps = [(s, trace.stamps[s]) for s in STAGES if s in trace.stamps]
+            start = stamps[0][1]
+            args = {"trace_id": trace.trace_id, "value": str(trace.value)[:80]}
+            events.append({
+                "name": trace.name, "cat": "trace", "ph": "X", "pid": 1, "tid": trace.trace_id,
+                "ts": (start - t0) * 1e6, "dur": (stamps[-1][1] - start) * 1e6, "args": args,
+            })
+            for (stage, ts), (next_stage, ts_next) in zip(stamps, stamps[1:]):
+                events.append({
+                    "name": f"{stage} -> {next_stage}", "cat": "stage", "ph": "X", "pid": 1, "tid": trace.trace_id,
+                    "ts": (ts - t0) * 1e6, "dur": (ts_next - ts) * 1e6, "args": args,
+                })
+            events.append({"name": "thread_name", "ph": "M", "pid": 1, "tid": trace.trace_id,
+                           "args": {"name": f"{trace.name} #{trace.trace_id}"}})
+        return events
+
+    def export_chrome(self, path: str):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"traceEvents": self.chrome_events(), "displayTimeUnit": "ms"}, f)
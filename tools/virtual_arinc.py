@@ -0,0 +1,308 @@
+"""Virtual A429_8 ARINC 429 card
+
+An in-process stand-in for the A429_8 card with the interface the logic
+scripts use:
+
+- ``is_ready``
+- ``_rx_chnl[n]._label_queue``: a deque of ``(label, timestamp)`` tuples
+- ``send_manual_list_fast([(chnl, label), ...])``
+- ``send_manual_single_fast(chnl, label)``
+
+The card models word timing on the wire. A word takes 36 bit times: 32 data
+bits plus the 4 bit minimum gap. At 12.5 kHz that is 2.88 ms and at 100 kHz
+0.36 ms. Every TX channel has a bounded FIFO, so words leave the card in
+order, one wire time apart. TX_MANUAL channels are fed by the send methods.
+TX_TIMETABLE channels repeat scheduled words at a fixed period. A TX channel
+can be wired back to one or more RX channels of the same card (loopback);
+words arrive there when they finish on the wire. Panel emulators can also
+listen to TX channels and inject words into RX channels, and logic workers
+(``tools.logic_worker``) listen to RX channels.
+
+- Configuration
+The card is created from a config/device JSON whose "product" is
+"A429_8_SIM". It uses the same "TX_channels"/"RX_channels" settings as the
+real card. A TX channel may add "loopback_rx": [rx numbers] and
+"fifo_depth": words.
+
+The card has no thread of its own. Call ``step()`` from the loop that drives
+the logic scripts, or run ``run()`` as an asyncio task. Timetable words are
+timers of a ``tools.timer_wheel.TimerWheel``. Pass the same wheel to every
+card (``load_devices(timers=...)``) so that one ``advance()`` serves the
+whole cockpit.
+"""
+
+import asyncio
+import collections
+import json
+import os
+import time
+from typing import Callable
+
+from tools.timer_wheel import TimerWheel
+
+PRODUCT: str = "A429_8_SIM"
+
+# Channel speed setting -> bit rate in bits/s
+SPEEDS = {"S12_KHZ": 12500, "S100_KHZ": 100000}
+
+# Bit times used by one word on the wire: 32 data bits + 4 bit minimum gap
+WORD_BITS: int = 36
+
+TX_FIFO_DEPTH: int = 512
+RX_FIFO_DEPTH: int = 512
+
+
+def word_time(speed: str) -> float:
+    """Seconds one word occupies the wire at the given channel speed setting."""
+    return WORD_BITS / SPEEDS[speed]
+
+
+class VirtualRxChannel:
+    """Receiving channel. Words land in ``_label_queue`` as ``(label, timestamp)``."""
+
+    def __init__(self, number: int, speed: str = "S100_KHZ", mode: str = "RX_NORMAL", enable: bool = True,
+                 fifo_depth: int = RX_FIFO_DEPTH):
+        self.number = number
+        self.speed = speed
+        self.mode = mode
+        self.enable = enable
+        self._label_queue = collections.deque()
+        self._fifo_depth = fifo_depth
+        # Callbacks for every received word (logic workers)
+        self.listeners = []
+        # Counters
+        self.received = 0
+        self.overflows = 0
+
+    def put(self, label: int, timestamp: float):
+        """Stores a received word. The oldest word is lost when the FIFO is full, as on the card."""
+        if not self.enable:
+            return
+        if len(self._label_queue) >= self._fifo_depth:
+            self._label_queue.popleft()
+            self.overflows += 1
+        self._label_queue.append((label & 0xFFFFFFFF, timestamp))
+        self.received += 1
+        for callback in self.listeners:
+            callback(label & 0xFFFFFFFF, timestamp)
+
+
+class VirtualTxChannel:
+    """Transmitting channel with a bounded FIFO and an optional timetable."""
+
+    def __init__(self, number: int, speed: str = "S100_KHZ", mode: str = "TX_MANUAL", enable: bool = True,
+                 fifo_depth: int = TX_FIFO_DEPTH):
+        self.number = number
+        self.speed = speed
+        self.mode = mode
+        self.enable = enable
+        self.word_time = word_time(speed)
+        self._fifo_depth = fifo_depth
+        # Words accepted by the card: (time the word is off the wire, label)
+        self._fifo = collections.deque()
+        self._wire_free_at = 0.0
+        # TX_TIMETABLE entries: key -> [label, period, Timer]. The timer deadline is the next due time
+        self._timetable = {}
+        # RX channels wired to this TX channel and TX listeners (emulators)
+        self.loopback = []
+        self.listeners = []
+        # Counters
+        self.sent = 0
+        self.rejected = 0
+
+    @property
+    def fifo_level(self) -> int:
+        return len(self._fifo)
+
+    def push(self, label: int, now: float):
+        """Queues a word for the wire. Raises BufferError when the FIFO is full."""
+        if len(self._fifo) >= self._fifo_depth:
+            self.rejected += 1
+            raise BufferError(f"TX channel {self.number} FIFO full ({self._fifo_depth} words)")
+        done = max(self._wire_free_at, now) + self.word_time
+        self._wire_free_at = done
+        self._fifo.append((done, label & 0xFFFFFFFF))
+
+    def step(self, now: float) -> list:
+        """Returns the (time, label) words that finished on the wire."""
+        out = []
+        fifo = self._fifo
+        while fifo and fifo[0][0] <= now:
+            out.append(fifo.popleft())
+        self.sent += len(out)
+        return out
+
+
+class VirtualA429Card:
+    """Virtual A429_8 card. See the module documentation."""
+
+    product: str = PRODUCT
+
+    def __init__(self, name: str = "arinc_1", clock: Callable[[], float] = time.monotonic,
+                 timers: TimerWheel = None):
+        self.name = name
+        self._clock = clock
+        self.timers = timers if timers is not None else TimerWheel(now=clock())
+        self._ready = True
+        self._tx_chnl = {}
+        self._rx_chnl = {}
+
+    @classmethod
+    def from_settings(cls, settings: dict, clock: Callable[[], float] = time.monotonic,
+                      timers: TimerWheel = None) -> "VirtualA429Card":
+        """Creates a card from the "settings" object of a device JSON."""
+        card = cls(settings.get("name", "arinc_1"), clock=clock, timers=timers)
+        for number, cfg in settings.get("RX_channels", {}).items():
+            card.add_rx_channel(int(number), cfg.get("speed", "S100_KHZ"), cfg.get("mode", "RX_NORMAL"),
+                                cfg.get("enable", True), cfg.get("fifo_depth", RX_FIFO_DEPTH))
+        for number, cfg in settings.get("TX_channels", {}).items():
+            card.add_tx_channel(int(number), cfg.get("speed", "S100_KHZ"), cfg.get("mode", "TX_MANUAL"),
+                                cfg.get("enable", True), cfg.get("fifo_depth", TX_FIFO_DEPTH))
+            for rx in cfg.get("loopback_rx", []):
+                card.connect(int(number), int(rx))
+        return card
+
+    # ----- Configuration -----
+
+    def add_rx_channel(self, number: int, speed: str = "S100_KHZ", mode: str = "RX_NORMAL", enable: bool = True,
+                       fifo_depth: int = RX_FIFO_DEPTH) -> VirtualRxChannel:
+        self._rx_chnl[number] = VirtualRxChannel(number, speed, mode, enable, fifo_depth)
+        return self._rx_chnl[number]
+
+    def add_tx_channel(self, number: int, speed: str = "S100_KHZ", mode: str = "TX_MANUAL", enable: bool = True,
+                       fifo_depth: int = TX_FIFO_DEPTH) -> VirtualTxChannel:
+        self._tx_chnl[number] = VirtualTxChannel(number, speed, mode, enable, fifo_depth)
+        return self._tx_chnl[number]
+
+    def connect(self, tx_number: int, rx_number: int):
+        """Wires a TX channel to an RX channel of this card (loopback)."""
+        self._tx_chnl[tx_number].loopback.append(self._rx_chnl[rx_number])
+
+    def add_tx_listener(self, tx_number: int, callback: Callable[[int, float], None]):
+        """Calls ``callback(label, timestamp)`` for every word that finishes on the TX channel."""
+        self._tx_chnl[tx_number].listeners.append(callback)
+
+    def add_rx_listener(self, rx_number: int, callback: Callable[[int, float], None]):
+        """Calls ``callback(label, timestamp)`` for every word received on the RX channel."""
+        self._rx_chnl[rx_number].listeners.append(callback)
+
+    # ----- Driver interface used by the logic scripts -----
+
+    @property
+    def is_ready(self) -> bool:
+        return self._ready
+
+    @is_ready.setter
+    def is_ready(self, ready: bool):
+        # Lets tests simulate the card going offline
+        self._ready = ready
+
+    def _tx(self, chnl: int) -> VirtualTxChannel:
+        tx = self._tx_chnl[chnl]
+        if not self._ready or not tx.enable:
+            raise ConnectionError(f"{self.name}: TX channel {chnl} is not available")
+        if tx.mode != "TX_MANUAL":
+            raise ValueError(f"{self.name}: TX channel {chnl} is in {tx.mode} mode")
+        return tx
+
+    def send_manual_single_fast(self, chnl: int, label: int):
+        self._tx(chnl).push(label, self._clock())
+
+    def send_manual_list_fast(self, labels: list):
+        now = self._clock()
+        for chnl, label in labels:
+            self._tx(chnl).push(label, now)
+
+    # ----- Timetable -----
+
+    def timetable_set(self, chnl: int, key, label: int, period_sec: float):
+        """Adds or updates a word repeated every ``period_sec`` on a TX_TIMETABLE channel."""
+        tx = self._tx_chnl[chnl]
+        if tx.mode != "TX_TIMETABLE":
+            raise ValueError(f"{self.name}: TX channel {chnl} is in {tx.mode} mode")
+        entry = tx._timetable.get(key)
+        if entry is None:
+            entry = [label, period_sec, None]
+
+            def due(timestamp: float):
+                if tx.enable:
+                    tx.push(entry[0], timestamp)
+
+            # First word now, then one per period. A jump of the clock skips the missed periods
+            entry[2] = self.timers.schedule(self._clock(), due, period_sec)
+            tx._timetable[key] = entry
+        else:
+            entry[0] = label
+            entry[1] = entry[2].period = period_sec
+
+    # ----- Panel side -----
+
+    def inject(self, rx_chnl: int, label: int, timestamp: float = None):
+        """Delivers a word to an RX channel as if a panel had sent it."""
+        self._rx_chnl[rx_chnl].put(label, self._clock() if timestamp is None else timestamp)
+
+    # ----- Time -----
+
+    def next_deadline(self) -> float | None:
+        """Time a TX FIFO drains or the next timetable word is due, None if the card is idle.
+
+        Words keep their own wire times; a burst wakes the caller once, when its last word is off the wire.
+        """
+        times = [tx._fifo[-1][0] for tx in self._tx_chnl.values() if tx._fifo and tx.enable]
+        timer = self.timers.next_deadline()
+        if timer is not None:
+            times.append(timer)
+        return min(times) if times else None
+
+    def step(self, now: float = None):
+        """Advances the wire up to ``now``. Finished words go to the loopback RX channels and the TX listeners."""
+        now = self._clock() if now is None else now
+        # Due timetable words go into the FIFOs first. A shared wheel is advanced once by the first card
+        self.timers.advance(now)
+        for tx in self._tx_chnl.values():
+            if not tx.enable:
+                continue
+            for done, label in tx.step(now):
+                for rx in tx.loopback:
+                    rx.put(label, done)
+                for callback in tx.listeners:
+                    callback(label, done)
+
+    async def run(self, period_sec: float = 0.001):
+        """Steps the card forever. Run it as an asyncio task next to the logic scripts."""
+        while True:
+            self.step()
+            await asyncio.sleep(period_sec)
+
+
+def load_device(path: str, clock: Callable[[], float] = time.monotonic, force_virtual: bool = False,
+                timers: TimerWheel = None):
+    """Creates a virtual card from a config/device JSON file.
+
+    Returns None for devices that are not virtual ARINC 429 cards. With
+    ``force_virtual`` every ARINC429 device is replaced by a virtual card,
+    so an unmodified cockpit configuration runs without hardware.
+    """
+    with open(path, encoding="utf-8") as f:
+        config = json.load(f)
+    if config.get("product") == PRODUCT or (force_virtual and config.get("type") == "ARINC429"):
+        return VirtualA429Card.from_settings(config.get("settings", {}), clock=clock, timers=timers)
+    return None
+
+
+def load_devices(device_dir: str, clock: Callable[[], float] = time.monotonic, force_virtual: bool = False,
+                 timers: TimerWheel = None) -> dict:
+    """Loads every virtual card found in a config/device directory, keyed by device name.
+
+    The cards share ``timers``, or one wheel created here if it is None.
+    """
+    if timers is None:
+        timers = TimerWheel(now=clock())
+    devices = {}
+    for file_name in sorted(os.listdir(device_dir)):
+        if file_name.endswith(".json"):
+            card = load_device(os.path.join(device_dir, file_name), clock=clock, force_virtual=force_virtual,
+                               timers=timers)
+            if card is not None:
+                devices[card.name] = card
+    return devices
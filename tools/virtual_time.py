@@ -0,0 +1,345 @@
+"""Deterministic virtual-time runner
+
+Runs a logic script in a ``LogicHost`` on a virtual clock that only moves
+when nothing else can run. Whenever the event loop goes idle, the clock
+jumps straight to the next deadline, which is the earliest of:
+
+- an ``asyncio`` timer: the script's ``asyncio.sleep``, ``wait_for``
+  timeouts, futures of ``call_later``
+- a timer of the host's ``TimerWheel``: card timetables, dataref polls
+- a word finishing on the wire of a virtual card
+- the next scripted action or periodic word of a panel emulator
+
+The host is stepped at every jump, so replies and timeouts are seen at the
+time they happen. The script's clocks are rebound to the virtual clock in
+the module globals: the ``time`` module and functions imported from it,
+and ``datetime``. A blocking ``time.sleep`` moves the clock forward by its
+duration, as the blocking call would on the real loop; the same call in a
+helper thread of the script sleeps in real time. The A739 retry path
+(3 retries of 1.5 s) or the HUD 5 s RX timeout then take milliseconds, and
+two runs with the same inputs produce the same events at the same times.
+
+Usage:
+    python -m tools.virtual_time config/logic/mcdu_logic_A739_v3.py --duration 3600
+
+and as a regression run, which fails the scripts that do not load or do
+not get through 60 virtual seconds in 30 s of wall time (a loop that spins
+instead of moving the clock):
+
+    python -m tools.virtual_time config/logic/*.py --duration 60 --regress 30
+
+or from a test:
+
+    runner = VirtualTimeRunner("config/logic/hud_logic.py", "config")
+    panel = attach(runner.host, HudPanel(runner.card, script=[(1.0, "set_alive", False)]))
+    runner.run(10.0)
+
+The virtual clock starts at 0. ``time.time()`` and ``datetime.now()`` of
+the script count from ``epoch``.
+"""
+
+import argparse
+import asyncio
+import datetime as _datetime
+import heapq
+import json
+import subprocess
+import sys
+import threading
+import time
+import types
+
+from tools import panel_emulators
+from tools.logic_host import LogicHost
+
+# time.time() of the script at virtual time 0: 2024-01-01 00:00:00 UTC
+EPOCH: float = 1704067200.0
+
+# Smallest jump of the clock: one tick of the host's TimerWheel
+MIN_STEP_SEC: float = 0.001
+
+# Functions of the time module that read or wait on the clock
+_CLOCK_FUNCTIONS = ("time", "time_ns", "monotonic", "monotonic_ns", "perf_counter", "perf_counter_ns", "sleep")
+
+
+class VirtualClock:
+    """Time source of the runner. Call it for the current virtual time.
+
+    Args:
+        start (float): initial virtual time
+        epoch (float): wall-clock time at virtual time 0
+    """
+
+    def __init__(self, start: float = 0.0, epoch: float = EPOCH):
+        self.now = start
+        self.epoch = epoch
+        # Thread running the logic loop. Only its blocking sleeps move the clock
+        self.thread = threading.get_ident()
+        # Number of jumps and virtual seconds skipped by them
+        self.jumps = 0
+        self.skipped = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+    def advance_to(self, when: float):
+        if when > self.now:
+            self.jumps += 1
+            self.skipped += when - self.now
+            self.now = when
+
+    def time_module(self) -> types.ModuleType:
+        """A copy of the ``time`` module whose clock functions read this clock."""
+        shim = types.ModuleType("time")
+        shim.__dict__.update(time.__dict__)
+
+        def wall():
+            return self.epoch + self.now
+
+        def sleep(secs: float):
+            if threading.get_ident() == self.thread:
+                self.advance_to(self.now + secs)
+            else:
+                # Helper threads of the script (log writers) wait in real time
+                time.sleep(secs)
+
+        shim.time = wall
+        shim.time_ns = lambda: int(wall() * 1e9)
+        shim.monotonic = shim.perf_counter = self
+        shim.monotonic_ns = shim.perf_counter_ns = lambda: int(self.now * 1e9)
+        shim.sleep = sleep
+        return shim
+
+    def datetime_class(self) -> type:
+        """A ``datetime`` subclass whose ``now()`` reads this clock."""
+        clock = self
+
+        class VirtualDatetime(_datetime.datetime):
+            @classmethod
+            def now(cls, tz=None):
+                return cls.fromtimestamp(clock.epoch + clock.now, tz)
+
+            @classmethod
+            def utcnow(cls):
+                return cls.fromtimestamp(clock.epoch + clock.now, _datetime.timezone.utc).replace(tzinfo=None)
+
+        return VirtualDatetime
+
+
+def patch_module(module: types.ModuleType, clock: VirtualClock) -> list:
+    """Rebinds the clocks in the globals of a logic script to ``clock``. Returns the patched names."""
+    time_shim = clock.time_module()
+    patched = []
+    for name, value in list(vars(module).items()):
+        if value is time:
+            replacement = time_shim
+        elif value is _datetime:
+            replacement = types.ModuleType("datetime")
+            replacement.__dict__.update(_datetime.__dict__)
+            replacement.datetime = clock.datetime_class()
+        elif value is _datetime.datetime:
+            replacement = clock.datetime_class()
+        elif any(value is getattr(time, func) for func in _CLOCK_FUNCTIONS):
+            # from time import time, monotonic, ...
+            replacement = getattr(time_shim, value.__name__)
+        else:
+            continue
+        setattr(module, name, replacement)
+        patched.append(name)
+    return patched
+
+
+def _noop():
+    pass
+
+
+async def _cancel_pending():
+    tasks = asyncio.all_tasks() - {asyncio.current_task()}
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
+class VirtualTimeLoop(asyncio.SelectorEventLoop):
+    """Event loop on a virtual clock that jumps to the next deadline when idle.
+
+    Args:
+        clock (VirtualClock): the clock, also returned by ``time()``
+        deadlines (Callable): returns the earliest deadline outside the loop, or None
+        on_advance (Callable): called with the new time after every jump
+    """
+
+    def __init__(self, clock: VirtualClock, deadlines=None, on_advance=None):
+        super().__init__()
+        self._virtual_clock = clock
+        self._deadlines = deadlines
+        self._on_advance = on_advance
+        # Idle iterations whose outside deadline was already due, so the clock was moved by MIN_STEP_SEC
+        self.stalls = 0
+
+    def time(self) -> float:
+        return self._virtual_clock.now
+
+    def _run_once(self):
+        # Relies on the ready queue and timer heap of asyncio.BaseEventLoop
+        if not self._ready and not self._stopping:
+            when = self._next_deadline()
+            if when is None:
+                raise RuntimeError("virtual time: the loop is idle and nothing is scheduled")
+            now = self._virtual_clock.now
+            if when <= now and not (self._scheduled and self._scheduled[0]._when <= now):
+                # An outside deadline that stepping the host at ``now`` did not clear: waiting
+                # for it again would spin, so the clock moves on by at least one tick
+                self.stalls += 1
+                when = now + MIN_STEP_SEC
+            if when > now:
+                self._virtual_clock.advance_to(when)
+                if self._on_advance is not None:
+                    self._on_advance(when)
+            if not self._ready:
+                # The deadline was outside the loop: do not let select() wait for the next timer in real time
+                self.call_soon(_noop)
+        super()._run_once()
+
+    def _next_deadline(self) -> float | None:
+        scheduled = self._scheduled
+        while scheduled and scheduled[0]._cancelled:
+            # As BaseEventLoop._run_once drops them
+            heapq.heappop(scheduled)._scheduled = False
+            self._timer_cancelled_count -= 1
+        when = scheduled[0]._when if scheduled else None
+        other = self._deadlines() if self._deadlines is not None else None
+        if other is not None and (when is None or other < when):
+            # Outside deadlines are only seen by the loop through on_advance
+            return other
+        return when
+
+
+class VirtualTimeRunner:
+    """Runs a logic script with its host, cards and emulators in virtual time.
+
+    Args:
+        script_path (str): path of the logic script
+        config_dir (str): config directory, as for ``LogicHost``
+        epoch (float): wall-clock time of the script at virtual time 0
+    """
+
+    def __init__(self, script_path: str, config_dir: str, epoch: float = EPOCH):
+        self.clock = VirtualClock(epoch=epoch)
+        self.host = LogicHost(script_path, config_dir, clock=self.clock)
+        self.host.load()
+        self.patched = patch_module(self.host.module, self.clock)
+        self.updates = 0
+
+    @property
+    def card(self):
+        """The first card of the host, where the emulators usually attach."""
+        return next(iter(self.host.devices.values()))
+
+    def _deadline(self) -> float | None:
+        times = [card.next_deadline() for card in self.host.devices.values()]
+        times.append(self.host.timers.next_deadline())
+        times += [peer.next_deadline() for peer in self.host.peers if hasattr(peer, "next_deadline")]
+        times = [t for t in times if t is not None]
+        return min(times) if times else None
+
+    async def _main(self, duration_sec: float, setup):
+        if setup is not None:
+            await setup(self)
+        end = self.clock.now + duration_sec
+        logic = self.host.logic
+        while self.clock.now < end:
+            now = self.clock.now
+            self.host.step(now)
+            await logic.update()
+            self.updates += 1
+            if self.clock.now == now:
+                # update() polled without waiting: the next poll is one tick later, not at the same instant forever
+                await asyncio.sleep(MIN_STEP_SEC)
+
+    def run(self, duration_sec: float, setup=None) -> dict:
+        """Runs ``update()`` for ``duration_sec`` virtual seconds. Returns the run statistics.
+
+        ``setup`` is an optional ``async def setup(runner)`` awaited first in the loop,
+        e.g. to start tasks that change datarefs at given times.
+        """
+        loop = VirtualTimeLoop(self.clock, self._deadline, self.host.step)
+        start, jumps = self.clock.now, self.clock.jumps
+        t0 = time.perf_counter()
+        try:
+            loop.run_until_complete(self._main(duration_sec, setup))
+        finally:
+            # Transfers the script left running end with the run
+            loop.run_until_complete(_cancel_pending())
+            loop.close()
+        wall = time.perf_counter() - t0
+        return {
+            "virtual_sec": self.clock.now - start,
+            "wall_sec": wall,
+            "speedup": (self.clock.now - start) / wall if wall else None,
+            "jumps": self.clock.jumps - jumps,
+            "stalls": loop.stalls,
+            "updates": self.updates,
+        }
+
+
+def run_script(script_path: str, config_dir: str, duration_sec: float) -> dict:
+    """Runs a logic script with its panel emulator for ``duration_sec`` virtual seconds. Returns the run statistics."""
+    runner = VirtualTimeRunner(script_path, config_dir)
+    emulator = panel_emulators.for_script(runner.card, script_path)
+    if emulator is not None:
+        panel_emulators.attach(runner.host, emulator)
+    stats = runner.run(duration_sec)
+    stats["patched"] = runner.patched
+    if emulator is not None:
+        stats["panel_keys"] = len(emulator.keys)
+        stats["panel_displays"] = len(emulator.displays)
+    return stats
+
+
+def regress(scripts: list, config_dir: str, duration_sec: float, max_wall_sec: float) -> dict:
+    """Runs each script in virtual time and checks it finishes within ``max_wall_sec`` of wall time.
+
+    A run that spins instead of advancing the clock never finishes, so each
+    one runs in a child process that is killed at the budget.
+    """
+    results = {}
+    for script_path in scripts:
+        command = [sys.executable, "-m", "tools.virtual_time", script_path,
+                   "--config", config_dir, "--duration", str(duration_sec)]
+        try:
+            proc = subprocess.run(command, capture_output=True, text=True, timeout=max_wall_sec)
+        except subprocess.TimeoutExpired:
+            results[script_path] = {"ok": False, "error": f"no result after {max_wall_sec} s of wall time"}
+            continue
+        if proc.returncode:
+            results[script_path] = {"ok": False, "error": proc.stderr.strip().splitlines()[-1:]}
+            continue
+        # The statistics are printed last, after whatever the script printed
+        stats = json.loads(proc.stdout[proc.stdout.rindex('{\n  "virtual_sec"'):])
+        results[script_path] = {"ok": True, "wall_sec": stats["wall_sec"], "speedup": stats["speedup"],
+                                "stalls": stats["stalls"]}
+    return results
+
+
+def main(argv: list = None) -> int:
+    parser = argparse.ArgumentParser(description="Runs a logic script with its panel emulator in virtual time")
+    parser.add_argument("scripts", nargs="+", help="logic scripts")
+    parser.add_argument("--config", default="config", help="config directory (default: config)")
+    parser.add_argument("--duration", type=float, default=3600.0, help="virtual seconds (default: 3600)")
+    parser.add_argument("--regress", type=float, metavar="WALL_SEC",
+                        help="run every script and fail the ones that take more than WALL_SEC of wall time")
+    args = parser.parse_args(argv)
+
+    if args.regress is not None:
+        results = regress(args.scripts, args.config, args.duration, args.regress)
+        print(json.dumps(results, indent=2))
+        return 0 if all(r["ok"] for r in results.values()) else 1
+    if len(args.scripts) > 1:
+        parser.error("one script at a time, or --regress")
+    print(json.dumps(run_script(args.scripts[0], args.config, args.duration), indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())